@@ -0,0 +1,305 @@
+// checkpoint.cpp -- save and restore the complete simulation state
+
+// When p.checkpointStride > 0, simulator() calls saveCheckpoint() at every
+// generation boundary where the number of the generation just completed
+// modulo checkpointStride == 0. The checkpoint holds everything the next
+// generation depends on: the new population (peeps, including genomes and
+// neural nets), the grid with its barriers, the signal layers, the number
+// of the next generation, the RNG state of every thread, and the size of
+// the epoch log and of the fingerprint file at that moment. It is written to <logDir>/checkpoint.bin.tmp
+// and then renamed over <logDir>/checkpoint.bin, so a crash while writing
+// leaves the previous checkpoint intact.
+//
+// To resume, pass the checkpoint file as the second command line argument:
+//
+//     ./bin/Release/biosim4 biosim4.ini logs/checkpoint.bin
+//
+// loadCheckpoint() restores the state and truncates the epoch log to the
+// size it had at the checkpoint, dropping the lines of generations that
+// are about to be simulated again. With deterministic = true and the same
+// numThreads, a resumed run produces the same results as an uninterrupted
+// one. The file is a plain binary dump for the machine that wrote it; it
+// is not meant to be portable.
+
+#include <iostream>
+#include <fstream>
+#include <vector>
+#include <string>
+#include <cstdio>
+#include <cstdlib>
+#include <cstdint>
+#include <cstring>
+#include <type_traits>
+#include <utility>
+#include <unistd.h>
+#include "simulator.h"
+
+namespace BS {
+
+constexpr char CHECKPOINT_MAGIC[8] = "BS4CKPT";
+constexpr uint32_t CHECKPOINT_VERSION = 2;
+
+static_assert(std::is_trivially_copyable<RandomUintGenerator>::value, "RNG state is saved as raw bytes");
+static_assert(std::is_trivially_copyable<Gene>::value, "genes are saved as raw bytes");
+static_assert(std::is_trivially_copyable<Coord>::value, "coords are saved as raw bytes");
+
+
+template <typename T>
+static void put(std::ostream &out, const T &value)
+{
+    static_assert(std::is_trivially_copyable<T>::value, "raw write");
+    out.write(reinterpret_cast<const char *>(&value), sizeof(T));
+}
+
+
+template <typename T>
+static void putVector(std::ostream &out, const std::vector<T> &values)
+{
+    static_assert(std::is_trivially_copyable<T>::value, "raw write");
+    put(out, uint64_t(values.size()));
+    out.write(reinterpret_cast<const char *>(values.data()), values.size() * sizeof(T));
+}
+
+
+template <typename T>
+static void get(std::istream &in, T &value)
+{
+    static_assert(std::is_trivially_copyable<T>::value, "raw read");
+    in.read(reinterpret_cast<char *>(&value), sizeof(T));
+}
+
+
+template <typename T>
+static void getVector(std::istream &in, std::vector<T> &values)
+{
+    static_assert(std::is_trivially_copyable<T>::value, "raw read");
+    uint64_t size = 0;
+    get(in, size);
+    if (!in || size > (1ULL << 32)) {
+        in.setstate(std::ios::failbit);
+        return;
+    }
+    values.resize(size);
+    in.read(reinterpret_cast<char *>(values.data()), size * sizeof(T));
+}
+
+
+static std::string epochLogPath()
+{
+    return p.logDir + "/epoch-log.txt";
+}
+
+
+static std::string fingerprintsPath()
+{
+    return p.logDir + "/fingerprints.txt";
+}
+
+
+static uint64_t fileSize(const std::string &path)
+{
+    std::ifstream in(path, std::ios::binary | std::ios::ate);
+    return in ? uint64_t(in.tellg()) : 0;
+}
+
+
+// Called in single-thread mode between generations, after spawnNewGeneration().
+// threadRngs holds a copy of each thread's randomUint.
+void saveCheckpoint(unsigned nextGeneration, const std::vector<RandomUintGenerator> &threadRngs)
+{
+    const std::string path = p.logDir + "/checkpoint.bin";
+    const std::string tmpPath = path + ".tmp";
+
+    std::ofstream out(tmpPath, std::ios::binary | std::ios::trunc);
+    if (!out) {
+        std::cerr << "Cannot write checkpoint " << tmpPath << std::endl;
+        return;
+    }
+
+    out.write(CHECKPOINT_MAGIC, sizeof(CHECKPOINT_MAGIC));
+    put(out, CHECKPOINT_VERSION);
+    put(out, uint32_t(nextGeneration));
+    put(out, uint32_t(p.population));
+    put(out, uint16_t(p.sizeX));
+    put(out, uint16_t(p.sizeY));
+    put(out, uint32_t(p.signalLayers));
+    put(out, fileSize(epochLogPath()));
+    put(out, fileSize(fingerprintsPath()));
+    putVector(out, threadRngs);
+
+    // grid
+    std::vector<uint16_t> column(p.sizeY);
+    for (unsigned x = 0; x < p.sizeX; ++x) {
+        for (unsigned y = 0; y < p.sizeY; ++y) {
+            column[y] = grid.at(x, y);
+        }
+        out.write(reinterpret_cast<const char *>(column.data()), column.size() * sizeof(uint16_t));
+    }
+    putVector(out, grid.getBarrierLocations());
+    putVector(out, grid.getBarrierCenters());
+
+    // signals
+    std::vector<uint8_t> signalColumn(p.sizeY);
+    for (unsigned layer = 0; layer < p.signalLayers; ++layer) {
+        for (unsigned x = 0; x < p.sizeX; ++x) {
+            for (unsigned y = 0; y < p.sizeY; ++y) {
+                signalColumn[y] = signals[layer][x][y];
+            }
+            out.write(reinterpret_cast<const char *>(signalColumn.data()), signalColumn.size());
+        }
+    }
+
+    // peeps
+    for (unsigned index = 1; index <= p.population; ++index) {
+        const Indiv &indiv = peeps[index];
+        put(out, uint8_t(indiv.alive));
+        put(out, indiv.index);
+        put(out, indiv.loc);
+        put(out, indiv.birthLoc);
+        put(out, uint32_t(indiv.age));
+        put(out, indiv.responsiveness);
+        put(out, uint32_t(indiv.oscPeriod));
+        put(out, uint32_t(indiv.longProbeDist));
+        put(out, indiv.lastMoveDir.asInt());
+        put(out, uint32_t(indiv.challengeBits));
+        putVector(out, indiv.genome);
+        putVector(out, indiv.nnet.connections);
+        put(out, uint64_t(indiv.nnet.neurons.size()));
+        for (const NeuralNet::Neuron &neuron : indiv.nnet.neurons) {
+            put(out, neuron.output);
+            put(out, uint8_t(neuron.driven));
+        }
+    }
+
+    out.close();
+    if (!out) {
+        std::cerr << "Error writing checkpoint " << tmpPath << std::endl;
+        std::remove(tmpPath.c_str());
+        return;
+    }
+    std::rename(tmpPath.c_str(), path.c_str());
+}
+
+
+static void failResume(const std::string &path, const std::string &why)
+{
+    std::cerr << "Cannot resume from " << path << ": " << why << std::endl;
+    std::exit(1);
+}
+
+
+// Restores the state saved by saveCheckpoint() into the already allocated
+// grid, signals and peeps containers. Returns the number of the generation
+// to simulate next and fills threadRngs with the saved RNG states.
+unsigned loadCheckpoint(const std::string &path, std::vector<RandomUintGenerator> &threadRngs)
+{
+    std::ifstream in(path, std::ios::binary);
+    if (!in) {
+        failResume(path, "cannot open the file");
+    }
+
+    char magic[sizeof(CHECKPOINT_MAGIC)];
+    uint32_t version, nextGeneration, population, signalLayers;
+    uint16_t sizeX, sizeY;
+    uint64_t epochLogSize, fingerprintsSize;
+    in.read(magic, sizeof(magic));
+    get(in, version);
+    if (!in || std::memcmp(magic, CHECKPOINT_MAGIC, sizeof(magic)) != 0 || version != CHECKPOINT_VERSION) {
+        failResume(path, "not a checkpoint of this version of biosim4");
+    }
+    get(in, nextGeneration);
+    get(in, population);
+    get(in, sizeX);
+    get(in, sizeY);
+    get(in, signalLayers);
+    get(in, epochLogSize);
+    get(in, fingerprintsSize);
+    if (population != p.population || sizeX != p.sizeX || sizeY != p.sizeY || signalLayers != p.signalLayers) {
+        failResume(path, "population, sizeX, sizeY and signalLayers must match the checkpoint");
+    }
+    getVector(in, threadRngs);
+    if (threadRngs.size() != p.numThreads) {
+        std::cerr << "Warning: the checkpoint was written with numThreads = " << threadRngs.size()
+                  << ", results will differ from an uninterrupted run" << std::endl;
+    }
+
+    std::vector<uint16_t> column(p.sizeY);
+    for (unsigned x = 0; x < p.sizeX; ++x) {
+        in.read(reinterpret_cast<char *>(column.data()), column.size() * sizeof(uint16_t));
+        for (unsigned y = 0; y < p.sizeY; ++y) {
+            grid.set(x, y, column[y]);
+        }
+    }
+    std::vector<Coord> barrierLocations, barrierCenters;
+    getVector(in, barrierLocations);
+    getVector(in, barrierCenters);
+    grid.restoreBarriers(std::move(barrierLocations), std::move(barrierCenters));
+
+    std::vector<uint8_t> signalColumn(p.sizeY);
+    for (unsigned layer = 0; layer < p.signalLayers; ++layer) {
+        for (unsigned x = 0; x < p.sizeX; ++x) {
+            in.read(reinterpret_cast<char *>(signalColumn.data()), signalColumn.size());
+            for (unsigned y = 0; y < p.sizeY; ++y) {
+                signals[layer][x][y] = signalColumn[y];
+            }
+        }
+    }
+
+    for (unsigned index = 1; index <= p.population; ++index) {
+        Indiv &indiv = peeps[index];
+        uint8_t alive, lastMoveDir;
+        uint32_t age, oscPeriod, longProbeDist, challengeBits;
+        uint64_t numNeurons = 0;
+        get(in, alive);
+        get(in, indiv.index);
+        get(in, indiv.loc);
+        get(in, indiv.birthLoc);
+        get(in, age);
+        get(in, indiv.responsiveness);
+        get(in, oscPeriod);
+        get(in, longProbeDist);
+        get(in, lastMoveDir);
+        get(in, challengeBits);
+        indiv.alive = alive;
+        indiv.age = age;
+        indiv.oscPeriod = oscPeriod;
+        indiv.longProbeDist = longProbeDist;
+        indiv.lastMoveDir = Dir((Compass)lastMoveDir);
+        indiv.challengeBits = challengeBits;
+        getVector(in, indiv.genome);
+        getVector(in, indiv.nnet.connections);
+        get(in, numNeurons);
+        if (!in || numNeurons > 0x10000) {
+            failResume(path, "truncated or corrupt file");
+        }
+        indiv.nnet.neurons.resize(numNeurons);
+        for (NeuralNet::Neuron &neuron : indiv.nnet.neurons) {
+            uint8_t driven;
+            get(in, neuron.output);
+            get(in, driven);
+            neuron.driven = driven;
+        }
+    }
+
+    if (!in) {
+        failResume(path, "truncated or corrupt file");
+    }
+
+    // Forget the generations that will be simulated again
+    const std::pair<std::string, uint64_t> logs[] = {
+        { epochLogPath(), epochLogSize },
+        { fingerprintsPath(), fingerprintsSize },
+    };
+    for (const auto &log : logs) {
+        if (fileSize(log.first) > log.second) {
+            if (truncate(log.first.c_str(), log.second) != 0) {
+                std::cerr << "Warning: cannot truncate " << log.first << std::endl;
+            }
+        }
+    }
+
+    std::cout << "Resuming at generation " << nextGeneration << " from " << path << std::endl;
+    return nextGeneration;
+}
+
+} // end namespace BS
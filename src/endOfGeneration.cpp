@@ -10,8 +10,15 @@
 
 namespace BS {
 
-// At the end of each generation, we save a video file (if p.saveVideo is true) and
-// print some genomic statistics to stdout (if p.updateGraphLog is true).
+extern void saveSnapshot(unsigned generation);
+extern void saveGenerationTrajectory(unsigned generation);
+extern void saveFingerprint(unsigned generation);
+
+// At the end of each generation, we save a video file (if p.saveVideo is true),
+// complete the trajectory file (if p.saveTrajectory is true),
+// print some genomic statistics to stdout (if p.updateGraphLog is true),
+// write a population snapshot (if p.snapshotStride is nonzero), and append
+// a state fingerprint (if p.saveFingerprints is true).
 
 void endOfGeneration(unsigned generation)
 {
@@ -23,6 +30,9 @@ void endOfGeneration(unsigned generation)
                      && generation <= p.replaceBarrierTypeGenerationNumber + p.videoSaveFirstFrames))) {
             imageWriter.saveGenerationVideo(generation);
         }
+        if (p.saveTrajectory) {
+            saveGenerationTrajectory(generation);
+        }
     }
 
     {
@@ -31,6 +41,18 @@ void endOfGeneration(unsigned generation)
             std::system(p.graphLogUpdateCommand.c_str());
         }
     }
+
+    {
+        if (p.snapshotStride > 0 && (generation % p.snapshotStride) == 0) {
+            saveSnapshot(generation);
+        }
+    }
+
+    {
+        if (p.saveFingerprints) {
+            saveFingerprint(generation);
+        }
+    }
 }
 
 } // end namespace BS
@@ -18,9 +18,12 @@ mode to take care of several things:
 4. We then drain the deferred movement queue.
 5. We fade the signal layer(s) (pheromones).
 6. We save the resulting world condition as a single image frame (if
-   p.saveVideo is true).
+   p.saveVideo is true) and/or as a trajectory frame (if p.saveTrajectory
+   is true).
 */
 
+extern void saveTrajectoryFrame(unsigned simStep, unsigned generation);
+
 void endOfSimStep(unsigned simStep, unsigned generation)
 {
     if (p.challenge == CHALLENGE_RADIOACTIVE_WALLS) {
@@ -80,12 +83,15 @@ void endOfSimStep(unsigned simStep, unsigned generation)
     signals.fade(0); // takes layerNum  todo!!!
 
     // saveVideoFrameSync() is the synchronous version of saveVideFrame()
-    if (p.saveVideo &&
+    if ((p.saveVideo || p.saveTrajectory) &&
                 ((generation % p.videoStride) == 0
                  || generation <= p.videoSaveFirstFrames
                  || (generation >= p.replaceBarrierTypeGenerationNumber
                      && generation <= p.replaceBarrierTypeGenerationNumber + p.videoSaveFirstFrames))) {
-        if (!imageWriter.saveVideoFrameSync(simStep, generation)) {
+        if (p.saveTrajectory) {
+            saveTrajectoryFrame(simStep, generation);
+        }
+        if (p.saveVideo && !imageWriter.saveVideoFrameSync(simStep, generation)) {
             std::cout << "imageWriter busy" << std::endl;
         }
     }
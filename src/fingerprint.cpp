@@ -0,0 +1,102 @@
+// fingerprint.cpp -- per-generation hash of the simulation state
+
+// When p.saveFingerprints is true, endOfGeneration() appends one line per
+// generation to <logDir>/fingerprints.txt:
+//
+//     <generation> <64-bit hash as 16 hex digits>
+//
+// The hash covers the state at the end of the generation's last sim step:
+// the alive flag, location and genome of every individual, and every signal
+// layer. With deterministic = true and numThreads = 1, two runs with the same
+// parameters and the same simulator behavior produce identical lines, and the
+// first line that differs names the first generation whose state differs.
+// tests/testapp.py compares the lines of a running test against a golden
+// file and stops the simulation at the first difference.
+//
+// The file is emptied when a run starts at generation 0. Unlike the epoch
+// log, it is not emptied when the population goes extinct and the
+// simulation starts over, so the lines are the complete sequence of
+// generations simulated. loadCheckpoint() truncates it to its size at the
+// checkpoint, dropping the generations a resumed run simulates again.
+
+#include <iostream>
+#include <fstream>
+#include <iomanip>
+#include <string>
+#include <cstdint>
+#include "simulator.h"
+
+namespace BS {
+
+// Word-wise FNV-1a. Each step h = (h ^ v) * prime is a bijection of h for a
+// given v and of v for a given h, so changing any single value always
+// changes the result.
+static inline void mix(uint64_t &h, uint64_t v)
+{
+    h = (h ^ v) * 0x100000001b3ULL;
+}
+
+
+static uint64_t stateFingerprint(unsigned generation)
+{
+    uint64_t h = 0xcbf29ce484222325ULL;
+    mix(h, generation);
+    mix(h, p.population);
+
+    for (unsigned index = 1; index <= p.population; ++index) {
+        const Indiv &indiv = peeps[index];
+        mix(h, uint64_t(indiv.alive) | (uint64_t(uint16_t(indiv.loc.x)) << 8) | (uint64_t(uint16_t(indiv.loc.y)) << 24));
+        mix(h, indiv.genome.size());
+        // the gene fields, not the bytes of the bit fields, so the hash
+        // does not depend on how the compiler lays them out
+        for (const Gene &gene : indiv.genome) {
+            mix(h, uint64_t(gene.sourceType) | (uint64_t(gene.sourceNum) << 1)
+                   | (uint64_t(gene.sinkType) << 8) | (uint64_t(gene.sinkNum) << 9)
+                   | (uint64_t(uint16_t(gene.weight)) << 16));
+        }
+    }
+
+    for (unsigned layer = 0; layer < p.signalLayers; ++layer) {
+        for (unsigned x = 0; x < p.sizeX; ++x) {
+            // eight cells per step
+            uint64_t word = 0;
+            unsigned y = 0;
+            for (; y < p.sizeY; ++y) {
+                word = (word << 8) | signals[layer][x][y];
+                if ((y & 7) == 7) {
+                    mix(h, word);
+                    word = 0;
+                }
+            }
+            if ((y & 7) != 0) {
+                mix(h, word);
+            }
+        }
+    }
+
+    return h;
+}
+
+
+// Called from endOfGeneration() in single-thread mode.
+void saveFingerprint(unsigned generation)
+{
+    static bool firstCall = true;
+    const std::string path = p.logDir + "/fingerprints.txt";
+
+    // a resumed run starts after generation 0 and keeps the file
+    if (firstCall && generation == 0) {
+        std::ofstream(path, std::ios::trunc).close();
+    }
+    firstCall = false;
+
+    std::ofstream out(path, std::ios::app);
+    if (!out) {
+        std::cerr << "Cannot write " << path << std::endl;
+        return;
+    }
+    out << generation << ' ' << std::hex << std::setfill('0') << std::setw(16)
+        << stateFingerprint(generation) << std::endl;
+}
+
+} // end namespace BS
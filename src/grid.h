@@ -5,6 +5,7 @@
 
 #include <cstdint>
 #include <vector>
+#include <utility>
 #include <functional>
 #include "basicTypes.h"
 
@@ -54,6 +55,9 @@ public:
     void createBarrier(unsigned barrierType);
     const std::vector<Coord> &getBarrierLocations() const { return barrierLocations; }
     const std::vector<Coord> &getBarrierCenters() const { return barrierCenters; }
+    // Used when resuming from a checkpoint; the grid data itself is restored with set()
+    void restoreBarriers(std::vector<Coord> &&locations, std::vector<Coord> &&centers)
+        { barrierLocations = std::move(locations); barrierCenters = std::move(centers); }
     // Direct access:
     Column & operator[](uint16_t columnXNum) { return data[columnXNum]; }
     const Column & operator[](uint16_t columnXNum) const { return data[columnXNum]; }
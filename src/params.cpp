@@ -54,12 +54,16 @@ void ParamManager::setDefaults()
     privParams.shortProbeBarrierDistance = 4;
     privParams.valenceSaturationMag = 0.5;
     privParams.saveVideo = true;
+    privParams.saveTrajectory = false;
     privParams.videoStride = 25;
     privParams.videoSaveFirstFrames = 2;
     privParams.displayScale = 8;
     privParams.agentSize = 4;
     privParams.genomeAnalysisStride = privParams.videoStride;
     privParams.displaySampleGenomes = 5;
+    privParams.snapshotStride = 0;
+    privParams.checkpointStride = 0;
+    privParams.saveFingerprints = false;
     privParams.genomeComparisonMethod = 1;
     privParams.updateGraphLog = true;
     privParams.updateGraphLogStride = privParams.videoStride;
@@ -72,6 +76,7 @@ void ParamManager::setDefaults()
 void ParamManager::registerConfigFile(const char *filename)
 {
     configFilename = std::string(filename);
+    configRead = false;
 }
 
 
@@ -228,6 +233,9 @@ void ParamManager::ingestParameter(std::string name, std::string val)
         else if (name == "savevideo" && isBool) {
             privParams.saveVideo = bVal; break;
         }
+        else if (name == "savetrajectory" && isBool) {
+            privParams.saveTrajectory = bVal; break;
+        }
         else if (name == "videostride" && isUint && uVal > 0) {
             privParams.videoStride = uVal; break;
         }
@@ -249,6 +257,15 @@ void ParamManager::ingestParameter(std::string name, std::string val)
         else if (name == "displaysamplegenomes" && isUint) {
             privParams.displaySampleGenomes = uVal; break;
         }
+        else if (name == "snapshotstride" && isUint) {
+            privParams.snapshotStride = uVal; break;
+        }
+        else if (name == "checkpointstride" && isUint) {
+            privParams.checkpointStride = uVal; break;
+        }
+        else if (name == "savefingerprints" && isBool) {
+            privParams.saveFingerprints = bVal; break;
+        }
         else if (name == "genomecomparisonmethod" && isUint) {
             privParams.genomeComparisonMethod = uVal; break;
         }
@@ -274,8 +291,23 @@ void ParamManager::ingestParameter(std::string name, std::string val)
 }
 
 
+// Called after every generation, so the file is only parsed again when it
+// was changed or replaced since the last read. Replacing the file with
+// rename() is the safe way to change parameters of a running simulation.
 void ParamManager::updateFromConfigFile()
 {
+    struct stat st;
+    if (stat(configFilename.c_str(), &st) == 0) {
+        if (configRead && st.st_ino == lastInode && st.st_size == lastSize
+                && st.st_mtim.tv_sec == lastModTime.tv_sec && st.st_mtim.tv_nsec == lastModTime.tv_nsec) {
+            return;
+        }
+        configRead = true;
+        lastInode = st.st_ino;
+        lastSize = st.st_size;
+        lastModTime = st.st_mtim;
+    }
+
     // std::ifstream is RAII, i.e. no need to call close
     std::ifstream cFile(configFilename.c_str());
     if (cFile.is_open()) {
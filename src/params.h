@@ -4,6 +4,7 @@
 // Global simulator parameters
 
 #include <string>
+#include <sys/stat.h>
 
 // To add a new parameter:
 //    1. Add a member to struct Params in params.h.
@@ -43,12 +44,16 @@ struct Params {
     unsigned shortProbeBarrierDistance; // > 0
     float valenceSaturationMag;
     bool saveVideo;
+    bool saveTrajectory;
     unsigned videoStride; // > 0
     unsigned videoSaveFirstFrames; // >= 0, overrides videoStride
     unsigned displayScale;
     unsigned agentSize;
     unsigned genomeAnalysisStride; // > 0
     unsigned displaySampleGenomes; // >= 0
+    unsigned snapshotStride; // 0 = no snapshots
+    unsigned checkpointStride; // 0 = no checkpoints
+    bool saveFingerprints;
     unsigned genomeComparisonMethod; // 0 = Jaro-Winkler; 1 = Hamming
     bool updateGraphLog;
     unsigned updateGraphLogStride; // > 0
@@ -79,7 +84,12 @@ public:
 private:
     Params privParams;
     std::string configFilename;
-    time_t lastModTime; // when config file was last read
+    // Identity of the config file when it was last read; the file is parsed
+    // again only when its inode, size or modification time differ
+    bool configRead;
+    ino_t lastInode;
+    off_t lastSize;
+    struct timespec lastModTime;
     void ingestParameter(std::string name, std::string val);
 };
 
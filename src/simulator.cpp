@@ -6,16 +6,19 @@
 // config file ("biosim4.ini" in the current directory) to get the simulation
 // parameters for this run. If there are one or more command line args, then
 // argv[1] must contain the name of the config file which will be read instead
-// of biosim4.ini. Any args after that are ignored. The simulator code is
-// in namespace BS (for "biosim").
+// of biosim4.ini. If there is a second argument, it is the name of a checkpoint
+// file (see checkpoint.cpp) to resume the simulation from. Any args after that
+// are ignored. The simulator code is in namespace BS (for "biosim").
 
 #include <iostream>
+#include <vector>
 #include <chrono>
 #include <cassert>
 #include <utility>
 #include <algorithm>
 #include "simulator.h"     // the simulator data structures
 #include "imageWriter.h"   // this is for generating the movies
+#include "omp.h"
 
 namespace BS {
 
@@ -25,6 +28,8 @@ extern void displaySampleGenomes(unsigned count);
 extern void executeActions(Indiv &indiv, std::array<float, Action::NUM_ACTIONS> &actionLevels);
 extern void endOfSimStep(unsigned simStep, unsigned generation);
 extern void endOfGeneration(unsigned generation);
+extern void saveCheckpoint(unsigned nextGeneration, const std::vector<RandomUintGenerator> &threadRngs);
+extern unsigned loadCheckpoint(const std::string &path, std::vector<RandomUintGenerator> &threadRngs);
 
 RunMode runMode = RunMode::STOP;
 Grid grid;        // The 2D world where the creatures live
@@ -129,8 +134,23 @@ void simulator(int argc, char **argv)
     //unitTestConnectNeuralNetWiringFromGenome();
     //unitTestGridVisitNeighborhood();
 
+    // Each thread's RNG state is collected here for checkpoints, or
+    // restored from here when resuming.
+    std::vector<RandomUintGenerator> threadRngs(p.numThreads);
+    bool resuming = argc > 2;
+    bool checkpointDue = false;
+    unsigned restoredRngs = 0; // threads whose RNG state comes from the checkpoint
+
     unsigned generation = 0;
-    initializeGeneration0(); // starting population
+    if (resuming) {
+        generation = loadCheckpoint(argv[2], threadRngs);
+        // The checkpoint may hold fewer or more RNGs than there are threads now;
+        // every thread stores its state in threadRngs at the next checkpoint.
+        restoredRngs = std::min<size_t>(threadRngs.size(), p.numThreads);
+        threadRngs.resize(p.numThreads);
+    } else {
+        initializeGeneration0(); // starting population
+    }
     runMode = RunMode::RUN;
     unsigned murderCount;
 
@@ -139,6 +159,9 @@ void simulator(int argc, char **argv)
     #pragma omp parallel num_threads(p.numThreads) default(shared)
     {
         randomUint.initialize(); // seed the RNG, each thread has a private instance
+        if ((unsigned)omp_get_thread_num() < restoredRngs) {
+            randomUint = threadRngs[omp_get_thread_num()];
+        }
 
         while (runMode == RunMode::RUN && generation < p.maxGenerations) { // generation loop
             #pragma omp single
@@ -171,12 +194,23 @@ void simulator(int argc, char **argv)
                 if (numberSurvivors > 0 && (generation % p.genomeAnalysisStride == 0)) {
                     displaySampleGenomes(p.displaySampleGenomes);
                 }
+                checkpointDue = numberSurvivors > 0 && p.checkpointStride > 0
+                                && (generation % p.checkpointStride) == 0;
                 if (numberSurvivors == 0) {
                     generation = 0;  // start over
                 } else {
                     ++generation;
                 }
             }
+
+            // The checkpoint needs the RNG state of every thread, so each
+            // thread saves its own before one of them writes the file.
+            if (checkpointDue) {
+                threadRngs[omp_get_thread_num()] = randomUint;
+                #pragma omp barrier
+                #pragma omp single
+                saveCheckpoint(generation, threadRngs);
+            }
         }
     }
     displaySampleGenomes(3); // final report, for debugging
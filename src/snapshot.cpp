@@ -0,0 +1,173 @@
+// snapshot.cpp -- binary population snapshots
+
+// saveSnapshot() writes the complete state of the population at the end of
+// a generation to <logDir>/snapshot-NNNNNN.bin: every individual's location,
+// birth location, age, alive flag and genome, plus the grid and the signal
+// layers. The layout is fixed so that it can be memory-mapped without
+// parsing (see tests/pylib/snapshot.py). All values are little-endian (the
+// byte order of the machines the simulator runs on) and every section
+// starts at a multiple of 8 bytes:
+//
+//     SnapshotHeader                      96 bytes
+//     SnapshotIndiv[population]           16 bytes each, peeps[1..population]
+//     uint64_t genomeOffsets[population + 1]
+//                                         genes of individual i (0-based) are
+//                                         genes[genomeOffsets[i]..genomeOffsets[i + 1])
+//     uint32_t genes[numGenes]            raw Gene words, as printGenome() prints them
+//     uint16_t grid[sizeX][sizeY]         EMPTY, BARRIER or an individual's index
+//     uint8_t signals[signalLayers][sizeX][sizeY]
+
+#include <iostream>
+#include <fstream>
+#include <sstream>
+#include <iomanip>
+#include <vector>
+#include <cstdio>
+#include <cstring>
+#include <cstdint>
+#include "simulator.h"
+
+namespace BS {
+
+constexpr uint32_t SNAPSHOT_VERSION = 1;
+
+struct SnapshotHeader {
+    char magic[8];            // "BS4SNAP" plus a terminating 0
+    uint32_t version;
+    uint32_t generation;
+    uint32_t population;
+    uint16_t sizeX;
+    uint16_t sizeY;
+    uint16_t signalLayers;
+    uint16_t reserved0;
+    uint32_t reserved1;
+    uint64_t numGenes;
+    uint64_t indivOffset;     // byte offsets of the sections from the start of the file
+    uint64_t genomeOffsetsOffset;
+    uint64_t genesOffset;
+    uint64_t gridOffset;
+    uint64_t signalsOffset;
+    uint64_t fileSize;
+    uint64_t reserved2;
+};
+static_assert(sizeof(SnapshotHeader) == 96, "snapshot header layout");
+
+struct SnapshotIndiv {
+    int16_t x;
+    int16_t y;
+    int16_t birthX;
+    int16_t birthY;
+    uint32_t age;
+    uint8_t alive;
+    uint8_t reserved[3];
+};
+static_assert(sizeof(SnapshotIndiv) == 16, "snapshot indiv layout");
+
+
+static uint64_t align8(uint64_t offset)
+{
+    return (offset + 7) & ~uint64_t(7);
+}
+
+
+static void pad(std::ofstream &out, uint64_t from, uint64_t to)
+{
+    static const char zeros[8] = { 0 };
+    out.write(zeros, to - from);
+}
+
+
+// Called at the end of a generation, in single-thread mode.
+void saveSnapshot(unsigned generation)
+{
+    std::stringstream name;
+    name << p.logDir << "/snapshot-" << std::setfill('0') << std::setw(6) << generation << ".bin";
+    const std::string path = name.str();
+    const std::string tmpPath = path + ".tmp";
+
+    SnapshotHeader header;
+    std::memset(&header, 0, sizeof(header));
+    std::strcpy(header.magic, "BS4SNAP");
+    header.version = SNAPSHOT_VERSION;
+    header.generation = generation;
+    header.population = p.population;
+    header.sizeX = p.sizeX;
+    header.sizeY = p.sizeY;
+    header.signalLayers = p.signalLayers;
+
+    std::vector<SnapshotIndiv> indivs(p.population);
+    std::vector<uint64_t> genomeOffsets(p.population + 1, 0);
+    for (unsigned index = 1; index <= p.population; ++index) {
+        const Indiv &indiv = peeps[index];
+        SnapshotIndiv &rec = indivs[index - 1];
+        std::memset(&rec, 0, sizeof(rec));
+        rec.x = indiv.loc.x;
+        rec.y = indiv.loc.y;
+        // as the simulator has it; Indiv::initialize() doesn't set it
+        rec.birthX = indiv.birthLoc.x;
+        rec.birthY = indiv.birthLoc.y;
+        rec.age = indiv.age;
+        rec.alive = indiv.alive;
+        genomeOffsets[index] = genomeOffsets[index - 1] + indiv.genome.size();
+    }
+    header.numGenes = genomeOffsets[p.population];
+
+    header.indivOffset = sizeof(header);
+    header.genomeOffsetsOffset = align8(header.indivOffset + indivs.size() * sizeof(SnapshotIndiv));
+    header.genesOffset = align8(header.genomeOffsetsOffset + genomeOffsets.size() * sizeof(uint64_t));
+    header.gridOffset = align8(header.genesOffset + header.numGenes * sizeof(Gene));
+    header.signalsOffset = align8(header.gridOffset + uint64_t(p.sizeX) * p.sizeY * sizeof(uint16_t));
+    header.fileSize = align8(header.signalsOffset + uint64_t(p.signalLayers) * p.sizeX * p.sizeY);
+
+    std::ofstream out(tmpPath, std::ios::binary | std::ios::trunc);
+    if (!out) {
+        std::cerr << "Cannot write snapshot " << tmpPath << std::endl;
+        return;
+    }
+
+    out.write(reinterpret_cast<const char *>(&header), sizeof(header));
+    out.write(reinterpret_cast<const char *>(indivs.data()), indivs.size() * sizeof(SnapshotIndiv));
+    pad(out, header.indivOffset + indivs.size() * sizeof(SnapshotIndiv), header.genomeOffsetsOffset);
+    out.write(reinterpret_cast<const char *>(genomeOffsets.data()), genomeOffsets.size() * sizeof(uint64_t));
+    pad(out, header.genomeOffsetsOffset + genomeOffsets.size() * sizeof(uint64_t), header.genesOffset);
+
+    static_assert(sizeof(Gene) == sizeof(uint32_t), "a Gene is one 32-bit word");
+    for (unsigned index = 1; index <= p.population; ++index) {
+        const Genome &genome = peeps[index].genome;
+        out.write(reinterpret_cast<const char *>(genome.data()), genome.size() * sizeof(Gene));
+    }
+    pad(out, header.genesOffset + header.numGenes * sizeof(Gene), header.gridOffset);
+
+    // Grid and Signals store one column (all y of one x) contiguously
+    std::vector<uint16_t> gridColumn(p.sizeY);
+    for (unsigned x = 0; x < p.sizeX; ++x) {
+        for (unsigned y = 0; y < p.sizeY; ++y) {
+            gridColumn[y] = grid.at(x, y);
+        }
+        out.write(reinterpret_cast<const char *>(gridColumn.data()), gridColumn.size() * sizeof(uint16_t));
+    }
+    pad(out, header.gridOffset + uint64_t(p.sizeX) * p.sizeY * sizeof(uint16_t), header.signalsOffset);
+
+    std::vector<uint8_t> signalColumn(p.sizeY);
+    for (unsigned layer = 0; layer < p.signalLayers; ++layer) {
+        for (unsigned x = 0; x < p.sizeX; ++x) {
+            for (unsigned y = 0; y < p.sizeY; ++y) {
+                signalColumn[y] = signals[layer][x][y];
+            }
+            out.write(reinterpret_cast<const char *>(signalColumn.data()), signalColumn.size());
+        }
+    }
+    pad(out, header.signalsOffset + uint64_t(p.signalLayers) * p.sizeX * p.sizeY, header.fileSize);
+
+    out.close();
+    if (!out) {
+        std::cerr << "Error writing snapshot " << tmpPath << std::endl;
+        std::remove(tmpPath.c_str());
+        return;
+    }
+
+    // readers never see a partial snapshot
+    std::rename(tmpPath.c_str(), path.c_str());
+}
+
+} // end namespace BS
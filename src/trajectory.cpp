@@ -0,0 +1,157 @@
+// trajectory.cpp -- compact per-step recording of agent positions
+
+// When p.saveTrajectory is true, every sim step of the generations that
+// would get a video (see videoStride and videoSaveFirstFrames) is appended
+// to <imageDir>/gen-NNNNNN.traj instead of being drawn. Only what changed
+// since the previous step is recorded, so a step costs one pass over peeps
+// plus a few bytes per moved agent. tools/render-trajectory.py turns the
+// files into PNG frames and videos offline; tests/pylib/trajectory.py reads
+// them for analysis.
+//
+// File layout, little-endian:
+//
+//     char magic[8]               "BS4TRAJ" plus a terminating 0
+//     uint32_t version
+//     uint32_t generation
+//     uint16_t sizeX, sizeY
+//     uint32_t population
+//     uint32_t numBarriers
+//     Coord barriers[numBarriers] int16_t x, y
+//
+// followed by one frame per sim step:
+//
+//     uint32_t simStep
+//     uint32_t numRecords
+//     TrajectoryRecord records[numRecords]
+//
+// The first frame of a file lists every living agent. Later frames list
+// only the agents that moved, and those that died (flag TRAJECTORY_DIED).
+// An agent's color (see makeGeneticColor()) never changes during a
+// generation but is repeated in every record.
+
+#include <iostream>
+#include <fstream>
+#include <sstream>
+#include <iomanip>
+#include <vector>
+#include <cstdio>
+#include <cstdint>
+#include "simulator.h"
+
+namespace BS {
+
+extern uint8_t makeGeneticColor(const Genome &genome);
+
+constexpr uint32_t TRAJECTORY_VERSION = 1;
+constexpr uint8_t TRAJECTORY_DIED = 1;
+
+struct TrajectoryRecord {
+    uint16_t index;
+    int16_t x;
+    int16_t y;
+    uint8_t color;
+    uint8_t flags;
+};
+static_assert(sizeof(TrajectoryRecord) == 8, "trajectory record layout");
+
+
+// The open trajectory file and the last recorded state of every agent.
+static struct {
+    std::ofstream out;
+    std::string path;
+    unsigned generation = 0;
+    std::vector<Coord> locs;
+    std::vector<uint8_t> present;  // alive in the last frame
+    std::vector<uint8_t> colors;
+    std::vector<TrajectoryRecord> records;
+} trajectory;
+
+
+static void openTrajectory(unsigned generation)
+{
+    std::stringstream name;
+    name << p.imageDir << "/gen-" << std::setfill('0') << std::setw(6) << generation << ".traj";
+    trajectory.path = name.str();
+    trajectory.generation = generation;
+    trajectory.out.open(trajectory.path + ".tmp", std::ios::binary | std::ios::trunc);
+    if (!trajectory.out) {
+        std::cerr << "Cannot write trajectory " << trajectory.path << ".tmp" << std::endl;
+        return;
+    }
+
+    trajectory.locs.assign(p.population + 1, Coord(0, 0));
+    trajectory.present.assign(p.population + 1, 0);
+    trajectory.colors.assign(p.population + 1, 0);
+
+    const char magic[8] = "BS4TRAJ";
+    const std::vector<Coord> &barriers = grid.getBarrierLocations();
+    uint32_t u32;
+    uint16_t u16;
+    trajectory.out.write(magic, sizeof(magic));
+    u32 = TRAJECTORY_VERSION; trajectory.out.write(reinterpret_cast<const char *>(&u32), sizeof(u32));
+    u32 = generation; trajectory.out.write(reinterpret_cast<const char *>(&u32), sizeof(u32));
+    u16 = p.sizeX; trajectory.out.write(reinterpret_cast<const char *>(&u16), sizeof(u16));
+    u16 = p.sizeY; trajectory.out.write(reinterpret_cast<const char *>(&u16), sizeof(u16));
+    u32 = p.population; trajectory.out.write(reinterpret_cast<const char *>(&u32), sizeof(u32));
+    u32 = barriers.size(); trajectory.out.write(reinterpret_cast<const char *>(&u32), sizeof(u32));
+    static_assert(sizeof(Coord) == 4, "Coord is two int16_t");
+    trajectory.out.write(reinterpret_cast<const char *>(barriers.data()), barriers.size() * sizeof(Coord));
+}
+
+
+// Called from endOfSimStep() in single-thread mode, after the deferred
+// moves and deaths have been applied.
+void saveTrajectoryFrame(unsigned simStep, unsigned generation)
+{
+    if (trajectory.path.empty() || trajectory.generation != generation) {
+        if (trajectory.out.is_open()) {
+            trajectory.out.close();  // unfinished generation
+        }
+        openTrajectory(generation);
+    }
+    if (!trajectory.out.is_open()) {
+        return;
+    }
+
+    trajectory.records.clear();
+    for (uint16_t index = 1; index <= p.population; ++index) {
+        const Indiv &indiv = peeps[index];
+        if (indiv.alive) {
+            if (!trajectory.present[index]) {
+                trajectory.present[index] = 1;
+                trajectory.colors[index] = makeGeneticColor(indiv.genome);
+            } else if (trajectory.locs[index].x == indiv.loc.x && trajectory.locs[index].y == indiv.loc.y) {
+                continue;
+            }
+            trajectory.locs[index] = indiv.loc;
+            trajectory.records.push_back({ index, indiv.loc.x, indiv.loc.y, trajectory.colors[index], 0 });
+        } else if (trajectory.present[index]) {
+            trajectory.present[index] = 0;
+            trajectory.records.push_back({ index, trajectory.locs[index].x, trajectory.locs[index].y,
+                                           trajectory.colors[index], TRAJECTORY_DIED });
+        }
+    }
+
+    uint32_t header[2] = { simStep, (uint32_t)trajectory.records.size() };
+    trajectory.out.write(reinterpret_cast<const char *>(header), sizeof(header));
+    trajectory.out.write(reinterpret_cast<const char *>(trajectory.records.data()),
+                         trajectory.records.size() * sizeof(TrajectoryRecord));
+}
+
+
+// Called from endOfGeneration(); completes the generation's file.
+void saveGenerationTrajectory(unsigned generation)
+{
+    if (!trajectory.out.is_open() || trajectory.generation != generation) {
+        return;
+    }
+    trajectory.out.close();
+    if (!trajectory.out) {
+        std::cerr << "Error writing trajectory " << trajectory.path << ".tmp" << std::endl;
+    } else {
+        std::rename((trajectory.path + ".tmp").c_str(), trajectory.path.c_str());
+    }
+    trajectory.path.clear();
+}
+
+} // end namespace BS
@@ -0,0 +1,195 @@
+""" Scaling benchmark. bench() runs a fixed matrix of
+    numThreads x population x grid size x maxNumberNeurons, one
+    simulation at a time so the runs don't compete for CPUs, and
+    measures sim steps and generations per second (see runreport).
+
+    Each point is compared with the baseline of this machine in
+    ./results/bench-<hostname>.json. A point fails if its steps per
+    second dropped by more than the tolerance (in percent). Points
+    without a baseline are stored as the baseline; --adjust replaces
+    the stored baseline with the current results.
+
+    For every population x grid x neurons group the report shows the
+    parallel speedup over one thread and the parallel efficiency,
+    speedup / numThreads.
+    """
+
+import itertools
+import json
+import os
+import shutil
+import socket
+import statistics
+import time
+from pathlib import Path
+
+from . import runner
+
+BENCH_MATRIX = {
+    'numthreads' : [1, 2, 4, 8, 16],
+    'population' : [1000, 3000],
+    'size' : [64, 128],
+    'maxnumberneurons' : [2, 5],
+}
+
+# fixed params of every benchmark run; no video, graphs or console reports
+BENCH_PARAMS = {
+    'maxgenerations' : "10",
+    'stepspergeneration' : "100",
+    'genomeinitiallengthmin' : "24",
+    'genomeinitiallengthmax' : "24",
+    'deterministic' : "true",
+    'rngseed' : "12345678",
+    'savevideo' : "false",
+    'updategraphlog' : "false",
+    'displaysamplegenomes' : "0",
+    'genomeanalysisstride' : "1000000",
+}
+
+# runs per point; the median is reported
+BENCH_REPEATS = 3
+
+
+def benchPoints(maxthreads=None):
+    """ Return the matrix as a list of points {param: value},
+        without thread counts above 'maxthreads' (the number of CPUs
+        by default).
+        """
+
+    maxthreads = maxthreads or os.cpu_count() or 1
+    threads = [t for t in BENCH_MATRIX['numthreads'] if t <= maxthreads] or [1]
+    points = list()
+    for t, pop, size, neurons in itertools.product(threads, BENCH_MATRIX['population'],
+                                                   BENCH_MATRIX['size'], BENCH_MATRIX['maxnumberneurons']):
+        points.append({'numthreads': t, 'population': pop, 'sizex': size, 'sizey': size,
+                       'maxnumberneurons': neurons})
+
+    return points
+
+
+def pointName(point):
+    return "threads=%i population=%i size=%i neurons=%i" % (point['numthreads'], point['population'],
+                                                            point['sizex'], point['maxnumberneurons'])
+
+
+def baselinePath(host=None):
+    return os.path.join(runner.RESULTSDIR, "bench-%s.json" % (host or socket.gethostname()))
+
+
+def loadBaseline(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def saveBaseline(baseline, path):
+    """ Atomically replace the stored baseline.
+        """
+
+    Path(runner.RESULTSDIR).mkdir(exist_ok=True)
+    tmppath = "%s.%i.tmp" % (path, os.getpid())
+    with open(tmppath, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+    os.replace(tmppath, path)
+
+
+def benchPoint(point, repeats=BENCH_REPEATS):
+    """ Run one point 'repeats' times. Return a dictionary with the
+        median throughput, or None if a run failed.
+        """
+
+    params = dict(BENCH_PARAMS)
+    params.update((k, str(v)) for k, v in point.items())
+    runs = list()
+    for i in range(repeats):
+        job = {
+            'test' : "bench",
+            'run' : "bench-%i" % i,
+            'params' : params,
+            'results' : {},
+            'watch' : None,
+            # a cached result would measure nothing
+            'cache' : False,
+        }
+        report = runner.runIsolated(job)
+        if report['error'] is not None or not report.get('usage'):
+            print("  %s failed: %s\n      workspace: %s" % (pointName(point), report['error'], report['dir']))
+            return None
+        runs.append(report['usage'])
+        shutil.rmtree(report['dir'], ignore_errors=True)
+
+    return {
+        'steps_per_sec' : statistics.median(r['steps_per_sec'] for r in runs),
+        'gens_per_sec' : statistics.median(r['gens_per_sec'] for r in runs),
+        'omp_efficiency' : statistics.median(r['omp_efficiency'] for r in runs),
+        'maxrss' : max(r['maxrss'] for r in runs),
+        'repeats' : repeats,
+    }
+
+
+def speedupTable(results):
+    """ Return lines showing the speedup over one thread and the
+        parallel efficiency of each population x grid x neurons group.
+        """
+
+    lines = list()
+    groups = dict()
+    for point, res in results:
+        group = (point['population'], point['sizex'], point['maxnumberneurons'])
+        groups.setdefault(group, dict())[point['numthreads']] = res['steps_per_sec']
+    for (pop, size, neurons), bythreads in sorted(groups.items()):
+        if 1 not in bythreads or len(bythreads) < 2:
+            continue
+        lines.append("population=%i size=%i neurons=%i" % (pop, size, neurons))
+        for t in sorted(bythreads):
+            speedup = bythreads[t] / bythreads[1] if bythreads[1] else 0.0
+            lines.append("    %2i thread(s)  %10.1f steps/s  speedup %5.2f  efficiency %4.2f"
+                         % (t, bythreads[t], speedup, speedup / t))
+
+    return lines
+
+
+def bench(tolerance=10.0, adjust=False, maxthreads=None):
+    """ Run the benchmark matrix and compare it with this machine's
+        baseline. Return the number of points that regressed by more
+        than 'tolerance' percent or failed.
+        """
+
+    path = baselinePath()
+    baseline = loadBaseline(path)
+    points = benchPoints(maxthreads)
+    print("\nBenchmarking %i point(s), %i run(s) each, baseline %s\n" % (len(points), BENCH_REPEATS, path))
+
+    failed = 0
+    results = list()
+    start_time = time.monotonic()
+    for point in points:
+        name = pointName(point)
+        res = benchPoint(point)
+        if res is None:
+            failed += 1
+            continue
+        results.append((point, res))
+        base = baseline.get(name)
+        status = "new"
+        if base and base.get('steps_per_sec'):
+            change = 100.0 * (res['steps_per_sec'] - base['steps_per_sec']) / base['steps_per_sec']
+            status = "%+6.1f%%" % change
+            if change < -tolerance:
+                status += " Fail"
+                failed += 1
+        print("  %-48s %10.1f steps/s %8.2f gens/s  %s" % (name, res['steps_per_sec'], res['gens_per_sec'], status),
+              flush=True)
+        if adjust or not base:
+            baseline[name] = dict(res, time=time.time())
+
+    print("\nParallel speedup:\n")
+    for line in speedupTable(results) or ["  needs more than one thread count (see BENCH_MATRIX)"]:
+        print(line)
+    saveBaseline(baseline, path)
+    print("\n%i point(s) regressed by more than %s%% or failed, in %s seconds\n"
+          % (failed, tolerance, round(time.monotonic() - start_time, 1)))
+
+    return failed
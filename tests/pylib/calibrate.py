@@ -0,0 +1,109 @@
+""" Statistical calibration of result params. calibrate() runs N
+    replicates of a test in parallel, each with deterministic = true
+    and its own RNGSeed, and derives the result params from the
+    distribution of the final epoch-log records:
+
+        result-survivors-min/max    percentiles of the final survivors
+        result-diversity-min/max    percentiles of the final diversity
+        result-generations          most common final generation
+        result-genomesize           most common final genome size
+        result-kills                most common final kill count
+    """
+
+import math
+from collections import Counter
+
+from . import runner
+from . import testlib
+
+# default RNGSeed of biosim4, see params.cpp
+DEFAULT_SEED = 12345678
+
+
+def percentile(values, pct):
+    """ Return the pct-th percentile (0..100) of 'values' using linear
+        interpolation between the closest ranks.
+        """
+
+    ordered = sorted(values)
+    if not ordered:
+        raise ValueError("percentile of an empty sequence")
+    pos = (len(ordered) - 1) * pct / 100.0
+    lower = int(math.floor(pos))
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+def mostCommon(values):
+    """ Return the most common value; ties go to the smallest value.
+        """
+
+    counts = Counter(values)
+    best = max(counts.values())
+
+    return min(v for v, c in counts.items() if c == best)
+
+
+def resultBounds(finals, coverage=95.0):
+    """ Derive result params from a list of final epoch-log records
+        (dictionaries as returned by testlib.readLog()). The min/max
+        params bracket the central 'coverage' percent of the runs.
+        """
+
+    lo = (100.0 - coverage) / 2.0
+    hi = 100.0 - lo
+    survivors = [r['survivors'] for r in finals]
+    diversity = [r['diversity'] for r in finals]
+
+    return {
+        'result-generations' : mostCommon([r['generation'] for r in finals]),
+        'result-survivors-min' : int(math.floor(percentile(survivors, lo))),
+        'result-survivors-max' : int(math.ceil(percentile(survivors, hi))),
+        # three decimals, rounded outwards
+        'result-diversity-min' : math.floor(percentile(diversity, lo) * 1000) / 1000.0,
+        'result-diversity-max' : math.ceil(percentile(diversity, hi) * 1000) / 1000.0,
+        'result-genomesize' : mostCommon([r['genomeSize'] for r in finals]),
+        'result-kills' : mostCommon([r['kills'] for r in finals]),
+    }
+
+
+def calibrate(thisconfig, testname, replicates, jobs, coverage=95.0):
+    """ Run 'replicates' deterministic runs of 'testname' with seeds
+        RNGSeed, RNGSeed + 1, ... in 'jobs' parallel processes and
+        store percentile-based result params in the test config.
+        Return the dictionary of new result params, or None if no
+        run completed.
+        """
+
+    section = testlib.getTestSection(thisconfig, testname)
+    base = int(testlib.getTestParams(section).get('rngseed', DEFAULT_SEED))
+    queue = list()
+    for i in range(replicates):
+        overrides = {'deterministic': "true", 'rngseed': str(base + i)}
+        runname = "%s-seed%i" % (testname, base + i)
+        queue.append(runner.makeJob(thisconfig, testname, runname, overrides))
+
+    print("\nCalibrating %s with %i replicate(s) and %i job(s)\n" % (testname, replicates, jobs))
+    finals = list()
+    for report in runner.runJobs(queue, jobs):
+        if report['error'] is not None or 'results' not in report:
+            print("  %s failed: %s" % (report['run'], report['error']))
+            continue
+        r = report['results']
+        print("  %s  survivors %i  diversity %s  (%.1fs)" % (report['run'], r['survivors'],
+                                                           r['diversity'], report['walltime']),
+              flush=True)
+        finals.append(r)
+
+    if not finals:
+        return None
+    newparams = resultBounds(finals, coverage)
+    print("\n%i of %i run(s) completed, result params covering %s%% of runs:\n"
+          % (len(finals), replicates, coverage))
+    for k, v in newparams.items():
+        print("%s= %s" % (k, v))
+    testlib.updateResultParams(thisconfig, testname, newparams)
+    testlib.writeTestParamsToConfig(thisconfig, False)
+
+    return newparams
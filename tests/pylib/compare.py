@@ -0,0 +1,227 @@
+""" A/B throughput comparison of two biosim4 binaries. compare()
+    runs a test section with both binaries, interleaved in ABBA order
+    so that slow drifts of the machine's load affect both alike. The
+    i-th run of each binary uses the same deterministic RNGSeed, and
+    every run is pinned to the same set of cores.
+
+    biosim4 prints "Gen N, ..." at the end of every generation. The
+    time between two of these lines is one generation's duration,
+    which gives a per-generation throughput distribution for each
+    binary. Generations of one run are not independent samples, so
+    the confidence interval of the speedup is bootstrapped over the
+    paired runs, and the verdict comes from a paired sign-flip
+    permutation test of the per-run log ratios.
+
+    With numThreads = 1 both binaries must write identical epoch
+    logs for the same seed; otherwise a speedup may come from changed
+    behavior rather than faster code.
+    """
+
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+from . import runner
+from . import supervisor
+from . import testlib
+from .calibrate import DEFAULT_SEED, percentile
+
+_results_log = "epoch-log.txt"
+# without a wall-clock limit, a run that takes this many times as long
+# as the slowest run so far is stopped as hung
+HANG_FACTOR = 10.0
+
+
+def parseCores(text):
+    """ Parse a core list like "0-3,6" into a set of ints.
+        """
+
+    cores = set()
+    for part in str.split(text, ","):
+        part = str.strip(part)
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = str.split(part, "-", 1)
+            cores.update(range(int(lo), int(hi) + 1))
+        else:
+            cores.add(int(part))
+
+    return cores
+
+
+def timeRun(binary, params, runname, cores=None, timeout=None, cputimeout=None):
+    """ Run 'binary' with 'params' in the workspace ./runs/<runname>/,
+        supervised with the wall-clock and CPU limits 'timeout' and
+        'cputimeout' and pinned to 'cores' where the platform supports
+        it. The output is kept in stdout.txt and stderr.txt in the
+        workspace. Return a dictionary with the monotonic time of
+        every "Gen N" line, the wall time, the rusage and the sha256
+        of the epoch log.
+        """
+
+    paths = runner.makeRunDir(runname)
+    params = dict(params)
+    params['logdir'] = paths['logdir']
+    params['imagedir'] = paths['imagedir']
+    params['updategraphlog'] = "false"
+    testlib.writeStdParams(params, os.path.join(paths['dir'], "tmp.ini"))
+
+    def pin(child):
+        if cores and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(child.pid, cores)
+
+    gens = list()
+    child = supervisor.run([binary, paths['ini']], cwd='../', stdout=os.path.join(paths['dir'], "stdout.txt"),
+                           stderr=os.path.join(paths['dir'], "stderr.txt"), timeout=timeout, cputimeout=cputimeout,
+                           progress=lambda c: gens.append(time.monotonic()), started=pin)
+    if child.timedout is not None:
+        raise subprocess.TimeoutExpired(binary, timeout if child.timedout == "wall" else cputimeout,
+                                        output=child.tail())
+    if child.returncode != 0:
+        raise subprocess.CalledProcessError(child.returncode, binary, output=child.tail())
+
+    digest = hashlib.sha256()
+    with open(os.path.join(paths['dir'], "logs", _results_log), 'rb') as f:
+        digest.update(f.read())
+
+    return {'gens': gens, 'walltime': child.walltime, 'rusage': child.rusage, 'log': digest.hexdigest()}
+
+
+def bootstrapCI(values, level=95.0, resamples=10000, seed=0):
+    """ Return the (low, high) bootstrap percentile interval of the
+        mean of 'values'.
+        """
+
+    rng = random.Random(seed)
+    n = len(values)
+    means = [sum(rng.choice(values) for i in range(n)) / n for r in range(resamples)]
+    tail = (100.0 - level) / 2.0
+
+    return (percentile(means, tail), percentile(means, 100.0 - tail))
+
+
+def signFlipTest(values, resamples=10000, seed=0):
+    """ Return the two-sided p-value of a paired sign-flip permutation
+        test of the hypothesis that 'values' (paired differences) are
+        centered on zero. Exact for up to 16 values.
+        """
+
+    n = len(values)
+    observed = abs(sum(values))
+    if n <= 16:
+        signs = itertools.product([1, -1], repeat=n)
+        total = 2 ** n
+    else:
+        rng = random.Random(seed)
+        signs = ([rng.choice([1, -1]) for i in range(n)] for r in range(resamples))
+        total = resamples
+    extreme = sum(1 for s in signs if abs(sum(v * x for v, x in zip(values, s))) >= observed - 1e-12)
+
+    return extreme / total
+
+
+def compare(thisconfig, testname, binaries, repeats=5, cores=None, level=95.0, timeout=None, cputimeout=None):
+    """ Compare the two biosim4 'binaries' on test 'testname' with
+        'repeats' interleaved runs each. 'timeout' and 'cputimeout'
+        limit the seconds of each run; without 'timeout', a run is
+        stopped after HANG_FACTOR times the slowest run so far.
+        Return the report dictionary, or None if a run failed.
+        """
+
+    binaries = [os.path.abspath(b) for b in binaries]
+    section = testlib.getTestSection(thisconfig, testname)
+    params = testlib.getTestParams(section, {'deterministic': "true"})
+    base = int(params.get('rngseed', DEFAULT_SEED))
+    steps = int(testlib.effectiveParams(params).get('stepspergeneration', 0))
+    if cores is None and hasattr(os, 'sched_getaffinity'):
+        cores = os.sched_getaffinity(0)
+
+    print("\nComparing on %s, %i run(s) each, cores %s\n  A: %s\n  B: %s\n"
+          % (testname, repeats, ",".join(str(c) for c in sorted(cores)) if cores else "any",
+             binaries[0], binaries[1]))
+    runs = [list(), list()]
+    for i in range(repeats):
+        seedparams = dict(params, rngseed=str(base + i))
+        # ABBA: alternate which binary goes first
+        for b in ([0, 1] if i % 2 == 0 else [1, 0]):
+            limit = timeout
+            if limit is None and (runs[0] or runs[1]):
+                limit = HANG_FACTOR * max(r['walltime'] for r in runs[0] + runs[1])
+            try:
+                res = timeRun(binaries[b], seedparams, "compare-%s-%s-seed%i" % (testname, "AB"[b], base + i),
+                              cores, limit, cputimeout)
+            except Exception as e:
+                print("  run %i of %s failed: %s" % (i, "AB"[b], e))
+                return None
+            runs[b].append(res)
+            print("  %s seed %i  %7.2fs  %i generations" % ("AB"[b], base + i, res['walltime'], len(res['gens'])),
+                  flush=True)
+
+    report = {'test': testname, 'binaries': binaries, 'repeats': repeats,
+              'cores': sorted(cores) if cores else None, 'stepspergeneration': steps}
+    medians = list()
+    for b in [0, 1]:
+        durations = list()
+        runmedians = list()
+        for res in runs[b]:
+            d = [t1 - t0 for t0, t1 in zip(res['gens'], res['gens'][1:])]
+            durations.extend(d)
+            runmedians.append(statistics.median(d) if d else res['walltime'])
+        medians.append(runmedians)
+        genrate = sorted(1.0 / d for d in durations if d > 0)
+        report["AB"[b]] = {
+            'gens_per_sec_median' : statistics.median(genrate) if genrate else None,
+            'gens_per_sec_p5' : percentile(genrate, 5) if genrate else None,
+            'gens_per_sec_p95' : percentile(genrate, 95) if genrate else None,
+            'steps_per_sec_median' : statistics.median(genrate) * steps if genrate else None,
+            'cputime' : sum(r['rusage'].ru_utime + r['rusage'].ru_stime for r in runs[b]),
+            'walltime' : sum(r['walltime'] for r in runs[b]),
+        }
+
+    # log of A's over B's median generation duration, per seed; > 0 means B is faster
+    logratios = [math.log(a / b) for a, b in zip(medians[0], medians[1]) if a > 0 and b > 0]
+    lo, hi = bootstrapCI(logratios, level)
+    report['speedup'] = math.exp(statistics.mean(logratios))
+    report['speedup_ci'] = (math.exp(lo), math.exp(hi))
+    report['p_value'] = signFlipTest(logratios)
+    if lo > 0:
+        report['verdict'] = "B is faster"
+    elif hi < 0:
+        report['verdict'] = "B is slower"
+    else:
+        report['verdict'] = "no significant difference"
+    mismatches = [i for i in range(repeats) if runs[0][i]['log'] != runs[1][i]['log']]
+    report['identical_logs'] = not mismatches
+    report['mismatched_seeds'] = [base + i for i in mismatches]
+
+    print("\n  per-generation throughput (generations/s)    median       5%      95%")
+    for b in "AB":
+        r = report[b]
+        print("  %s                                        %9.3f %8.3f %8.3f" % (b, r['gens_per_sec_median'] or 0,
+                                                                              r['gens_per_sec_p5'] or 0,
+                                                                              r['gens_per_sec_p95'] or 0))
+    print("\n  speedup of B over A: %.3fx, %s%% CI %.3f - %.3f, p = %.4f"
+          % (report['speedup'], level, report['speedup_ci'][0], report['speedup_ci'][1], report['p_value']))
+    print("  verdict: %s" % report['verdict'])
+    if report['identical_logs']:
+        print("  epoch logs: identical for every seed")
+    else:
+        print("  epoch logs: DIFFER for seed(s) %s" % ", ".join(str(s) for s in report['mismatched_seeds']))
+        if testlib.effectiveParams(params).get('numthreads') != "1":
+            print("  (numThreads > 1 is not reproducible, use numThreads = 1 to check behavior)")
+
+    Path(runner.RESULTSDIR).mkdir(exist_ok=True)
+    path = os.path.join(runner.RESULTSDIR, "compare-%s.json" % testname)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print("\n  report: %s\n" % path)
+
+    return report
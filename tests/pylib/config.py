@@ -7,11 +7,14 @@
     wrap load() and save() operations.
     """
 
+import os
 from configparser import SafeConfigParser
+from contextlib import contextmanager
 
 # Signal is used in class methods write_config() at the bottom
-# of this file. Signal lock forces exection to conclude before
-# other Signal operations can execute. 
+# of this file. Signal._lock is an application-wide lock that
+# serializes these read-modify-write operations; signals
+# themselves no longer take it.
 #
 # from facil.threadutils import Signal
 # with Signal._lock():
@@ -25,6 +28,10 @@ class TestConfig(SafeConfigParser):
     def __init__(self, filename, _DEFAULTS=[]):
         self.filename = filename
         self._DEFAULTS = _DEFAULTS
+        # save() only marks the config dirty while a batch() is open
+        self._batch_depth = 0
+        self._dirty = False
+        self._dirty_sort = False
         SafeConfigParser.__init__(self)
         self.load()
 
@@ -39,14 +46,60 @@ class TestConfig(SafeConfigParser):
         """ add the missing default values, 
             default is a list of defaults
             """
-        for (sect, opt, default) in defaults:
-            self._default(sect, opt, default)
+        with self.batch():
+            for (sect, opt, default) in defaults:
+                self._default(sect, opt, default)
+
+    @contextmanager
+    def batch(self):
+        """ collect all save() calls made inside the 'with' block
+            and write the .ini file once, when the outermost block
+            exits. e.g.
+
+            with config.batch():
+                config.set(...)
+                config.save()
+            """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+
+    def flush(self):
+        """ write the pending changes of a batch, if any
+            """
+        if self._dirty:
+            sort = self._dirty_sort
+            self._dirty = False
+            self._dirty_sort = False
+            self.save(sort)
 
     def save(self, sort=False):
-        """ save the config to the .ini file
+        """ save the config to the .ini file. The file is written
+            to a temp file that replaces the original in one rename,
+            so concurrent readers never see a partially written file.
             """
-        with open(self.filename, 'w') as configfile:
-            self.write(configfile, sort, space_around_delimiters=True)
+        if self._batch_depth:
+            self._dirty = True
+            self._dirty_sort = self._dirty_sort or sort
+            return
+        filename = str(self.filename)
+        tmpname = "%s.%i.tmp" % (filename, os.getpid())
+        try:
+            with open(tmpname, 'w') as configfile:
+                self.write(configfile, sort, space_around_delimiters=True)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+            os.replace(tmpname, filename)
+        except BaseException:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            raise
 
     def load(self):
         """ (re)load the config from the .ini file
@@ -0,0 +1,421 @@
+""" Offline genetic diversity and species analysis of a population
+    (a genome.Population). The simulator's geneticDiversity() in
+    src/genome-compare.cpp estimates diversity from at most 1000
+    random adjacent pairs (index, index + 1); this module computes it
+    over all pairs, or over a random sample of pairs with a stated
+    error bound, using the same three genomeComparisonMethod metrics:
+
+        0  Jaro distance over the first 20 genes (the simulator's
+           jaro_winkler_distance() has no Winkler prefix bonus)
+        1  bit Hamming:  1 - min(1, 2 * differing bits / bits)
+        2  byte Hamming: equal genes / genome length in bytes (a gene
+           is 4 bytes, so identical genomes score 0.25, as in the
+           simulator)
+
+    The simulator defines the Hamming metrics only for genomes of
+    equal length; here unequal genomes are compared over the length
+    of the shorter one.
+
+    All pairs are compared block by block, so memory use is bounded
+    by the block size and the N x N matrix is never built, and the
+    blocks are spread over a process pool. Identical genomes, common
+    in a converged population, are compared only once. Diversity is
+    1 - mean similarity, as in the simulator.
+
+    species() clusters large populations with MinHash signatures of
+    each genome's set of genes and locality-sensitive hashing.
+
+        python3 -m pylib.diversity runs/quicktest/stdout.txt --method 1
+        python3 -m pylib.diversity dump.txt --hexdump --sample 100000
+        python3 -m pylib.diversity dump.txt --hexdump --species 0.5
+
+    Requires numpy.
+    """
+
+import argparse
+import math
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import genome
+
+# jaro_winkler_distance() compares at most this many genes
+JARO_GENES = 20
+# individuals per side of a block of pairs
+BLOCKSIZE = 128
+
+# popcount of every byte value, for numpy versions without bitwise_count
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """ Return the number of set bits of each uint32 in 'words'.
+        """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _POPCOUNT8[words.view(np.uint8)].reshape(words.shape + (4,)).sum(axis=-1, dtype=np.uint32)
+
+
+def paddedGenes(pop, width=None):
+    """ Return (matrix, lengths): the genomes as rows of a uint32
+        matrix, padded with zeros (or cut) to 'width' genes (default:
+        the longest genome), and the genome lengths.
+        """
+    lengths = pop.lengths()
+    width = int(lengths.max()) if width is None and len(lengths) else (width or 0)
+    matrix = np.zeros((len(pop), width), dtype=np.uint32)
+    col = np.arange(len(pop.genes)) - np.repeat(pop.offsets[:-1], lengths)
+    keep = col < width
+    matrix[pop.owner()[keep], col[keep]] = pop.genes[keep]
+    return matrix, np.minimum(lengths, width)
+
+
+def hammingBits(A, lenA, B, lenB):
+    """ Bit Hamming similarity of the row pairs (A[k], B[k]).
+        """
+    minlen = np.minimum(lenA, lenB)
+    mask = np.arange(A.shape[1])[None, :] < minlen[:, None]
+    bits = (popcount(A ^ B) * mask).sum(axis=1, dtype=np.int64)
+    lenbits = 32.0 * minlen
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sim = 1.0 - np.minimum(1.0, 2.0 * bits / lenbits)
+    return np.where(minlen > 0, sim, 0.0)
+
+
+def hammingBytes(A, lenA, B, lenB):
+    """ Byte Hamming similarity of the row pairs (A[k], B[k]).
+        """
+    minlen = np.minimum(lenA, lenB)
+    mask = np.arange(A.shape[1])[None, :] < minlen[:, None]
+    equal = ((A == B) & mask).sum(axis=1, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sim = equal / (4.0 * minlen)
+    return np.where(minlen > 0, sim, 0.0)
+
+
+def jaro(S, lenS, A, lenA):
+    """ jaro_winkler_distance(genome1, genome2) of the row pairs
+        (S[k], A[k]), where S holds the first genomes and A the second
+        ones, at least JARO_GENES wide. The simulator's greedy matching
+        is reproduced step by step, vectorized over all pairs.
+        """
+    n = len(S)
+    sl = np.minimum(lenS, JARO_GENES).astype(np.int64)
+    al = np.minimum(lenA, JARO_GENES).astype(np.int64)
+    S = S[:, :JARO_GENES].astype(np.int64)
+    A = A[:, :JARO_GENES].astype(np.int64)
+    # padding never matches
+    cols = np.arange(JARO_GENES)[None, :]
+    S = np.where(cols < sl[:, None], S, -1)
+    A = np.where(cols < al[:, None], A, -2)
+    rng = np.maximum(0, np.maximum(sl, al) // 2 - 1)
+    sflags = np.zeros((n, JARO_GENES), dtype=bool)
+    aflags = np.zeros((n, JARO_GENES), dtype=bool)
+
+    # candidate[k, i, j]: gene i of A matches gene j of S within the window
+    i = np.arange(JARO_GENES)[None, :, None]
+    j = np.arange(JARO_GENES)[None, None, :]
+    window = (j >= i - rng[:, None, None]) & (j < np.minimum(i + rng[:, None, None] + 1, sl[:, None, None]))
+    candidate = window & (A[:, :, None] == S[:, None, :])
+
+    # the greedy pass only visits genes that match something
+    for i in np.flatnonzero(candidate.any(axis=(0, 2))):
+        found = np.zeros(n, dtype=bool)
+        for j in np.flatnonzero(candidate[:, i, :].any(axis=0)):
+            hit = candidate[:, i, j] & ~found & ~sflags[:, j]
+            sflags[:, j] |= hit
+            found |= hit
+        aflags[:, i] = found
+
+    m = aflags.sum(axis=1)
+    # the k-th matched gene of A is compared with the k-th matched gene of S
+    arank = np.where(aflags, np.cumsum(aflags, axis=1) - 1, JARO_GENES)
+    srank = np.where(sflags, np.cumsum(sflags, axis=1) - 1, JARO_GENES)
+    rows = np.arange(n)[:, None].repeat(JARO_GENES, axis=1)
+    amatched = np.full((n, JARO_GENES + 1), -3, dtype=np.int64)
+    smatched = np.full((n, JARO_GENES + 1), -3, dtype=np.int64)
+    amatched[rows, arank] = A
+    smatched[rows, srank] = S
+    t = (amatched[:, :JARO_GENES] != smatched[:, :JARO_GENES]).sum(axis=1) // 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dw = (m / sl + m / al + (m - t) / m) / 3.0
+    return np.where((m > 0) & (sl > 0) & (al > 0), dw, 0.0)
+
+
+METRICS = {0: jaro, 1: hammingBits, 2: hammingBytes}
+
+
+# per-process copies of the distinct genomes for the pool workers
+_matrix = None
+_lengths = None
+_weights = None
+
+
+def _initWorker(matrix, lengths, weights):
+    global _matrix, _lengths, _weights
+    _matrix = matrix
+    _lengths = lengths
+    _weights = weights
+
+
+def _blockSums(task):
+    """ Return (weighted sum of similarities, number of pairs) of all
+        pairs of distinct genomes i < j with i in rows [i0, i1) and j
+        in rows [j0, j1).
+        """
+    method, i0, i1, j0, j1 = task
+    i = np.arange(i0, i1)[:, None]
+    j = np.arange(j0, j1)[None, :]
+    i, j = np.broadcast_arrays(i, j)
+    keep = i < j
+    i = i[keep]
+    j = j[keep]
+    if len(i) == 0:
+        return 0.0, 0
+    sim = METRICS[method](_matrix[i], _lengths[i], _matrix[j], _lengths[j])
+    w = _weights[i] * _weights[j]
+    return float((sim * w).sum()), int(w.sum())
+
+
+def _metricMatrix(pop, method):
+    """ Return (matrix, lengths) as the metric needs them: Jaro only
+        looks at the first JARO_GENES genes.
+        """
+    return paddedGenes(pop, JARO_GENES if method == 0 else None)
+
+
+def distinctRows(matrix, lengths):
+    """ Return (matrix, lengths, counts) of the distinct rows.
+        """
+    keyed = np.concatenate([lengths.astype(np.uint32)[:, None], matrix], axis=1)
+    rows, counts = np.unique(keyed, axis=0, return_counts=True)
+    return np.ascontiguousarray(rows[:, 1:]), rows[:, 0].astype(np.int64), counts.astype(np.int64)
+
+
+def allPairs(pop, method=1, blocksize=BLOCKSIZE, jobs=None):
+    """ Return the mean similarity over all N * (N - 1) / 2 pairs of
+        'pop' using genomeComparisonMethod 'method'. Identical genomes
+        are compared once and weighted by their count, the distinct
+        ones in blocks of blocksize x blocksize spread over 'jobs'
+        processes (default: all cores).
+        """
+    n = len(pop)
+    if n < 2:
+        return 0.0
+    if method == 2 and len(set(pop.lengths().tolist())) == 1:
+        return byteHammingColumns(pop)
+
+    matrix, lengths, weights = distinctRows(*_metricMatrix(pop, method))
+    # pairs of identical genomes
+    same = METRICS[method](matrix, lengths, matrix, lengths)
+    total = float((same * weights * (weights - 1) // 2).sum())
+
+    u = len(weights)
+    starts = range(0, u, blocksize)
+    tasks = [(method, i0, min(i0 + blocksize, u), j0, min(j0 + blocksize, u))
+             for i0 in starts for j0 in starts if j0 >= i0]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) == 1:
+        _initWorker(matrix, lengths, weights)
+        sums = [_blockSums(t) for t in tasks]
+    else:
+        with Pool(jobs, initializer=_initWorker, initargs=(matrix, lengths, weights)) as pool:
+            sums = list(pool.imap_unordered(_blockSums, tasks, chunksize=max(1, len(tasks) // (8 * jobs))))
+
+    total += sum(s for s, c in sums)
+    return total / (n * (n - 1) // 2)
+
+
+def byteHammingColumns(pop):
+    """ Exact mean byte Hamming similarity of a population of equal
+        length genomes in O(N * length): the pairs that share a gene
+        at position p are counted per distinct gene value, without
+        comparing any pair.
+        """
+    n = len(pop)
+    length = int(pop.lengths()[0])
+    if length == 0:
+        return 0.0
+    matrix = pop.genes.reshape(n, length)
+    equal = 0
+    for p in range(length):
+        counts = np.unique(matrix[:, p], return_counts=True)[1].astype(np.int64)
+        equal += int((counts * (counts - 1) // 2).sum())
+    pairs = n * (n - 1) // 2
+    return equal / (4.0 * length * pairs)
+
+
+def sampledPairs(pop, method=1, samples=100000, seed=0, delta=0.05):
+    """ Return (mean similarity, error) estimated from 'samples'
+        pairs drawn uniformly from all pairs of 'pop'. Similarities
+        lie in [0, 1], so by Hoeffding's inequality the estimate is
+        within 'error' of the all-pairs mean with probability
+        1 - 'delta'.
+        """
+    n = len(pop)
+    if n < 2:
+        return 0.0, 0.0
+    rng = np.random.default_rng(seed)
+    i = rng.integers(0, n, samples)
+    j = rng.integers(0, n - 1, samples)
+    j += j >= i
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    matrix, lengths = _metricMatrix(pop, method)
+    total = 0.0
+    chunk = BLOCKSIZE * BLOCKSIZE
+    for k in range(0, samples, chunk):
+        a = i[k:k + chunk]
+        b = j[k:k + chunk]
+        total += float(METRICS[method](matrix[a], lengths[a], matrix[b], lengths[b]).sum())
+    error = math.sqrt(math.log(2.0 / delta) / (2.0 * samples))
+    return total / samples, error
+
+
+def samplesFor(error, delta=0.05):
+    """ Return the number of sampled pairs that bounds the error of
+        sampledPairs() by 'error' with probability 1 - 'delta'.
+        """
+    return int(math.ceil(math.log(2.0 / delta) / (2.0 * error * error)))
+
+
+def adjacentPairs(pop, method=1, seed=0):
+    """ The simulator's estimate: the mean similarity of at most 1000
+        pairs (k, k + 1), k drawn from 1 .. N - 1 (the last draw has
+        no successor and is skipped here).
+        """
+    n = len(pop)
+    rng = np.random.default_rng(seed)
+    i = rng.integers(1, n, min(1000, n))
+    i = i[i + 1 < n]
+    if len(i) == 0:
+        return 0.0
+    matrix, lengths = _metricMatrix(pop, method)
+    return float(METRICS[method](matrix[i], lengths[i], matrix[i + 1], lengths[i + 1]).mean())
+
+
+def minhash(pop, hashes=128, seed=0):
+    """ Return the (N, hashes) uint32 MinHash signatures of the gene
+        sets of 'pop', one multiply-shift hash function per column.
+        Two genomes agree in a column with probability equal to the
+        Jaccard similarity of their gene sets.
+        """
+    rng = np.random.default_rng(seed)
+    # odd 64-bit multipliers; the high 32 bits of a * x + b are a universal hash
+    a = rng.integers(0, 2**63, hashes, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, hashes, dtype=np.uint64)
+    lengths = pop.lengths()
+    nonempty = lengths > 0
+    starts = pop.offsets[:-1][nonempty]
+    sig = np.full((len(pop), hashes), np.iinfo(np.uint32).max, dtype=np.uint32)
+    genes = pop.genes.astype(np.uint64)
+    for h in range(hashes):
+        values = ((genes * a[h] + b[h]) >> np.uint64(32)).astype(np.uint32)
+        if len(starts):
+            sig[nonempty, h] = np.minimum.reduceat(values, starts)
+    return sig
+
+
+def bandsFor(threshold, hashes):
+    """ Return (bands, rows) with bands * rows <= 'hashes' whose LSH
+        threshold (1 / bands) ** (1 / rows) is closest to 'threshold'.
+        """
+    best = None
+    for rows in range(1, hashes + 1):
+        bands = hashes // rows
+        t = (1.0 / bands) ** (1.0 / rows)
+        if best is None or abs(t - threshold) < abs(best[2] - threshold):
+            best = (bands, rows, t)
+    return best[0], best[1]
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def species(pop, threshold=0.5, hashes=128, seed=0):
+    """ Cluster 'pop' into species: genomes whose gene sets have an
+        estimated Jaccard similarity of at least 'threshold' are
+        linked, and a species is a connected group of linked genomes.
+        Candidate pairs come from LSH buckets of the MinHash
+        signatures, so the work grows with N rather than N * N.
+        Return an array with the species label (0 = most numerous) of
+        every individual.
+        """
+    n = len(pop)
+    sig = minhash(pop, hashes, seed)
+    bands, rows = bandsFor(threshold, hashes)
+    parent = list(range(n))
+    for band in range(bands):
+        cols = sig[:, band * rows:(band + 1) * rows]
+        keys = np.unique(cols, axis=0, return_inverse=True)[1].reshape(-1)
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) < 2:
+                continue
+            # compare the bucket's members with its first member only
+            rep = bucket[0]
+            agree = (sig[bucket[1:]] == sig[rep]).mean(axis=1)
+            for k in bucket[1:][agree >= threshold]:
+                ri = _find(parent, rep)
+                rk = _find(parent, int(k))
+                if ri != rk:
+                    parent[rk] = ri
+
+    roots = np.array([_find(parent, i) for i in range(n)], dtype=np.int64)
+    uniq, inverse, counts = np.unique(roots, return_inverse=True, return_counts=True)
+    # relabel by decreasing size
+    rank = np.empty(len(uniq), dtype=np.int64)
+    rank[np.argsort(-counts, kind='stable')] = np.arange(len(uniq))
+    return rank[inverse.reshape(-1)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genetic diversity and species of a population of genomes")
+    parser.add_argument("file", help="simulator output with 'Individual ID' genome blocks, or a hex dump")
+    parser.add_argument("--hexdump", action="store_true", help="the file holds one hex genome per paragraph")
+    parser.add_argument("--generation", type=int, default=None, help="only use genomes of this generation")
+    parser.add_argument("--method", type=int, choices=sorted(METRICS), default=1,
+                        help="genomeComparisonMethod: 0 Jaro, 1 bit Hamming, 2 byte Hamming (default 1)")
+    parser.add_argument("--sample", type=int, metavar="PAIRS", default=None,
+                        help="estimate from PAIRS random pairs instead of all pairs")
+    parser.add_argument("--error", type=float, default=None,
+                        help="estimate from enough random pairs to be within ERROR (95%% confidence)")
+    parser.add_argument("--species", type=float, metavar="THRESHOLD", default=None,
+                        help="also cluster into species of Jaccard similarity THRESHOLD")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with open(args.file, 'r') as f:
+        pop = genome.readHexDump(f) if args.hexdump else genome.readPopulation(f, args.generation)
+    if len(pop) < 2:
+        print("%s: fewer than two genomes" % args.file)
+        return 1
+
+    print("%i genomes, %i genes" % (len(pop), len(pop.genes)))
+    print("simulator estimate (adjacent pairs): diversity %.6f" % (1.0 - adjacentPairs(pop, args.method, args.seed)))
+    samples = args.sample or (samplesFor(args.error) if args.error else None)
+    if samples:
+        sim, error = sampledPairs(pop, args.method, samples, args.seed)
+        print("sampled (%i pairs): diversity %.6f +- %.6f (95%%)" % (samples, 1.0 - sim, error))
+    else:
+        print("all pairs: diversity %.6f" % (1.0 - allPairs(pop, args.method, jobs=args.jobs)))
+
+    if args.species is not None:
+        labels = species(pop, args.species, seed=args.seed)
+        counts = np.bincount(labels)
+        print("%i species at Jaccard >= %s; largest: %s"
+              % (len(counts), args.species, ", ".join(str(c) for c in counts[:10])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
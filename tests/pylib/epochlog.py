@@ -0,0 +1,181 @@
+""" Incremental reader for the biosim4 epoch log. Each line of
+    epoch-log.txt holds five columns:
+
+        generation survivors diversity genomeSize kills
+
+    EpochLog keeps the columns in compact typed arrays and only
+    parses the lines appended since the previous update(), so a log
+    that grows during a long simulation is never parsed twice.
+    """
+
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+COLUMNS = ('generation', 'survivors', 'diversity', 'genomeSize', 'kills')
+# array typecodes for COLUMNS
+TYPECODES = ('I', 'I', 'd', 'I', 'I')
+
+
+def parseLine(line):
+    """ Parse one epoch-log line into a tuple of typed values.
+        Raise ValueError or IndexError if the line is malformed.
+        """
+
+    fields = line.split()
+    return (int(fields[0]),
+            int(fields[1]),
+            float(fields[2]),
+            int(float(fields[3])),  # averageGenomeLength() is a float
+            int(fields[4]))
+
+
+class EpochLog():
+    """ Typed, incrementally updated view of an epoch log file.
+        """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # number of times the file was found truncated or rewritten
+        self.truncations = 0
+        self.reset()
+
+    def reset(self):
+        """ Forget everything parsed so far.
+            """
+        self.columns = dict((c, array(t)) for c, t in zip(COLUMNS, TYPECODES))
+        # byte offset just past the last complete line parsed
+        self._offset = 0
+        # the last parsed line, used to detect a truncated or rewritten file
+        self._lastline = b""
+
+    def position(self):
+        """ Return the read position as an (offset, lastline) tuple
+            that seek() accepts, e.g. to continue reading the file in
+            a later process.
+            """
+        return (self._offset, self._lastline)
+
+    def seek(self, position):
+        """ Forget the parsed records and make update() continue with
+            the lines after 'position', as returned by position(). If
+            the file was truncated or rewritten since, update() parses
+            it again from the start.
+            """
+        self.reset()
+        self._offset, self._lastline = position
+
+    def __len__(self):
+        return len(self.columns['generation'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def last(self):
+        """ Return the last complete record of the file as a
+            dictionary without reading the rest of the file, or None
+            if the file holds no complete record. The file is read
+            backwards from its end in small blocks.
+            """
+        try:
+            with open(self.filename, 'rb') as f:
+                end = f.seek(0, os.SEEK_END)
+                line = self._lastLineBefore(f, end)
+        except OSError:
+            return None
+        if not line:
+            return None
+        return dict(zip(COLUMNS, parseLine(line.decode())))
+
+    def _lastLineBefore(self, f, end, blocksize=256):
+        """ Return the last newline-terminated line that ends at or
+            before byte offset 'end' of the open file 'f'.
+            """
+        buf = b""
+        pos = end
+        while True:
+            step = min(blocksize, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            # ignore a partially written last line
+            complete = buf[:buf.rfind(b"\n") + 1].rstrip()
+            start = complete.rfind(b"\n")
+            if (complete and start >= 0) or pos == 0:
+                return complete[start + 1:]
+
+    def update(self):
+        """ Parse the lines appended since the previous call. If the
+            file was truncated or rewritten (biosim4 starts a new log
+            at generation 0), everything is parsed again. Return the
+            number of new records.
+            """
+        try:
+            f = open(self.filename, 'rb')
+        except OSError:
+            self.reset()
+            return 0
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            if self._offset:
+                start = self._offset - len(self._lastline) - 1
+                f.seek(start)
+                if size < self._offset or f.read(len(self._lastline) + 1) != self._lastline + b"\n":
+                    self.truncations += 1
+                    self.reset()
+            if size == self._offset:
+                return 0
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+
+        # only consume complete lines; a partial last line is read next time
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return 0
+        chunk = chunk[:end + 1]
+        lines = chunk.splitlines()
+        tokens = chunk.split()
+        count = 0
+        if len(tokens) == 5 * len(lines):
+            # fast path: every line has exactly five columns
+            self.columns['generation'].extend(array('I', map(int, tokens[0::5])))
+            self.columns['survivors'].extend(array('I', map(int, tokens[1::5])))
+            self.columns['diversity'].extend(array('d', map(float, tokens[2::5])))
+            self.columns['genomeSize'].extend(array('I', (int(float(t)) for t in tokens[3::5])))
+            self.columns['kills'].extend(array('I', map(int, tokens[4::5])))
+            count = len(lines)
+        else:
+            for line in lines:
+                try:
+                    values = parseLine(line.decode())
+                except (ValueError, IndexError):
+                    continue
+                for c, v in zip(COLUMNS, values):
+                    self.columns[c].append(v)
+                count += 1
+        self._offset += end + 1
+        self._lastline = lines[-1] if lines else self._lastline
+
+        return count
+
+    def record(self, index):
+        """ Return the record at position 'index' as a dictionary.
+            """
+        return dict((c, self.columns[c][index]) for c in COLUMNS)
+
+    def indexRange(self, first=None, last=None):
+        """ Return the (start, stop) positions of the records whose
+            generation is in the inclusive range first..last. The
+            generation column is ascending, so this is a binary search.
+            """
+        gens = self.columns['generation']
+        start = 0 if first is None else bisect_left(gens, first)
+        stop = len(gens) if last is None else bisect_right(gens, last)
+        return (start, stop)
+
+    def select(self, first=None, last=None):
+        """ Return a dictionary of column slices for the generations
+            first..last (inclusive) without parsing the file again.
+            """
+        start, stop = self.indexRange(first, last)
+        return dict((c, self.columns[c][start:stop]) for c in COLUMNS)
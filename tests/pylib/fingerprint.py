@@ -0,0 +1,140 @@
+""" State fingerprints for exact regression tests. With
+    saveFingerprints = true, biosim4 appends one line per generation
+    to <logDir>/fingerprints.txt:
+
+        <generation> <hash of genomes, locations, alive flags and signals>
+
+    With deterministic = true and numThreads = 1, the lines only
+    change when the simulation itself behaves differently. testapp
+    keeps a golden copy per test in ./configs/golden/<test>.txt
+    (recorded with --golden), and a monitor.Monitor compares the
+    lines of a running test with it, stopping the simulation at the
+    first generation whose state differs.
+    """
+
+import os
+import shutil
+from pathlib import Path
+
+# relative to the ./tests working directory
+GOLDENDIR = "configs/golden"
+FINGERPRINTS = "fingerprints.txt"
+
+
+def parseLines(lines):
+    """ Return the (generation, hash) tuples of fingerprint lines.
+        """
+
+    entries = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 2:
+            entries.append((int(fields[0]), fields[1]))
+    return entries
+
+
+def readFingerprints(path):
+    with open(path) as f:
+        return parseLines(f)
+
+
+def goldenPath(testname):
+    return Path(GOLDENDIR, "%s.txt" % testname)
+
+
+def readGolden(testname):
+    """ Return the golden fingerprints of a test, or None if the
+        test has no golden file.
+        """
+
+    try:
+        return readFingerprints(goldenPath(testname))
+    except OSError:
+        return None
+
+
+def saveGolden(testname, logdir):
+    """ Store the fingerprints of the run in 'logdir' as the golden
+        file of a test. Return the golden file's path.
+        """
+
+    path = goldenPath(testname)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = "%s.%i.tmp" % (path, os.getpid())
+    shutil.copyfile(os.path.join(logdir, FINGERPRINTS), tmppath)
+    os.replace(tmppath, str(path))
+    return path
+
+
+def canRecord(params):
+    """ Return None if a simulation with the effective biosim4-style
+        'params' produces reproducible fingerprints, else the reason.
+        """
+
+    if params.get('deterministic', 'false').lower() not in ['true', '1']:
+        return "deterministic must be true"
+    if params.get('numthreads', '1') != '1':
+        return "numThreads must be 1"
+    return None
+
+
+class FingerprintLog():
+    """ Incremental reader of a fingerprint file being written.
+        """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._offset = 0
+        self._partial = ""
+
+    def update(self):
+        """ Return the (generation, hash) tuples of the lines
+            appended since the previous call.
+            """
+        try:
+            with open(self.filename) as f:
+                f.seek(self._offset)
+                chunk = f.read()
+        except OSError:
+            return []
+        self._offset += len(chunk)
+        chunk = self._partial + chunk
+        end = chunk.rfind("\n") + 1
+        self._partial = chunk[end:]
+        return parseLines(chunk[:end].splitlines())
+
+
+class GoldenCheck():
+    """ Compare the fingerprints of a running simulation, line by
+        line, with a golden sequence as returned by readGolden().
+        """
+
+    def __init__(self, filename, golden):
+        self.log = FingerprintLog(filename)
+        self.golden = golden
+        self.checked = 0
+
+    def poll(self):
+        """ Check the new lines. Return (generation, message) for the
+            first line that differs from the golden file, else None.
+            """
+        for generation, digest in self.log.update():
+            if self.checked >= len(self.golden):
+                return (generation, "generation %i is beyond the %i generations of the golden file"
+                        % (generation, len(self.golden)))
+            expected = self.golden[self.checked]
+            self.checked += 1
+            if (generation, digest) != expected:
+                return (generation, "state fingerprint of generation %i differs from the golden file "
+                        "(%s, expected generation %i %s)" % (generation, digest, expected[0], expected[1]))
+        return None
+
+    def complete(self):
+        """ Return None if every golden line was matched, else a
+            (generation, message) failure tuple.
+            """
+        if self.checked == len(self.golden):
+            return None
+        generation = self.golden[self.checked][0] if self.checked < len(self.golden) else -1
+        return (generation, "the run ended after %i of the %i fingerprints of the golden file"
+                % (self.checked, len(self.golden)))
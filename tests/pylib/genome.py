@@ -0,0 +1,258 @@
+""" Vectorized decoding of biosim4 genomes. Indiv::printGenome()
+    prints a genome as rows of 32-bit hex words, one word per Gene
+    (see src/genome-neurons.h). With gcc's little-endian bitfield
+    layout, the bits of a word are:
+
+        bit  0        sourceType  (1 = SENSOR, 0 = NEURON)
+        bits 1..7     sourceNum
+        bit  8        sinkType    (1 = ACTION, 0 = NEURON)
+        bits 9..15    sinkNum
+        bits 16..31   weight      (int16, weightAsFloat() = weight / 8192)
+
+    A Population holds the genomes of many individuals in one
+    contiguous uint32 array plus an offsets array (a ragged array),
+    so every operation runs over all genes at once. Sensor and action
+    names are read from the simulator sources, sensors-actions.h and
+    analysis.cpp, so they always match the compiled enums.
+
+    Requires numpy.
+    """
+
+import re
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+SRCDIR = Path(__file__).resolve().parents[2].joinpath("src")
+
+SENSOR = 1  # always a source
+ACTION = 1  # always a sink
+NEURON = 0  # can be either a source or sink
+
+
+def _enum(text, name, marker):
+    """ Return the enumerator names of 'enum name' that come before
+        the 'marker' enumerator (the active sensors or actions).
+        """
+    body = re.search(r'enum\s+%s\s*\{(.*?)\};' % name, text, re.S).group(1)
+    body = re.sub(r'//[^\n]*', '', body)
+    names = [str.strip(n) for n in body.split(",") if str.strip(n)]
+    return names[:names.index(marker)]
+
+
+def _cases(text, function):
+    """ Return {enumerator: string} from the switch in 'function'.
+        """
+    body = re.search(r'std::string\s+%s\s*\([^)]*\)\s*\{(.*?)\n\}' % function, text, re.S).group(1)
+    return dict(re.findall(r'case\s+(\w+)\s*:\s*return\s+"([^"]*)"', body))
+
+
+@lru_cache(maxsize=None)
+def sensorActionNames(srcdir=SRCDIR):
+    """ Return a dictionary of name lists indexed by enum value:
+        'sensors', 'sensorsShort', 'actions', 'actionsShort'. Only
+        the active sensors and actions (before NUM_SENSES and
+        NUM_ACTIONS) are included.
+        """
+    srcdir = Path(srcdir)
+    header = srcdir.joinpath("sensors-actions.h").read_text()
+    analysis = srcdir.joinpath("analysis.cpp").read_text()
+    sensors = _enum(header, "Sensor", "NUM_SENSES")
+    actions = _enum(header, "Action", "NUM_ACTIONS")
+    names = dict()
+    for key, enums, function in [('sensors', sensors, "sensorName"),
+                                 ('sensorsShort', sensors, "sensorShortName"),
+                                 ('actions', actions, "actionName"),
+                                 ('actionsShort', actions, "actionShortName")]:
+        cases = _cases(analysis, function)
+        names[key] = [cases.get(e, e) for e in enums]
+
+    return names
+
+
+def hexToGenes(hexwords):
+    """ Convert an iterable of 8-digit hex words (as printed by
+        printGenome()) to a uint32 array.
+        """
+    data = bytes.fromhex("".join(hexwords))
+    # printGenome() prints the word's value, i.e. most significant digit first
+    return np.frombuffer(data, dtype='>u4').astype(np.uint32)
+
+
+class Population():
+    """ The genomes of a population as one ragged array: the genes of
+        individual i are genes[offsets[i]:offsets[i + 1]]. 'ids' and
+        'generations' hold the individual ID and generation of each
+        genome where known (-1 otherwise).
+        """
+
+    def __init__(self, genes, offsets, ids=None, generations=None):
+        self.genes = np.ascontiguousarray(genes, dtype=np.uint32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        n = len(self.offsets) - 1
+        self.ids = np.asarray(ids if ids is not None else np.full(n, -1), dtype=np.int64)
+        self.generations = np.asarray(generations if generations is not None else np.full(n, -1), dtype=np.int64)
+
+    @classmethod
+    def from_genomes(cls, genomes, ids=None, generations=None):
+        """ Build a Population from a list of uint32 arrays.
+            """
+        lengths = [len(g) for g in genomes]
+        offsets = np.zeros(len(genomes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        genes = np.concatenate(genomes) if genomes else np.zeros(0, dtype=np.uint32)
+        return cls(genes, offsets, ids, generations)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def genome(self, i):
+        """ Return the genes of individual i (a view, not a copy).
+            """
+        return self.genes[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def owner(self):
+        """ Return the index of the individual each gene belongs to.
+            """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.lengths())
+
+    def select(self, mask):
+        """ Return a new Population of the individuals where 'mask'
+            (a boolean array with one entry per individual) is true.
+            """
+        index = np.flatnonzero(mask)
+        genomes = [self.genome(i) for i in index]
+        return Population.from_genomes(genomes, self.ids[index], self.generations[index])
+
+    def decode(self):
+        """ Decode all genes; see decode().
+            """
+        return decode(self.genes)
+
+
+def decode(genes):
+    """ Decode a uint32 gene array into a dictionary of arrays:
+        sourceType, sourceNum, sinkType, sinkNum (uint8), weight
+        (int16) and weightAsFloat (float32).
+        """
+    genes = np.asarray(genes, dtype=np.uint32)
+    return {
+        'sourceType' : (genes & 1).astype(np.uint8),
+        'sourceNum' : ((genes >> 1) & 0x7f).astype(np.uint8),
+        'sinkType' : ((genes >> 8) & 1).astype(np.uint8),
+        'sinkNum' : ((genes >> 9) & 0x7f).astype(np.uint8),
+        'weight' : (genes >> 16).astype(np.uint16).view(np.int16),
+        'weightAsFloat' : weightAsFloat(genes),
+    }
+
+
+def weightAsFloat(genes):
+    """ Gene::weightAsFloat() for every gene.
+        """
+    weight = (np.asarray(genes, dtype=np.uint32) >> 16).astype(np.uint16).view(np.int16)
+    return weight.astype(np.float32) / np.float32(8192.0)
+
+
+def renumber(fields, maxNumberNeurons, srcdir=SRCDIR):
+    """ Return (sourceNum, sinkNum) reduced the way the simulator
+        wires a genome (makeRenumberedConnectionList()): sensor,
+        action and neuron numbers are taken modulo the number of
+        active sensors, active actions and maxNumberNeurons.
+        """
+    names = sensorActionNames(srcdir)
+    numSenses = len(names['sensors'])
+    numActions = len(names['actions'])
+    source = np.where(fields['sourceType'] == SENSOR,
+                      fields['sourceNum'] % numSenses, fields['sourceNum'] % maxNumberNeurons)
+    sink = np.where(fields['sinkType'] == ACTION,
+                    fields['sinkNum'] % numActions, fields['sinkNum'] % maxNumberNeurons)
+    return source.astype(np.uint8), sink.astype(np.uint8)
+
+
+def nodeNames(fields, maxNumberNeurons, short=True, srcdir=SRCDIR):
+    """ Return (sourceNames, sinkNames) as object arrays, e.g. "Lx",
+        "N3", "MvE" with short=True (the names printIGraphEdgeList()
+        uses) or "loc X", "N3", "move east" otherwise. Neuron numbers
+        are reduced modulo maxNumberNeurons but, unlike the simulator,
+        not renumbered after useless neurons are culled.
+        """
+    names = sensorActionNames(srcdir)
+    sensors = names['sensorsShort' if short else 'sensors']
+    actions = names['actionsShort' if short else 'actions']
+    source, sink = renumber(fields, maxNumberNeurons, srcdir)
+    neurons = ["N%i" % i for i in range(128)]
+    # lookup tables indexed by type * 128 + number
+    sourceTable = np.array(neurons + sensors + [""] * (128 - len(sensors)), dtype=object)
+    sinkTable = np.array(neurons + actions + [""] * (128 - len(actions)), dtype=object)
+    return (sourceTable[fields['sourceType'].astype(np.int64) * 128 + source],
+            sinkTable[fields['sinkType'].astype(np.int64) * 128 + sink])
+
+
+def readPopulation(lines, generation=None):
+    """ Stream-parse simulator output (or any text holding the
+        "Individual ID N" blocks of displaySampleGenomes()) into a
+        Population. Each genome is tagged with the generation of the
+        preceding "Gen N" line. If 'generation' is given, only the
+        genomes of that generation are kept.
+        """
+    chunks = []
+    lengths = []
+    ids = []
+    gens = []
+    current = 0
+    indiv = None
+    words = None
+    for line in lines:
+        if line.startswith("Gen "):
+            try:
+                current = int(line[4:].split(",")[0])
+            except ValueError:
+                pass
+        elif line.startswith("Individual ID "):
+            indiv = int(line[len("Individual ID "):])
+            words = []
+        elif words is not None:
+            tokens = line.split()
+            if tokens:
+                words.extend(tokens)
+                continue
+            # the hex genome ends with an empty line
+            if generation is None or current == generation:
+                chunks.append("".join(words))
+                lengths.append(len(words))
+                ids.append(indiv)
+                gens.append(current)
+            words = None
+
+    genes = np.frombuffer(bytes.fromhex("".join(chunks)), dtype='>u4').astype(np.uint32)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return Population(genes, offsets, ids, gens)
+
+
+def readHexDump(lines):
+    """ Parse plain hex dumps, one genome per paragraph (genomes are
+        separated by empty lines), into a Population.
+        """
+    chunks = []
+    lengths = []
+    words = []
+    for line in list(lines) + [""]:
+        tokens = line.split()
+        if tokens:
+            words.extend(tokens)
+        elif words:
+            chunks.append("".join(words))
+            lengths.append(len(words))
+            words = []
+
+    genes = np.frombuffer(bytes.fromhex("".join(chunks)), dtype='>u4').astype(np.uint32)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return Population(genes, offsets)
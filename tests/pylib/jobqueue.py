@@ -0,0 +1,338 @@
+""" A job queue for simulation runs in a shared directory, so that
+    workers on any number of hosts (each in the ./tests directory of
+    its own checkout) can work through a test suite or sweep. The
+    directory only needs to support atomic rename(), which local
+    file systems and NFS do:
+
+        pending/<id>@<attempt>.json           waiting jobs
+        running/<id>@<attempt>@<worker>.json  claimed jobs (leases)
+        done/<id>@<attempt>@<worker>.json     finished jobs
+        failed/<id>@<attempt>@<worker>.json   jobs given up on
+        results/<id>@<attempt>@<worker>/      uploaded logs and report
+
+    A job is a runner.makeJob() dictionary. Every transition is a
+    rename of the job file, so exactly one worker wins a claim and a
+    job is never lost or run twice to completion:
+
+      - a worker claims a job by renaming it from pending/ to
+        running/ under its own name,
+      - while the simulation runs, the worker touches the file every
+        few seconds; the modification time is the lease,
+      - a lease that has not been renewed for LEASE seconds belongs
+        to a crashed or stalled worker, and any worker moves the job
+        back to pending/ with the attempt count increased, or to
+        failed/ after MAXATTEMPTS attempts,
+      - a finished worker uploads the epoch log, run report and
+        console output into its private results/ directory and then
+        renames the job to done/. If the rename fails, the lease was
+        lost; the worker discards its results.
+
+    A worker that finds its own lease gone stops the simulation.
+    Leases are compared with the local clock, so the clocks of the
+    hosts must agree to within a few seconds (NTP).
+    """
+
+import asyncio
+import json
+import os
+import shutil
+import socket
+import time
+from pathlib import Path
+
+from . import runcache
+from . import runner
+from . import runreport
+from . import testlib
+
+SUBDIRS = ("pending", "running", "done", "failed", "results")
+# seconds without a heartbeat after which a job is reclaimed
+LEASE = 60.0
+# seconds between heartbeats, claims and reclaim scans of a worker
+POLL = 2.0
+# runs of a job that may be lost to crashed workers
+MAXATTEMPTS = 3
+# files of a run's workspace that are uploaded, if present
+UPLOADS = ["logs/epoch-log.txt", "logs/%s" % runreport.RUNREPORT, "logs/fingerprints.txt",
+           "stdout.txt", "stderr.txt", "tmp.ini"]
+
+
+def workerName():
+    """ Return the name of this worker process, unique across hosts.
+        """
+
+    host = socket.gethostname().split('.')[0].replace('@', '_').replace('/', '_')
+    return "%s-%i" % (host, os.getpid())
+
+
+def jobId(job):
+    """ Return the queue id of a runner.makeJob() job: the test name
+        and a hash of the effective params, so that enqueueing the
+        same run twice is a no-op.
+        """
+
+    key = testlib.paramsHash(testlib.effectiveParams(job['params']))
+    return "%s-%s" % (job['test'], key[:12])
+
+
+class Lease():
+    """ A job claimed by a worker; 'path' is its file in running/.
+        """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = path.stem
+        self.id, attempt, self.worker = self.name.split('@')
+        self.attempt = int(attempt)
+        with open(str(path)) as f:
+            self.job = json.load(f)
+        # JSON turns the tuples of the job into lists
+        if self.job.get('golden') is not None:
+            self.job['golden'] = [tuple(entry) for entry in self.job['golden']]
+        # a workspace per attempt, in case a stalled run of the
+        # same job is still going on this host
+        self.job['run'] = "%s-a%i" % (self.id, self.attempt)
+
+
+class JobQueue():
+    """ The queue directory 'path'; see the module docstring.
+        """
+
+    def __init__(self, path, lease=LEASE):
+        self.path = Path(path)
+        self.lease = lease
+        for d in SUBDIRS:
+            self.path.joinpath(d).mkdir(parents=True, exist_ok=True)
+
+    def _entries(self, subdir):
+        """ Return the job files of 'subdir', oldest first.
+            """
+        entries = []
+        for entry in os.scandir(str(self.path.joinpath(subdir))):
+            if entry.name.endswith(".json") and not entry.name.startswith("."):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.name))
+                except OSError:
+                    # claimed or reclaimed meanwhile
+                    pass
+        return [self.path.joinpath(subdir, name) for mtime, name in sorted(entries)]
+
+    def known(self):
+        """ Return the ids of all jobs in the queue, in any state.
+            """
+        return set(p.name.split('@')[0] for d in SUBDIRS[:4] for p in self._entries(d))
+
+    def enqueue(self, jobs):
+        """ Add runner.makeJob() jobs to pending/. Jobs already in the
+            queue are skipped. Return the ids of the added jobs.
+            """
+        known = self.known()
+        added = []
+        for job in jobs:
+            jobid = jobId(job)
+            if '@' in jobid or jobid in known:
+                continue
+            known.add(jobid)
+            job = dict(job, id=jobid, enqueued=time.time())
+            # written under a hidden name, which claims ignore
+            tmppath = self.path.joinpath("pending", ".%s.%i.tmp" % (jobid, os.getpid()))
+            with open(str(tmppath), 'w') as f:
+                json.dump(job, f, indent=1, sort_keys=True)
+            os.rename(str(tmppath), str(self.path.joinpath("pending", "%s@0.json" % jobid)))
+            added.append(jobid)
+        return added
+
+    def claim(self, worker):
+        """ Claim the oldest pending job for 'worker'. Return its
+            Lease, or None if no job is pending.
+            """
+        for path in self._entries("pending"):
+            leased = self.path.joinpath("running", "%s@%s.json" % (path.stem, worker))
+            try:
+                os.rename(str(path), str(leased))
+            except FileNotFoundError:
+                # another worker was faster
+                continue
+            # rename keeps the old modification time
+            if self.renew(leased):
+                return Lease(leased)
+        return None
+
+    def renew(self, path):
+        """ Renew the lease 'path'. Return False if it was lost.
+            """
+        try:
+            os.utime(str(path))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def reclaim(self):
+        """ Move the jobs of expired leases back to pending/, or to
+            failed/ after MAXATTEMPTS attempts. Return the names of
+            the reclaimed leases.
+            """
+        reclaimed = []
+        now = time.time()
+        for path in self._entries("running"):
+            try:
+                if now - path.stat().st_mtime < self.lease:
+                    continue
+            except OSError:
+                continue
+            jobid, attempt, worker = path.stem.split('@')
+            attempt = int(attempt) + 1
+            if attempt >= MAXATTEMPTS:
+                target = self.path.joinpath("failed", path.name)
+            else:
+                target = self.path.joinpath("pending", "%s@%i.json" % (jobid, attempt))
+            try:
+                os.rename(str(path), str(target))
+            except FileNotFoundError:
+                continue
+            # partial uploads of the lost run
+            shutil.rmtree(str(self.path.joinpath("results", path.stem)), ignore_errors=True)
+            reclaimed.append(path.stem)
+        return reclaimed
+
+    def complete(self, lease, report):
+        """ Upload the results of the finished run of 'lease' and
+            move the job to done/. Return False if the lease was lost,
+            in which case nothing is kept.
+            """
+        results = self.path.joinpath("results", lease.name)
+        if results.exists():
+            shutil.rmtree(str(results))
+        results.mkdir()
+        for name in UPLOADS:
+            src = os.path.join(report['dir'], name)
+            if os.path.exists(src):
+                shutil.copyfile(src, str(results.joinpath(os.path.basename(name))))
+        with open(str(results.joinpath("report.json")), 'w') as f:
+            json.dump(dict(report, worker=lease.worker, attempt=lease.attempt, binary=runcache.binaryHash()),
+                      f, indent=1, sort_keys=True)
+        try:
+            os.rename(str(lease.path), str(self.path.joinpath("done", lease.path.name)))
+        except FileNotFoundError:
+            shutil.rmtree(str(results), ignore_errors=True)
+            return False
+        return True
+
+    def drained(self):
+        """ Return True if no job is pending or running.
+            """
+        return not self._entries("pending") and not self._entries("running")
+
+    def status(self):
+        """ Return a dictionary with a list of entries per state.
+            Running entries carry the age of their lease, done
+            entries the report uploaded by the worker.
+            """
+        now = time.time()
+        state = dict()
+        for d in SUBDIRS[:4]:
+            state[d] = []
+            for path in self._entries(d):
+                jobid, attempt = path.stem.split('@')[:2]
+                entry = {'id': jobid, 'attempt': int(attempt), 'name': path.stem}
+                if d == "running":
+                    entry['worker'] = path.stem.split('@')[2]
+                    try:
+                        entry['age'] = now - path.stat().st_mtime
+                    except OSError:
+                        continue
+                elif d == "done":
+                    try:
+                        with open(str(self.path.joinpath("results", path.stem, "report.json"))) as f:
+                            entry['report'] = json.load(f)
+                    except (OSError, ValueError):
+                        entry['report'] = None
+                state[d].append(entry)
+        return state
+
+
+async def _runLeased(lease):
+    return await runner.runIsolatedAsync(lease.job)
+
+
+async def _work(queue, jobs, verbose):
+    worker = workerName()
+    running = dict()   # Lease -> Task
+    counts = {'passed': 0, 'failed': 0, 'lost': 0}
+    print("\nworker %s: %s, %i job(s)\n" % (worker, queue.path, jobs), flush=True)
+    while True:
+        for name in queue.reclaim():
+            print("  reclaimed %s" % name, flush=True)
+        while len(running) < jobs:
+            lease = queue.claim(worker)
+            if lease is None:
+                break
+            running[lease] = asyncio.ensure_future(_runLeased(lease))
+        if not running:
+            if queue.drained():
+                break
+            # jobs of other workers may still be reclaimed
+            await asyncio.sleep(POLL)
+            continue
+        await asyncio.wait(list(running.values()), timeout=POLL, return_when=asyncio.FIRST_COMPLETED)
+        for lease, task in list(running.items()):
+            if not task.done():
+                if not queue.renew(lease.path):
+                    print("  %s: lease lost, stopping the run" % lease.name, flush=True)
+                    # the simulation is killed in supervisor.supervise()
+                    task.cancel()
+                    counts['lost'] += 1
+                    del running[lease]
+                continue
+            del running[lease]
+            report = task.result()
+            if not queue.complete(lease, report):
+                print("  %s: lease lost, results discarded" % lease.name, flush=True)
+                counts['lost'] += 1
+                continue
+            counts['passed' if report['passed'] else 'failed'] += 1
+            print("  %s%s %s  %8.1fs%s" % (lease.id, " " * max(1, 36 - len(lease.id)),
+                                            "Pass" if report['passed'] else "Fail", report['walltime'],
+                                            "  (cached)" if report['cached'] else ""), flush=True)
+            if report['error'] is not None:
+                print("      %s" % report['error'])
+            if verbose or not report['passed']:
+                for row in report['rows']:
+                    print("      %s = %s (expected %s) %s" % (row[0], row[2], row[1], row[3]))
+    return counts
+
+
+def work(path, jobs, verbose=False, lease=LEASE):
+    """ Run jobs from the queue directory 'path', at most 'jobs' at
+        a time, until no job is pending or running. Return a
+        dictionary with the number of passed, failed and lost runs.
+        """
+
+    queue = JobQueue(path, lease)
+    counts = asyncio.run(_work(queue, jobs, verbose))
+    print("\n%i passed, %i failed, %i lost\n" % (counts['passed'], counts['failed'], counts['lost']))
+    return counts
+
+
+def showStatus(path, verbose=False):
+    """ Print the state of the queue directory 'path'. Return the
+        status dictionary.
+        """
+
+    state = JobQueue(path).status()
+    done = state['done']
+    passed = sum(1 for e in done if e['report'] and e['report'].get('passed'))
+    print("\n%s: %i pending, %i running, %i done (%i passed, %i failed), %i failed permanently\n"
+          % (path, len(state['pending']), len(state['running']), len(done), passed, len(done) - passed,
+             len(state['failed'])))
+    for e in state['running']:
+        print("  running  %s  attempt %i  on %s, lease renewed %.0fs ago"
+              % (e['id'], e['attempt'] + 1, e['worker'], e['age']))
+    for e in done:
+        report = e['report'] or {}
+        if verbose or not report.get('passed'):
+            print("  %s  %s%s" % ("Pass" if report.get('passed') else "Fail", e['id'],
+                                 "  %s" % report['error'] if report.get('error') else ""))
+    for e in state['failed']:
+        print("  lost     %s  after %i attempts" % (e['id'], e['attempt'] + 1))
+    return state
@@ -0,0 +1,194 @@
+""" Live monitoring of a running simulation. A Monitor follows the
+    epoch log while biosim4 is running and checks every new
+    generation against the test's result params. When the test is
+    clearly going to fail, the monitor terminates the simulation and
+    records which generation crossed the line.
+
+    The checks are tuned with optional 'watch-*' keys in a test
+    section of testapp.ini:
+
+        watch-restart = true     fail if the population goes extinct and
+                                 the simulation restarts from generation 0
+        watch-stagnation = 50    fail if survivors stay at the same value
+                                 for this many generations while outside
+                                 result-survivors-min/max (0 disables)
+        watch-from = 50          check survivors and diversity against
+                                 their result bounds from this generation
+                                 on (by default only resultsAnalysis()
+                                 checks them, after the last generation)
+        watch-tolerance = 0.25   widen the bounds by this fraction, since
+                                 they describe the last generation
+        watch-patience = 5       number of consecutive generations outside
+                                 the widened bounds that fails the test
+        watch-interval = 1.0     seconds between polls of the epoch log
+
+    A Monitor given the golden fingerprints of a test (see
+    fingerprint.py) also stops the simulation at the first generation
+    whose state differs from the golden run.
+    """
+
+import os
+import signal
+import threading
+
+from . import epochlog
+from . import fingerprint
+from .threadutils import Timer
+
+WATCH_DEFAULTS = {
+    'restart' : "true",
+    'stagnation' : "50",
+    'from' : None,
+    'tolerance' : "0.25",
+    'patience' : "5",
+    'interval' : "1.0",
+}
+
+# options for a Monitor that only checks golden fingerprints
+GOLDEN_ONLY = {'restart' : "false", 'stagnation' : "0"}
+
+
+def getWatchParams(section):
+    """ Return the 'watch-*' keys of a test section as a dictionary
+        with the 'watch-' prefix removed.
+        """
+
+    watchdict = dict()
+    for k, v in section.items():
+        if k.startswith('watch-'):
+            watchdict[k[len('watch-'):]] = v
+
+    return watchdict
+
+
+class Monitor():
+    """ Check each new epoch-log record of a running simulation.
+        'rp' is a result params dictionary as returned by
+        testlib.getResultParams(), 'options' a dictionary as returned
+        by getWatchParams(), 'golden' a list of fingerprints as
+        returned by fingerprint.readGolden().
+        """
+
+    def __init__(self, logfile, rp, options=None, lastgen=None, golden=None):
+        opts = dict(WATCH_DEFAULTS)
+        opts.update(options or {})
+        self.log = epochlog.EpochLog(logfile)
+        self.rp = rp
+        self.lastgen = lastgen if lastgen is not None else rp.get('generations')
+        self.restart = str(opts['restart']).lower() in ["true", "1", "yes"]
+        self.stagnation = int(opts['stagnation'])
+        self.checkfrom = int(opts['from']) if opts['from'] is not None else self.lastgen
+        self.tolerance = float(opts['tolerance'])
+        self.patience = max(1, int(opts['patience']))
+        self.interval = float(opts['interval'])
+
+        self.failure = None  # (generation, message) once the test is doomed
+        self.process = None
+        # held while signalling or reaping the process, see supervisor.supervise()
+        self.lock = threading.Lock()
+        self._checked = 0    # number of log records already checked
+        self._truncations = 0
+        self._previous = None
+        self._flat = 0       # generations with unchanged survivors
+        self._outside = dict()  # consecutive out-of-bounds count per column
+        self._timer = None
+        self.golden = None
+        if golden is not None:
+            self.golden = fingerprint.GoldenCheck(
+                os.path.join(os.path.dirname(logfile), fingerprint.FINGERPRINTS), golden)
+
+    def start(self, process):
+        """ Start polling the epoch log of 'process' (a subprocess.Popen).
+            """
+        self.process = process
+        self._timer = Timer(self.interval)
+        self._timer.connect(self._tick)
+
+    def stop(self):
+        """ Stop polling and check any records not yet seen.
+            """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.poll()
+        if self.golden and not self.failure:
+            self.failure = self.golden.complete()
+
+    def _tick(self, sender, data):
+        if self.poll() and self.process:
+            with self.lock:
+                # returncode is set once the process has been reaped
+                if self.process.returncode is None:
+                    os.kill(self.process.pid, signal.SIGTERM)
+
+    def poll(self):
+        """ Check the records appended since the last poll. Return
+            the failure tuple once the test is doomed, else None.
+            """
+        if self.failure:
+            return self.failure
+        self.log.update()
+        if self.log.truncations != self._truncations:
+            # biosim4 truncates the log when generation 0 starts over
+            self._truncations = self.log.truncations
+            self._checked = 0
+            if self._previous is not None and self.restart:
+                self.failure = (0, "population went extinct after generation %i and restarted from generation 0"
+                                % self._previous['generation'])
+                return self.failure
+        while self._checked < len(self.log) and not self.failure:
+            self.check(self.log.record(self._checked))
+            self._checked += 1
+        if self.golden and not self.failure:
+            self.failure = self.golden.poll()
+
+        return self.failure
+
+    def check(self, record):
+        """ Check one epoch-log record.
+            """
+        gen = record['generation']
+        previous = self._previous
+        self._previous = record
+        if previous is not None and gen <= previous['generation'] and self.restart:
+            self.failure = (gen, "population went extinct after generation %i and restarted from generation 0"
+                            % previous['generation'])
+            return
+
+        if previous is not None and record['survivors'] == previous['survivors']:
+            self._flat += 1
+        else:
+            self._flat = 0
+        if self.stagnation and self._flat >= self.stagnation \
+                and not self.in_bounds('survivors', record['survivors'], 0.0):
+            self.failure = (gen, "survivors stagnated at %i for %i generations, outside %s"
+                            % (record['survivors'], self._flat, self.bounds('survivors', 0.0)))
+            return
+
+        # the last generation is checked by resultsAnalysis()
+        if self.checkfrom is None or gen < self.checkfrom \
+                or (self.lastgen is not None and gen >= self.lastgen):
+            return
+        for k in ['survivors', 'diversity']:
+            if self.in_bounds(k, record[k], self.tolerance):
+                self._outside[k] = 0
+                continue
+            self._outside[k] = self._outside.get(k, 0) + 1
+            if self._outside[k] >= self.patience:
+                self.failure = (gen, "%s = %s outside %s for %i generations"
+                                % (k, record[k], self.bounds(k, self.tolerance), self._outside[k]))
+                return
+
+    def bounds(self, key, tolerance):
+        """ Return the (min, max) result bounds of 'key' widened by
+            'tolerance', or None if the test has no such bounds.
+            """
+        minstr = key + '-min'
+        maxstr = key + '-max'
+        if minstr not in self.rp or maxstr not in self.rp:
+            return None
+        return (self.rp[minstr] * (1.0 - tolerance), self.rp[maxstr] * (1.0 + tolerance))
+
+    def in_bounds(self, key, value, tolerance):
+        b = self.bounds(key, tolerance)
+        return b is None or b[0] <= value <= b[1]
@@ -0,0 +1,249 @@
+""" SQLite store of every simulation run: its effective parameters,
+    the binary it ran, the run report and the complete epoch log.
+    runner and testapp record each run they execute (cached results
+    are not recorded again) in ./results/results.db:
+
+        runs(id, test, run, host, time, binary, paramshash, returncode,
+             walltime, cputime, maxrss, generations, passed, error,
+             source, report)
+        params(run, name, value, num)         PRIMARY KEY (run, name)
+        generations(run, generation, survivors, diversity, genomesize,
+                    kills)                    PRIMARY KEY (run, generation)
+
+    params and generations are WITHOUT ROWID tables clustered on their
+    keys, and params has indexes on (name, num) and (name, value), so
+    looking up runs by parameter value and a generation of each run
+    are index searches. 'num' is the numeric value of a param, or NULL.
+
+        python3 -m pylib.resultstore --column diversity --at 500 --where "population>=5000"
+        python3 -m pylib.resultstore --ingest /shared/q/results/*
+    """
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from itertools import repeat
+from pathlib import Path
+
+from . import epochlog
+from . import runcache
+from . import testlib
+
+# relative to the ./tests working directory
+DATABASE = "results/results.db"
+# seconds to wait for another process's write transaction
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    test TEXT,
+    run TEXT,
+    host TEXT,
+    time REAL,
+    binary TEXT,
+    paramshash TEXT,
+    returncode INTEGER,
+    walltime REAL,
+    cputime REAL,
+    maxrss INTEGER,
+    generations INTEGER,
+    passed INTEGER,
+    error TEXT,
+    source TEXT UNIQUE,
+    report TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_test ON runs (test, time);
+CREATE INDEX IF NOT EXISTS runs_paramshash ON runs (paramshash);
+CREATE TABLE IF NOT EXISTS params (
+    run INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    num REAL,
+    PRIMARY KEY (run, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS params_num ON params (name, num, run);
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value, run);
+CREATE TABLE IF NOT EXISTS generations (
+    run INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    survivors INTEGER,
+    diversity REAL,
+    genomesize INTEGER,
+    kills INTEGER,
+    PRIMARY KEY (run, generation)
+) WITHOUT ROWID;
+"""
+
+# generations columns by epochlog.COLUMNS name
+COLUMNS = {'generation': 'generation', 'survivors': 'survivors', 'diversity': 'diversity',
+           'genomeSize': 'genomesize', 'kills': 'kills'}
+OPERATORS = ('>=', '<=', '!=', '=', '<', '>')
+_condition = re.compile(r"^\s*(\w+)\s*(>=|<=|!=|=|<|>)\s*(\S.*?)\s*$")
+
+
+def connect(path=DATABASE):
+    """ Open the results database 'path', creating it if needed.
+        """
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    # readers don't block the writer, and several runners can share the file
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def numeric(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def insertRun(conn, usage, params, logfile, test=None, run=None, passed=None, error=None,
+              binary=None, source=None):
+    """ Insert a run in the open transaction of 'conn' and return its
+        id. 'usage' is a run report (see runreport.makeRunReport()),
+        'params' the biosim4-style params of the run and 'logfile'
+        its epoch log, which is inserted in bulk.
+        """
+
+    usage = usage or {}
+    effective = testlib.effectiveParams(params)
+    cursor = conn.execute(
+        "INSERT INTO runs (test, run, host, time, binary, paramshash, returncode, walltime, cputime, maxrss,"
+        " generations, passed, error, source, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (test or usage.get('test'), run, usage.get('host'), usage.get('time', time.time()), binary,
+         testlib.paramsHash(effective), usage.get('returncode'), usage.get('walltime'), usage.get('cputime'),
+         usage.get('maxrss'), usage.get('generations'), None if passed is None else int(bool(passed)),
+         error, source, json.dumps(usage, sort_keys=True)))
+    runid = cursor.lastrowid
+    conn.executemany("INSERT INTO params (run, name, value, num) VALUES (?, ?, ?, ?)",
+                     ((runid, k, v, numeric(v)) for k, v in effective.items()))
+
+    log = epochlog.EpochLog(logfile)
+    log.update()
+    # the typed columns of the log go in without building row dictionaries
+    conn.executemany("INSERT OR REPLACE INTO generations (run, generation, survivors, diversity, genomesize, kills)"
+                     " VALUES (?, ?, ?, ?, ?, ?)",
+                     zip(repeat(runid), *(log[c] for c in epochlog.COLUMNS)))
+    return runid
+
+
+def recordRun(usage, params, logfile, test=None, run=None, passed=None, error=None, path=DATABASE):
+    """ Record a run executed with the local biosim4 binary in the
+        results database 'path'. Return the run id.
+        """
+
+    conn = connect(path)
+    try:
+        with conn:
+            return insertRun(conn, usage, params, logfile, test, run, passed, error, runcache.binaryHash())
+    finally:
+        conn.close()
+
+
+def ingestDir(conn, directory):
+    """ Insert the run uploaded to 'directory' by a jobqueue worker
+        (epoch-log.txt, tmp.ini and report.json) unless it is already
+        in the database. Return the run id, or None if the run was
+        skipped.
+        """
+
+    source = os.path.abspath(directory)
+    if conn.execute("SELECT 1 FROM runs WHERE source = ?", (source,)).fetchone():
+        return None
+    with open(os.path.join(directory, "report.json")) as f:
+        report = json.load(f)
+    params = testlib.readDefaultParams(os.path.join(directory, "tmp.ini"))
+    return insertRun(conn, report.get('usage'), params, os.path.join(directory, "epoch-log.txt"),
+                     report.get('test'), report.get('run'), report.get('passed'), report.get('error'),
+                     report.get('binary'), source)
+
+
+def parseCondition(text):
+    """ Parse a condition like 'population>=5000' into a (param,
+        operator, value) tuple. Raise ValueError if it is malformed.
+        """
+
+    match = _condition.match(text)
+    if not match:
+        raise ValueError("expected <param><op><value> with op one of %s, got '%s'" % (" ".join(OPERATORS), text))
+    return (str.lower(match.group(1)), match.group(2), match.group(3))
+
+
+def metricAt(conn, column, generation, conditions=(), test=None):
+    """ Return (run id, value) tuples of the epoch-log 'column' at
+        'generation' for all runs whose params satisfy every
+        (param, operator, value) condition. Numeric values are
+        compared as numbers, others as text.
+        """
+
+    if column not in COLUMNS.values():
+        raise ValueError("unknown column %s, expected one of %s" % (column, ", ".join(COLUMNS.values())))
+    joins = []
+    args = []
+    for i, (name, op, value) in enumerate(conditions):
+        if op not in OPERATORS:
+            raise ValueError("unknown operator %s" % op)
+        number = numeric(value)
+        joins.append("JOIN params p%i ON p%i.run = g.run AND p%i.name = ? AND p%i.%s %s ?"
+                     % (i, i, i, i, "num" if number is not None else "value", op))
+        args += [name, number if number is not None else value]
+    sql = "SELECT g.run, g.%s FROM generations g %s" % (column, " ".join(joins))
+    if test is not None:
+        sql += " JOIN runs r ON r.id = g.run AND r.test = ?"
+        args.append(test)
+    sql += " WHERE g.generation = ? ORDER BY g.run"
+    args.append(generation)
+    return conn.execute(sql, args).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query and fill the simulation results database")
+    parser.add_argument("--db", default=DATABASE, help="database file (default %s)" % DATABASE)
+    parser.add_argument("--ingest", nargs="+", metavar="DIR", default=None,
+                        help="add runs uploaded to a job queue's results/ directory")
+    parser.add_argument("--column", default="diversity",
+                        help="epoch-log column to show (default diversity)")
+    parser.add_argument("--at", type=int, metavar="GEN", default=None, help="generation to show")
+    parser.add_argument("--where", action="append", metavar="COND", default=[],
+                        help="param condition like population>=5000 (repeatable)")
+    parser.add_argument("--test", default=None, help="only runs of this test")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    if args.ingest:
+        count = 0
+        start_time = time.monotonic()
+        for directory in args.ingest:
+            try:
+                with conn:
+                    if ingestDir(conn, directory) is not None:
+                        count += 1
+            except (OSError, ValueError) as e:
+                print("%s: %s" % (directory, e))
+        print("%i run(s) added in %.2f seconds" % (count, time.monotonic() - start_time))
+    if args.at is not None:
+        try:
+            conditions = [parseCondition(c) for c in args.where]
+            start_time = time.monotonic()
+            rows = metricAt(conn, args.column, args.at, conditions, args.test)
+        except ValueError as e:
+            print(e)
+            return 1
+        for runid, value in rows:
+            print("%8i  %s" % (runid, value))
+        print("%i run(s) in %.1f ms" % (len(rows), (time.monotonic() - start_time) * 1000))
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+""" Content-addressed cache of simulation results. A simulation with
+    deterministic = true and numThreads = 1 is fully determined by
+    the biosim4 binary and its effective parameters (the biosim4.ini
+    defaults overlaid with the test params), so its epoch log can be
+    stored once and reused by every later run of the same test:
+
+        ./results/cache/<key>/epoch-log.txt
+        ./results/cache/<key>/run.json
+
+    The key is a hash of the binary's contents and the normalized
+    effective parameters. Parameters that only control output (file
+    locations, video, console reports) are left out of the key; none
+    of them draws random numbers, so they can't change the results.
+    """
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+from . import testlib
+
+# relative to the ./tests working directory
+CACHEDIR = "results/cache"
+BINARY = "../bin/Release/biosim4"
+_results_log = "epoch-log.txt"
+
+OUTPUTPARAMS = [
+    'logdir', 'imagedir',
+    'savevideo', 'savetrajectory', 'videostride', 'videosavefirstframes', 'displayscale', 'agentsize',
+    'updategraphlog', 'updategraphlogstride',
+    'genomeanalysisstride', 'displaysamplegenomes', 'snapshotstride', 'checkpointstride', 'savefingerprints',
+]
+
+# binary hashes by (path, size, mtime), so the binary is read once per process
+_binaryhashes = dict()
+
+
+def binaryHash(path=BINARY):
+    """ Return the sha256 hex digest of the biosim4 binary, or None
+        if it can't be read.
+        """
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if stamp not in _binaryhashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _binaryhashes[stamp] = digest.hexdigest()
+
+    return _binaryhashes[stamp]
+
+
+def isCacheable(effective):
+    """ Return True if a simulation with the effective parameters
+        'effective' always produces the same epoch log.
+        """
+
+    return str.lower(effective.get('deterministic', "")) in ["true", "1"] \
+        and effective.get('numthreads') == "1"
+
+
+def runKey(params, binary=BINARY):
+    """ Return the cache key of a run with the biosim4-style 'params'
+        (e.g. from testlib.getTestParams()), or None if the run is
+        not deterministic or the binary is missing.
+        """
+
+    effective = testlib.effectiveParams(params)
+    if not isCacheable(effective):
+        return None
+    binhash = binaryHash(binary)
+    if binhash is None:
+        return None
+    paramhash = testlib.paramsHash(effective, OUTPUTPARAMS)
+
+    return hashlib.sha256((binhash + paramhash).encode()).hexdigest()
+
+
+def lookup(key):
+    """ Return the path of the cached epoch log for 'key', or None.
+        """
+
+    if key is None:
+        return None
+    path = os.path.join(CACHEDIR, key, _results_log)
+
+    return path if os.path.isfile(path) else None
+
+
+def restore(key, logdir):
+    """ Copy the cached epoch log for 'key' into 'logdir', as if the
+        simulation had just written it. Return True on success.
+        """
+
+    cached = lookup(key)
+    if cached is None:
+        return False
+    Path(logdir).mkdir(parents=True, exist_ok=True)
+    path = os.path.join(logdir, _results_log)
+    tmppath = "%s.%i.tmp" % (path, os.getpid())
+    shutil.copyfile(cached, tmppath)
+    os.replace(tmppath, path)
+
+    return True
+
+
+def store(key, logdir, params=None, walltime=None):
+    """ Store the epoch log in 'logdir' under 'key'. The entry is
+        assembled in a temp directory and renamed into place, so
+        concurrent runs never see a partial entry.
+        """
+
+    if key is None or lookup(key):
+        return
+    Path(CACHEDIR).mkdir(parents=True, exist_ok=True)
+    tmpdir = os.path.join(CACHEDIR, "%s.%i.tmp" % (key, os.getpid()))
+    try:
+        os.mkdir(tmpdir)
+        shutil.copyfile(os.path.join(logdir, _results_log), os.path.join(tmpdir, _results_log))
+        with open(os.path.join(tmpdir, "run.json"), 'w') as f:
+            json.dump({
+                'binary' : binaryHash(),
+                'params' : testlib.effectiveParams(params or {}),
+                'walltime' : walltime,
+                'created' : time.time(),
+            }, f, indent=1, sort_keys=True)
+        # fails if another process stored the same key meanwhile
+        os.rename(tmpdir, os.path.join(CACHEDIR, key))
+    except OSError:
+        pass
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,338 @@
+""" Parallel test-matrix runner. Each simulation runs in its own
+    workspace under ./runs/ with a private temp ini file, logDir
+    and imageDir, so any number of biosim4 processes can run at
+    the same time without sharing ./configs/tmp.ini or
+    ../logs/epoch-log.txt. All simulations are supervised from one
+    asyncio event loop in this process, see pylib/supervisor.py.
+    """
+
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import time
+from pathlib import Path
+
+from . import fingerprint
+from . import monitor
+from . import resultstore
+from . import runcache
+from . import runreport
+from . import schedule
+from . import testlib
+from .threadutils import EventBus
+
+# all paths are relative to the ./tests working directory
+RUNSDIR = "runs"
+RESULTSDIR = "results"
+# wall time of the most recent run of each test, used for scheduling
+WALLTIMES = "walltimes.json"
+_results_log = "epoch-log.txt"
+# seconds between the progress lines of runMatrix()
+PROGRESS_INTERVAL = 10.0
+# progress events folded into one progress line at most
+PROGRESS_BATCH = 10000
+
+
+def makeRunDir(runname):
+    """ Create (or empty) the private workspace ./runs/<runname>/
+        with its own logs/ and images/ directories. Return a
+        dictionary of paths relative to the project root, which
+        is the working directory of the biosim4 process.
+        """
+
+    rundir = Path(RUNSDIR).joinpath(runname)
+    if rundir.exists():
+        shutil.rmtree(str(rundir))
+    rundir.joinpath("logs").mkdir(parents=True)
+    rundir.joinpath("images").mkdir()
+
+    # biosim4 runs in '../', so map everything relative to the project root
+    root = "./tests/%s/%s" % (RUNSDIR, runname)
+    return {
+        'dir' : str(rundir),
+        'ini' : root + "/tmp.ini",
+        'logdir' : root + "/logs",
+        'imagedir' : root + "/images/",
+    }
+
+
+def makeJob(thisconfig, testname, runname=None, overrides=None, watch=False, cache=True,
+            timeout=None, cputimeout=None):
+    """ Build a picklable job description for runIsolated() from
+        the test section 'testname'. 'overrides' is a dictionary of
+        biosim4-style params that replace the section's params. If
+        'watch' is True the run is monitored and stopped early when
+        it is clearly going to fail. If 'cache' is True, a
+        deterministic run reuses a cached epoch log (see runcache).
+        A test with golden fingerprints always runs and is compared
+        with them.
+        'timeout' and 'cputimeout' limit the wall-clock and CPU
+        seconds of the simulation.
+        """
+
+    section = testlib.getTestSection(thisconfig, testname)
+    rp, complete = testlib.getResultParams(thisconfig, testname)
+    # golden fingerprints only hold for the test's own params
+    golden = fingerprint.readGolden(testname) if not overrides else None
+    params = testlib.getTestParams(section, overrides)
+    if golden is not None:
+        params['savefingerprints'] = "true"
+    return {
+        'test' : testname,
+        'run' : runname or testname,
+        'params' : params,
+        'results' : rp,
+        'watch' : monitor.getWatchParams(section) if watch else None,
+        'golden' : golden,
+        'schedule' : schedule.getSchedule(section),
+        'interval' : schedule.getScheduleInterval(section),
+        'cache' : cache,
+        'timeout' : timeout,
+        'cputimeout' : cputimeout,
+    }
+
+
+def runIsolated(job):
+    """ runIsolatedAsync() for callers without an event loop.
+        """
+
+    return asyncio.run(runIsolatedAsync(job))
+
+
+async def runIsolatedAsync(job, bus=None):
+    """ Run one simulation in its private workspace and check the
+        final epoch-log line against the job's result params. The
+        output of biosim4 goes to stdout.txt and stderr.txt in the
+        workspace. Shares the event loop with the other runs of
+        runMatrix(); it must not prompt and must not touch any
+        shared file. File work that takes long (the workspace, the
+        run cache, reading the log and recording the run) is done in
+        worker threads, so that it doesn't hold up the other runs.
+        If 'bus' is an EventBus, the run emits a "progress" event
+        (run, generation) for every generation of the simulation,
+        and (run, None) when it has finished.
+        """
+
+    paths = await asyncio.to_thread(makeRunDir, job['run'])
+    params = dict(job['params'])
+    params['logdir'] = paths['logdir']
+    params['imagedir'] = paths['imagedir']
+    # the graph log command reads the shared ./logs/epoch-log.txt
+    params['updategraphlog'] = "false"
+    testlib.writeStdParams(params, os.path.join(paths['dir'], "tmp.ini"))
+
+    watcher = None
+    if job.get('watch') is not None or job.get('golden') is not None:
+        watcher = monitor.Monitor(os.path.join(paths['dir'], "logs", _results_log), job['results'],
+                                  job['watch'] if job.get('watch') is not None else monitor.GOLDEN_ONLY,
+                                  golden=job.get('golden'))
+
+    scheduler = None
+    if job.get('schedule'):
+        scheduler = schedule.Scheduler(os.path.join(paths['dir'], "tmp.ini"), params, job['schedule'],
+                                       os.path.join(paths['dir'], "logs", _results_log), job['interval'])
+        scheduler.prepare()
+
+    progress = None
+    if bus is not None:
+        def progress(child):
+            bus.emit("progress", (job['run'], child.generation))
+
+    report = {'test': job['test'], 'run': job['run'], 'dir': paths['dir'], 'cached': False}
+    # scheduled changes depend on timing, see pylib/schedule.py; a
+    # cached log would skip the check of the golden fingerprints
+    key = runcache.runKey(job['params']) \
+        if job.get('cache') and not scheduler and job.get('golden') is None else None
+    logdir = os.path.join(paths['dir'], "logs")
+    start_time = time.monotonic()
+    if await asyncio.to_thread(runcache.restore, key, logdir):
+        report['cached'] = True
+        report['error'] = None
+    else:
+        try:
+            process = await testlib.runTestAsync(paths['ini'], paths['dir'], watcher, schedule=scheduler,
+                                                 timeout=job.get('timeout'), cputimeout=job.get('cputimeout'),
+                                                 progress=progress)
+            report['error'] = None
+            report['usage'] = await asyncio.to_thread(runreport.makeRunReport, process, job['params'],
+                                                      os.path.join(logdir, _results_log), job['test'])
+            await asyncio.to_thread(runreport.writeRunReport, report['usage'], logdir)
+            if watcher and watcher.failure:
+                report['error'] = "stopped at generation %i: %s" % watcher.failure
+            elif scheduler and scheduler.late():
+                report['error'] = "the change scheduled for generation %i was applied after generation %i" \
+                                  % scheduler.late()[0]
+        except subprocess.TimeoutExpired as e:
+            report['error'] = "%s time limit of %s seconds exceeded" % (
+                "wall-clock" if e.limit == "wall" else "CPU", e.timeout)
+        except Exception as e:
+            report['error'] = str(e)
+    report['walltime'] = time.monotonic() - start_time
+    if bus is not None:
+        bus.emit("progress", (job['run'], None))
+    if report['error'] is None and not report['cached']:
+        await asyncio.to_thread(runcache.store, key, logdir, job['params'], round(report['walltime'], 3))
+
+    resdict = None
+    if report['error'] is None:
+        resdict = await asyncio.to_thread(testlib.readLog, _results_log, logdir)
+    if not resdict:
+        report['rows'] = []
+        report['passed'] = False
+    else:
+        report['results'] = resdict
+        report['rows'] = testlib.checkResults(job['results'], resdict)
+        report['passed'] = all(row[3] == "Pass" for row in report['rows'])
+
+    if 'usage' in report:
+        await asyncio.to_thread(_recordRun, report, job, os.path.join(logdir, _results_log))
+
+    return report
+
+
+def _recordRun(report, job, logfile):
+    try:
+        resultstore.recordRun(report['usage'], job['params'], logfile,
+                              job['test'], job['run'], report['passed'], report['error'])
+    except sqlite3.Error as e:
+        print("results database: %s" % e)
+
+
+def loadWallTimes():
+    """ Return the dictionary of past wall times {test: seconds}.
+        """
+
+    try:
+        with open(os.path.join(RESULTSDIR, WALLTIMES), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def saveWallTimes(walltimes):
+    """ Atomically replace the stored wall times.
+        """
+
+    Path(RESULTSDIR).mkdir(exist_ok=True)
+    path = os.path.join(RESULTSDIR, WALLTIMES)
+    tmppath = "%s.%i.tmp" % (path, os.getpid())
+    with open(tmppath, 'w') as f:
+        json.dump(walltimes, f, indent=1, sort_keys=True)
+    os.replace(tmppath, path)
+
+
+def scheduleJobs(jobs, walltimes):
+    """ Order jobs longest-first by their test's past wall time.
+        Tests that have never run are started first, since their
+        duration is unknown. Starting the longest tests first lets
+        the pool finish in roughly the time of the slowest test.
+        """
+
+    return sorted(jobs, key=lambda job: -walltimes.get(job['test'], float('inf')))
+
+
+async def showProgress(bus, interval=PROGRESS_INTERVAL):
+    """ Print the generation every unfinished run has reached, at
+        most every 'interval' seconds, from the "progress" events of
+        runIsolatedAsync() on the EventBus 'bus'.
+        """
+
+    latest = dict()
+    events = bus.subscribe("progress", batch=PROGRESS_BATCH, interval=interval)
+    try:
+        async for batch in events:
+            for run, generation in batch:
+                if generation is None:
+                    latest.pop(run, None)
+                else:
+                    latest[run] = generation
+            if latest:
+                print("      ... %s" % ", ".join("%s at generation %i" % (run, generation)
+                                                 for run, generation in sorted(latest.items())), flush=True)
+    finally:
+        events.close()
+
+
+async def _limited(semaphore, job, bus):
+    async with semaphore:
+        return await runIsolatedAsync(job, bus)
+
+
+def runJobs(queue, jobs, bus=None, follower=None):
+    """ Run the jobs in 'queue', at most 'jobs' at a time, in queue
+        order. Yield the report of each job as it completes. The
+        simulations are supervised from one event loop that runs
+        while the caller waits for the next report. The runs emit
+        their progress on the EventBus 'bus', if given (see
+        runIsolatedAsync()). The coroutine 'follower', e.g.
+        showProgress(bus), runs on the same loop until the last job
+        has finished.
+        """
+
+    loop = asyncio.new_event_loop()
+    semaphore = asyncio.Semaphore(jobs)
+    # started first, so that it subscribes before the runs emit events
+    following = loop.create_task(follower) if follower is not None else None
+    tasks = [loop.create_task(_limited(semaphore, job, bus)) for job in queue]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+            # runs that finished together are reported in queue order
+            for task in sorted(done, key=tasks.index):
+                yield task.result()
+    finally:
+        # the caller stopped early: kill and reap the remaining runs
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        if following is not None:
+            following.cancel()
+            loop.run_until_complete(asyncio.wait([following]))
+        loop.close()
+
+
+def runMatrix(thisconfig, testnames, jobs, verbose=False, watch=False, cache=True,
+              timeout=None, cputimeout=None):
+    """ Run the tests in 'testnames', at most 'jobs' at a time.
+        'timeout' and 'cputimeout' limit the seconds of each run.
+        Every PROGRESS_INTERVAL seconds, the generation each running
+        test has reached is printed. Return the number of failed tests.
+        """
+
+    walltimes = loadWallTimes()
+    queue = scheduleJobs([makeJob(thisconfig, t, watch=watch, cache=cache, timeout=timeout, cputimeout=cputimeout)
+                          for t in testnames], walltimes)
+    print("\nRunning %i test(s) with %i job(s)\n" % (len(queue), jobs))
+
+    failed = 0
+    start_time = time.monotonic()
+    bus = EventBus()
+    for report in runJobs(queue, jobs, bus, showProgress(bus)):
+        if report['error'] is None and not report['cached']:
+            # runs stopped early or cached say nothing about a test's duration
+            walltimes[report['test']] = round(report['walltime'], 3)
+        if not report['passed']:
+            failed += 1
+        print("  %s%s %s  %8.1fs%s" % (report['test'],
+                                        " " * max(1, 24 - len(report['test'])),
+                                        "Pass" if report['passed'] else "Fail",
+                                        report['walltime'],
+                                        "  (cached)" if report['cached'] else ""), flush=True)
+        if report['error'] is not None:
+            print("      %s" % report['error'])
+        if verbose or not report['passed']:
+            for row in report['rows']:
+                print("      %s = %s (expected %s) %s" % (row[0], row[2], row[1], row[3]))
+            print("      workspace: %s" % report['dir'])
+
+    saveWallTimes(walltimes)
+    print("\n%i passed, %i failed in %s seconds\n" % (len(queue) - failed, failed,
+                                                      round(time.monotonic() - start_time, 1)))
+
+    return failed
@@ -0,0 +1,104 @@
+""" Resource accounting of a simulation run. makeRunReport() combines
+    the resource usage of the biosim4 process (from os.wait4(), see
+    testlib.runTest()) with the epoch log into a dictionary that is
+    stored as run-report.json next to the epoch log:
+
+        walltime        seconds from launch to exit
+        utime, stime    user and system CPU seconds of biosim4
+        cputime         utime + stime
+        maxrss          peak resident set size in KiB
+        nvcsw, nivcsw   voluntary and involuntary context switches
+        generations     records in the epoch log
+        gens_per_sec    generations / walltime
+        steps_per_sec   generations * stepsPerGeneration / walltime
+        omp_efficiency  cputime / (walltime * numThreads); 1.0 means
+                        every OpenMP thread was busy all the time
+
+    If the population went extinct and the simulation restarted, the
+    epoch log only holds the generations since the restart, so the
+    throughput figures are lower bounds.
+    """
+
+import json
+import os
+import socket
+import sys
+import time
+
+from . import epochlog
+from . import testlib
+
+RUNREPORT = "run-report.json"
+
+
+def makeRunReport(process, params, logfile, test=None):
+    """ Return the run report of the CompletedProcess 'process'
+        returned by testlib.runTest(). 'params' are the run's
+        biosim4-style params, 'logfile' its epoch log.
+        """
+
+    effective = testlib.effectiveParams(params)
+    ru = process.rusage
+    maxrss = ru.ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS, KiB elsewhere
+        maxrss //= 1024
+    log = epochlog.EpochLog(logfile)
+    log.update()
+    generations = len(log)
+    walltime = process.walltime
+    cputime = ru.ru_utime + ru.ru_stime
+    try:
+        numthreads = max(1, int(effective.get('numthreads', 1)))
+        steps = int(effective.get('stepspergeneration', 0))
+    except ValueError:
+        numthreads, steps = 1, 0
+
+    return {
+        'test' : test,
+        'host' : socket.gethostname(),
+        'time' : time.time(),
+        'returncode' : process.returncode,
+        'numthreads' : numthreads,
+        'population' : effective.get('population'),
+        'stepspergeneration' : steps,
+        'walltime' : round(walltime, 4),
+        'utime' : round(ru.ru_utime, 4),
+        'stime' : round(ru.ru_stime, 4),
+        'cputime' : round(cputime, 4),
+        'maxrss' : maxrss,
+        'nvcsw' : ru.ru_nvcsw,
+        'nivcsw' : ru.ru_nivcsw,
+        'generations' : generations,
+        'gens_per_sec' : round(generations / walltime, 4) if walltime > 0 else None,
+        'steps_per_sec' : round(generations * steps / walltime, 2) if walltime > 0 else None,
+        'omp_efficiency' : round(cputime / (walltime * numthreads), 4) if walltime > 0 else None,
+    }
+
+
+def writeRunReport(report, logdir):
+    """ Atomically write 'report' to logdir/run-report.json and
+        return the path.
+        """
+
+    path = os.path.join(logdir, RUNREPORT)
+    tmppath = "%s.%i.tmp" % (path, os.getpid())
+    with open(tmppath, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    os.replace(tmppath, path)
+
+    return path
+
+
+def formatRunReport(report):
+    """ Return the report as lines of text for the console.
+        """
+
+    return [
+        "wall time: %.2f seconds" % report['walltime'],
+        "CPU time: %.2f seconds (user %.2f, system %.2f)" % (report['cputime'], report['utime'], report['stime']),
+        "peak RSS: %.1f MiB" % (report['maxrss'] / 1024.0),
+        "context switches: %i voluntary, %i involuntary" % (report['nvcsw'], report['nivcsw']),
+        "throughput: %s generations/s, %s sim steps/s" % (report['gens_per_sec'], report['steps_per_sec']),
+        "OpenMP efficiency: %s (%i thread(s))" % (report['omp_efficiency'], report['numthreads']),
+    ]
@@ -0,0 +1,146 @@
+""" Parameter schedules: changes to simulation parameters at given
+    generations of a running simulation. A test section of
+    testapp.ini defines them with 'schedule-<generation>' keys, each
+    a comma-separated list of biosim4 parameter assignments:
+
+        schedule-100 = barriertype=3, pointmutationrate=0.01
+        schedule-500 = challenge=7
+        schedule-interval = 0.1  seconds between polls of the epoch log
+
+    biosim4 reads its config file again after every generation, but
+    only if the file changed. A Scheduler follows the epoch log and,
+    once generation N - 2 is logged, replaces the run's temp ini file
+    with one that includes the changes of generation N. The new file
+    is written next to the old one and renamed over it, so biosim4
+    never reads a partial file, and it is in place a whole generation
+    before biosim4 reads it at the end of generation N - 1. Changes
+    therefore land exactly at generation N unless a generation takes
+    less time than the poll interval, so scheduled runs are never
+    taken from or stored in the run cache.
+
+    The earliest generation a schedule can change is 2; parameters
+    for generation 0 belong in the test's 'param-*' keys. The
+    schedule is not rewound when the population goes extinct and the
+    simulation starts over from generation 0.
+    """
+
+import os
+
+from . import epochlog
+from . import testlib
+from .threadutils import Timer
+
+SCHEDULE_INTERVAL = "0.1"
+
+
+def getSchedule(section):
+    """ Return the 'schedule-<generation>' keys of a test section
+        as a list of (generation, params) tuples ordered by
+        generation, where params is a dictionary of biosim4-style
+        params. Raise ValueError for a malformed entry.
+        """
+
+    schedule = []
+    for k, v in section.items():
+        if not k.startswith('schedule-') or k == 'schedule-interval':
+            continue
+        try:
+            generation = int(k[len('schedule-'):])
+        except ValueError:
+            raise ValueError("%s: expected schedule-<generation>" % k)
+        if generation < 2:
+            raise ValueError("%s: a schedule can change generation 2 and later, "
+                             "use param-* keys for the start of the run" % k)
+        params = dict()
+        for assignment in v.split(','):
+            if not assignment.strip():
+                continue
+            if '=' not in assignment:
+                raise ValueError("%s: expected param=value, got '%s'" % (k, assignment.strip()))
+            name, value = assignment.split('=', 1)
+            params[str.lower(name.strip())] = value.strip()
+        schedule.append((generation, params))
+
+    return sorted(schedule, key=lambda entry: entry[0])
+
+
+def getScheduleInterval(section):
+    return float(section.get('schedule-interval', SCHEDULE_INTERVAL))
+
+
+class Scheduler():
+    """ Apply a schedule, as returned by getSchedule(), to a running
+        simulation. 'inifile' is the temp ini file biosim4 was started
+        with, 'params' the biosim4-style params it holds and 'logfile'
+        the epoch log of the run.
+        """
+
+    def __init__(self, inifile, params, schedule, logfile, interval=float(SCHEDULE_INTERVAL)):
+        self.inifile = inifile
+        self.params = dict(params)
+        self.pending = list(schedule)
+        self.log = epochlog.EpochLog(logfile)
+        self.interval = interval
+        # (generation, last logged generation) of every applied change
+        self.applied = []
+        self._timer = None
+
+    def prepare(self, generation=0):
+        """ Write the temp ini file for a run that starts at
+            'generation', including every change scheduled up to it.
+            Call before the simulation starts, e.g. when resuming
+            from a checkpoint.
+            """
+        while self.pending and self.pending[0][0] <= generation:
+            entry = self.pending.pop(0)
+            self.params.update(entry[1])
+            self.applied.append((entry[0], None))
+        self._write()
+
+    def start(self, process=None):
+        """ Start polling the epoch log.
+            """
+        self._timer = Timer(self.interval)
+        self._timer.connect(self._tick)
+
+    def stop(self):
+        """ Stop polling.
+            """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _tick(self, sender, data):
+        self.poll()
+
+    def poll(self):
+        """ Apply the changes that are due. Return their number.
+            """
+        if not self.pending:
+            return 0
+        self.log.update()
+        if not len(self.log):
+            return 0
+        lastgen = self.log['generation'][-1]
+        count = 0
+        while self.pending and self.pending[0][0] - 2 <= lastgen:
+            entry = self.pending.pop(0)
+            self.params.update(entry[1])
+            self.applied.append((entry[0], lastgen))
+            count += 1
+        if count:
+            self._write()
+        # records are only needed for the last generation
+        self.log.seek(self.log.position())
+        return count
+
+    def late(self):
+        """ Return the applied changes that may have missed their
+            generation, because the simulator had already logged it.
+            """
+        return [entry for entry in self.applied if entry[1] is not None and entry[1] >= entry[0] - 1]
+
+    def _write(self):
+        tmppath = "%s.%i.tmp" % (self.inifile, os.getpid())
+        testlib.writeStdParams(self.params, tmppath)
+        os.replace(tmppath, self.inifile)
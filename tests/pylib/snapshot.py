@@ -0,0 +1,133 @@
+""" Reader for the binary population snapshots the simulator writes
+    to <logDir>/snapshot-NNNNNN.bin when snapshotStride > 0 (see
+    src/snapshot.cpp for the layout). A Snapshot maps the file with
+    numpy.memmap and exposes every section as an array view into the
+    mapping, so nothing is parsed or copied and only the pages that
+    are actually read are loaded:
+
+        snap = snapshot.Snapshot("logs/snapshot-000100.bin")
+        alive = snap.alive.astype(bool)
+        pop = snap.population()            # a genome.Population
+
+    birthLoc holds Indiv::birthLoc as the simulator has it, which
+    Indiv::initialize() currently leaves at (0, 0).
+
+    Requires numpy.
+    """
+
+from pathlib import Path
+
+import numpy as np
+
+from . import genome
+
+MAGIC = b"BS4SNAP\0"
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('generation', '<u4'),
+    ('population', '<u4'),
+    ('sizeX', '<u2'),
+    ('sizeY', '<u2'),
+    ('signalLayers', '<u2'),
+    ('reserved0', '<u2'),
+    ('reserved1', '<u4'),
+    ('numGenes', '<u8'),
+    ('indivOffset', '<u8'),
+    ('genomeOffsetsOffset', '<u8'),
+    ('genesOffset', '<u8'),
+    ('gridOffset', '<u8'),
+    ('signalsOffset', '<u8'),
+    ('fileSize', '<u8'),
+    ('reserved2', '<u8'),
+])
+
+INDIV = np.dtype([
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('birthX', '<i2'),
+    ('birthY', '<i2'),
+    ('age', '<u4'),
+    ('alive', 'u1'),
+    ('reserved', 'u1', (3,)),
+])
+
+
+class Snapshot():
+    """ A memory-mapped snapshot. Array attributes are read-only views:
+
+        indivs       structured array (x, y, birthX, birthY, age, alive),
+                     row i is the individual with index i + 1
+        loc          (population, 2) int16 view of x, y
+        birthLoc     (population, 2) int16 view of birthX, birthY
+        alive        uint8 per individual
+        offsets      genome offsets, population + 1 entries
+        genes        uint32 gene words of all genomes
+        grid         (sizeX, sizeY) uint16, grid[x, y] as in Grid
+        signals      (signalLayers, sizeX, sizeY) uint8
+        """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+        if len(self._map) < HEADER.itemsize:
+            raise ValueError("%s: too short for a snapshot" % self.path)
+        header = self._map[:HEADER.itemsize].view(HEADER)[0]
+        if bytes(header['magic']).ljust(8, b"\0") != MAGIC:
+            raise ValueError("%s: not a biosim4 snapshot" % self.path)
+        if header['version'] != VERSION:
+            raise ValueError("%s: snapshot version %i, expected %i" % (self.path, header['version'], VERSION))
+        if header['fileSize'] != len(self._map):
+            raise ValueError("%s: %i bytes, header says %i" % (self.path, len(self._map), header['fileSize']))
+        self.header = {name: int(header[name]) for name in HEADER.names if name != 'magic'}
+
+        self.generation = self.header['generation']
+        n = self.header['population']
+        sizeX = self.header['sizeX']
+        sizeY = self.header['sizeY']
+        layers = self.header['signalLayers']
+
+        self.indivs = self._section('indivOffset', INDIV, n)
+        raw = self._section('indivOffset', np.dtype('<i2'), n * INDIV.itemsize // 2).reshape(n, INDIV.itemsize // 2)
+        self.loc = raw[:, 0:2]
+        self.birthLoc = raw[:, 2:4]
+        self.alive = self.indivs['alive']
+        # written as uint64; int64 is what numpy indexing wants, and offsets stay < 2**63
+        self.offsets = self._section('genomeOffsetsOffset', np.dtype('<i8'), n + 1)
+        self.genes = self._section('genesOffset', np.dtype('<u4'), self.header['numGenes'])
+        self.grid = self._section('gridOffset', np.dtype('<u2'), sizeX * sizeY).reshape(sizeX, sizeY)
+        self.signals = self._section('signalsOffset', np.dtype('u1'), layers * sizeX * sizeY).reshape(layers, sizeX, sizeY)
+
+    def _section(self, offsetName, dtype, count):
+        start = self.header[offsetName]
+        return self._map[start:start + count * dtype.itemsize].view(dtype)
+
+    def __len__(self):
+        return self.header['population']
+
+    def genome(self, i):
+        """ Return the genes of the individual in row i (index i + 1).
+            """
+        return self.genes[self.offsets[i]:self.offsets[i + 1]]
+
+    def population(self, alive_only=False):
+        """ Return the genomes as a genome.Population sharing this
+            snapshot's memory, with ids set to the individual indexes.
+            With alive_only=True only the living individuals are
+            included (which copies their genes).
+            """
+        n = len(self)
+        ids = np.arange(1, n + 1)
+        gens = np.full(n, self.generation)
+        pop = genome.Population(self.genes, self.offsets, ids, gens)
+        if alive_only:
+            pop = pop.select(self.alive != 0)
+        return pop
+
+
+def listSnapshots(logdir):
+    """ Return the snapshot paths in 'logdir', by generation.
+        """
+    return sorted(Path(logdir).glob("snapshot-[0-9]*.bin"))
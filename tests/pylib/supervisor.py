@@ -0,0 +1,227 @@
+""" Supervision of biosim4 processes on an asyncio event loop.
+    supervise() starts the simulator without a shell and, without a
+    thread per child:
+
+        - streams its stdout and stderr line by line into per-run
+          files and a bounded ring buffer of the most recent lines,
+        - parses the "Gen N, M survivors" progress lines as they
+          arrive,
+        - applies a wall-clock timeout (SIGTERM, then SIGKILL) and a
+          CPU-time limit (RLIMIT_CPU, which the kernel enforces with
+          SIGXCPU),
+        - waits for the exit on a pidfd where available and reaps the
+          child with os.wait4() to get its resource usage.
+
+    Any number of supervise() coroutines can share one event loop;
+    runner.runJobs() runs a whole test matrix that way.
+    """
+
+import asyncio
+import math
+import os
+import re
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+# lines kept in Child.lines
+RINGSIZE = 200
+# seconds between SIGTERM and SIGKILL, and between the soft and hard CPU limit
+KILL_GRACE = 5.0
+# seconds to wait for the output pipes to close after the exit; a
+# process started by biosim4 (e.g. gnuplot) may keep them open
+DRAIN_TIMEOUT = 5.0
+# longest line the readers accept
+LINE_LIMIT = 1 << 20
+
+PROGRESS = re.compile(r"^Gen (\d+), (\d+) survivors")
+
+
+class Child():
+    """ A supervised process. Like subprocess.Popen it has 'args',
+        'pid' and 'returncode', which is set once the process has been
+        reaped. After supervise() returns, 'rusage' is the resource
+        usage of the process, 'walltime' its run time in seconds and
+        'timedout' is None, "wall" or "cpu". 'generation' and
+        'survivors' are taken from the last progress line, and
+        'lines' holds the last output lines as (stream, text) tuples.
+        """
+
+    def __init__(self, popen, ringsize):
+        self.popen = popen
+        self.args = popen.args
+        self.pid = popen.pid
+        self.rusage = None
+        self.walltime = None
+        self.timedout = None
+        self.generation = None
+        self.survivors = None
+        self.lines = deque(maxlen=ringsize)
+
+    @property
+    def returncode(self):
+        return self.popen.returncode
+
+    def tail(self, count=20):
+        """ Return the last 'count' output lines as one string.
+            """
+        return "\n".join(text for stream, text in list(self.lines)[-count:])
+
+
+def limitCpu(pid, seconds):
+    """ Limit the CPU time of the process 'pid'. Returns False where
+        the platform has no prlimit().
+        """
+    if not hasattr(resource, 'prlimit'):
+        return False
+    soft = max(1, int(math.ceil(seconds)))
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, soft + int(KILL_GRACE)))
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+async def _pump(stream, name, child, output, echo, progress):
+    """ Copy the lines of the pipe 'stream' to 'output', the ring
+        buffer and, with 'echo', to our own stdout.
+        """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    transport, protocol = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream)
+    try:
+        while True:
+            try:
+                raw = await reader.readline()
+            except ValueError:
+                # longer than LINE_LIMIT, keep it in pieces
+                raw = await reader.read(LINE_LIMIT)
+            if not raw:
+                break
+            line = raw.decode(errors='replace')
+            if output is not None:
+                output.write(line)
+            if echo:
+                sys.stdout.write(line)
+            text = line.rstrip("\n")
+            child.lines.append((name, text))
+            match = PROGRESS.match(text)
+            if match:
+                child.generation = int(match.group(1))
+                child.survivors = int(match.group(2))
+                if progress is not None:
+                    progress(child)
+    finally:
+        transport.close()
+        if echo:
+            sys.stdout.flush()
+
+
+async def _exited(pid):
+    """ Return once the process 'pid' has exited, without reaping it.
+        """
+    loop = asyncio.get_running_loop()
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is not None:
+        done = loop.create_future()
+        loop.add_reader(fd, lambda: done.done() or done.set_result(None))
+        try:
+            await done
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+        return
+    # no pidfd: poll
+    while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+        await asyncio.sleep(0.05)
+
+
+def _signal(child, sig, lock):
+    with lock:
+        # returncode is set once the process has been reaped
+        if child.returncode is None:
+            os.kill(child.pid, sig)
+
+
+async def supervise(args, cwd=None, stdout=None, stderr=None, timeout=None, cputimeout=None,
+                    ringsize=RINGSIZE, echo=False, progress=None, started=None, lock=None):
+    """ Run the command 'args' (a list, no shell) in 'cwd' and return
+        its Child once it has exited. 'stdout' and 'stderr' are paths
+        of files that receive the streams; both may name the same
+        file. 'timeout' is the wall-clock limit and 'cputimeout' the
+        CPU-time limit in seconds. With 'echo' the output is also
+        printed. 'progress(child)' is called after every progress
+        line, 'started(child)' right after the process started. The
+        child is signalled and reaped while holding 'lock', so the
+        same lock protects other threads that signal it (see
+        monitor.Monitor) from signalling a reused pid.
+        """
+    loop = asyncio.get_running_loop()
+    lock = lock or threading.Lock()
+    files = dict()
+    for path in (stdout, stderr):
+        if path is not None and path not in files:
+            files[path] = open(path, 'w')
+    start_time = time.monotonic()
+    popen = subprocess.Popen(args, cwd=cwd, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    child = Child(popen, ringsize)
+    timers = []
+    pumps = []
+    try:
+        if cputimeout is not None:
+            limitCpu(child.pid, cputimeout)
+        if started is not None:
+            started(child)
+        pumps.append(asyncio.ensure_future(_pump(popen.stdout, 'stdout', child, files.get(stdout), echo, progress)))
+        pumps.append(asyncio.ensure_future(_pump(popen.stderr, 'stderr', child, files.get(stderr), echo, None)))
+
+        def expire():
+            child.timedout = "wall"
+            _signal(child, signal.SIGTERM, lock)
+            timers.append(loop.call_later(KILL_GRACE, _signal, child, signal.SIGKILL, lock))
+        if timeout is not None:
+            timers.append(loop.call_later(timeout, expire))
+
+        await _exited(child.pid)
+        with lock:
+            pid, status, child.rusage = os.wait4(child.pid, 0)
+            popen.returncode = os.waitstatus_to_exitcode(status)
+        child.walltime = time.monotonic() - start_time
+        if popen.returncode == -signal.SIGXCPU or (cputimeout is not None and popen.returncode == -signal.SIGKILL
+                                                   and child.rusage.ru_utime + child.rusage.ru_stime >= cputimeout):
+            child.timedout = "cpu"
+
+        done, pending = await asyncio.wait(pumps, timeout=DRAIN_TIMEOUT)
+        for pump in done:
+            pump.result()
+    finally:
+        for timer in timers:
+            timer.cancel()
+        for pump in pumps:
+            pump.cancel()
+        if popen.returncode is None:
+            # cancelled or failed: don't leave the simulator running
+            _signal(child, signal.SIGKILL, lock)
+            with lock:
+                pid, status = os.waitpid(child.pid, 0)
+                popen.returncode = os.waitstatus_to_exitcode(status)
+        for f in files.values():
+            f.close()
+        popen.stdout.close()
+        popen.stderr.close()
+
+    return child
+
+
+def run(args, **kwargs):
+    """ supervise() for callers without an event loop.
+        """
+    return asyncio.run(supervise(args, **kwargs))
@@ -0,0 +1,267 @@
+""" Parameter sweeps. A test section of testapp.ini names the params
+    to vary with 'sweep-*' keys; every other param of the section
+    stays fixed:
+
+        sweep-population = 100, 500, 1000        a list of values
+        sweep-genomemaxlength = range(8, 33, 8)  start, stop (excluded), step
+        sweep-pointmutationrate = uniform(0.0001, 0.01)
+        sweep-genecrossoverrate = loguniform(0.001, 0.5)
+        sweep-maxnumberneurons = randint(1, 8)   both ends included
+        sweep-sizey = sizex                      always the value of sizex;
+                                                 if sizex is not swept, its
+                                                 fixed value
+
+    Without --samples the sweep runs the full grid of all lists and
+    ranges. With --samples N it draws N random points, picking list
+    and range values uniformly; distributions always need --samples.
+    The seed makes the drawn points reproducible.
+
+    Each finished run is appended to ./results/sweep-<test>.jsonl,
+    keyed by testlib.paramsHash() of its full parameter set (the
+    biosim4.ini defaults overlaid with the test params and the sweep
+    point). A sweep that is interrupted and started again skips the
+    points whose key is already recorded.
+    """
+
+import itertools
+import json
+import math
+import os
+import random
+import re
+import shutil
+import time
+from pathlib import Path
+
+from . import runner
+from . import testlib
+
+DISTRIBUTIONS = ['uniform', 'loguniform', 'randint', 'range']
+
+
+def getSweepSpecs(section):
+    """ Parse the 'sweep-*' keys of a test section. Return a
+        dictionary {param: spec} where spec is one of
+        ('choice', [values]), ('uniform', lo, hi), ('loguniform', lo, hi),
+        ('randint', lo, hi) or ('link', param). Raise ValueError on a
+        malformed spec.
+        """
+
+    raw = dict()
+    for k, v in section.items():
+        if k.startswith('sweep-'):
+            # sweep-param-population is the same as sweep-population
+            name = re.sub(r'^param-', '', k[len('sweep-'):])
+            raw[name] = str.strip(v)
+
+    # values of the params that are not swept, for links to them
+    try:
+        fixed = testlib.effectiveParams(testlib.getTestParams(section))
+    except OSError:
+        fixed = testlib.getTestParams(section)
+
+    specs = dict()
+    for k, v in raw.items():
+        m = re.match(r'^(\w+)\s*\((.*)\)$', v)
+        if m and m.group(1) in DISTRIBUTIONS:
+            try:
+                args = [float(a) for a in str.split(m.group(2), ",")]
+            except ValueError:
+                raise ValueError("sweep-%s: arguments of %s() must be numbers" % (k, m.group(1)))
+            if m.group(1) == 'range':
+                if not 1 <= len(args) <= 3:
+                    raise ValueError("sweep-%s: range() takes 1 to 3 arguments" % k)
+                values = range(*[int(a) for a in args])
+                if len(values) == 0:
+                    raise ValueError("sweep-%s: empty range" % k)
+                specs[k] = ('choice', [str(i) for i in values])
+                continue
+            if len(args) != 2 or args[0] > args[1]:
+                raise ValueError("sweep-%s: %s() takes two arguments lo <= hi" % (k, m.group(1)))
+            if m.group(1) == 'loguniform' and args[0] <= 0:
+                raise ValueError("sweep-%s: loguniform() needs lo > 0" % k)
+            if m.group(1) == 'randint':
+                args = [int(a) for a in args]
+            specs[k] = (m.group(1), args[0], args[1])
+        elif str.lower(v) in raw and str.lower(v) != k:
+            specs[k] = ('link', str.lower(v))
+        elif str.lower(v) in fixed and str.lower(v) != k:
+            specs[k] = ('choice', [fixed[str.lower(v)]])
+        else:
+            values = [str.strip(x) for x in str.split(v, ",") if str.strip(x)]
+            if not values:
+                raise ValueError("sweep-%s has no values" % k)
+            specs[k] = ('choice', values)
+
+    for k, spec in specs.items():
+        if spec[0] == 'link' and specs[spec[1]][0] == 'link':
+            raise ValueError("sweep-%s: %s is itself a link" % (k, spec[1]))
+
+    return specs
+
+
+def _resolveLinks(point, specs):
+    for k, spec in specs.items():
+        if spec[0] == 'link':
+            point[k] = point[spec[1]]
+    return point
+
+
+def gridPoints(specs):
+    """ Return the list of all points of a grid sweep, each a
+        dictionary {param: value}.
+        """
+
+    names = sorted(k for k, spec in specs.items() if spec[0] == 'choice')
+    for k, spec in specs.items():
+        if spec[0] not in ['choice', 'link']:
+            raise ValueError("sweep-%s is a distribution, use --samples N" % k)
+
+    points = list()
+    for values in itertools.product(*[specs[k][1] for k in names]):
+        points.append(_resolveLinks(dict(zip(names, values)), specs))
+
+    return points
+
+
+def samplePoints(specs, samples, seed=0):
+    """ Return 'samples' random points drawn from 'specs' with a
+        generator seeded by 'seed'.
+        """
+
+    rng = random.Random(seed)
+    names = sorted(k for k, spec in specs.items() if spec[0] != 'link')
+    points = list()
+    for i in range(samples):
+        point = dict()
+        for k in names:
+            spec = specs[k]
+            if spec[0] == 'choice':
+                point[k] = rng.choice(spec[1])
+            elif spec[0] == 'uniform':
+                point[k] = "%.6g" % rng.uniform(spec[1], spec[2])
+            elif spec[0] == 'loguniform':
+                point[k] = "%.6g" % math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2])))
+            elif spec[0] == 'randint':
+                point[k] = str(rng.randint(spec[1], spec[2]))
+        points.append(_resolveLinks(point, specs))
+
+    return points
+
+
+def resultsPath(testname):
+    return os.path.join(runner.RESULTSDIR, "sweep-%s.jsonl" % testname)
+
+
+def loadDone(path):
+    """ Return the set of keys of the successful runs recorded in
+        the results file 'path'. A partially written last line, left
+        by an interrupted sweep, is ignored.
+        """
+
+    done = set()
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('error') is None and entry.get('results'):
+                    done.add(entry['key'])
+    except OSError:
+        pass
+
+    return done
+
+
+def appendResult(path, entry):
+    """ Append one result line to 'path' and flush it to disk, so an
+        interrupted sweep loses at most the runs still in progress.
+        """
+
+    with open(path, 'a+') as f:
+        # complete a line left partial by an interrupted sweep
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                f.write("\n")
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def sweep(thisconfig, testname, jobs, samples=None, seed=0, verbose=False):
+    """ Run the sweep defined by the 'sweep-*' keys of 'testname' in
+        a pool of 'jobs' worker processes, skipping points already
+        recorded in the results file. Return the number of failed
+        runs, or None if the sweep is not defined properly.
+        """
+
+    section = testlib.getTestSection(thisconfig, testname)
+    try:
+        specs = getSweepSpecs(section)
+        if not specs:
+            print("test %s has no sweep-* keys" % testname)
+            return None
+        points = samplePoints(specs, samples, seed) if samples else gridPoints(specs)
+    except ValueError as e:
+        print("sweep error: %s" % e)
+        return None
+
+    Path(runner.RESULTSDIR).mkdir(exist_ok=True)
+    path = resultsPath(testname)
+    done = loadDone(path)
+    queue = list()
+    keys = set()
+    for point in points:
+        job = runner.makeJob(thisconfig, testname, overrides=point)
+        key = testlib.paramsHash(testlib.effectiveParams(job['params']))
+        if key in done or key in keys:
+            continue
+        keys.add(key)
+        job['run'] = "%s-sweep-%s" % (testname, key[:12])
+        job['key'] = key
+        job['point'] = point
+        queue.append(job)
+
+    print("\nSweeping %s: %i point(s), %i already done, %i to run with %i job(s)\n"
+          % (testname, len(points), len(points) - len(queue), len(queue), jobs))
+    print("results: %s\n" % path)
+
+    failed = 0
+    count = 0
+    jobsbyrun = dict((job['run'], job) for job in queue)
+    start_time = time.monotonic()
+    for report in runner.runJobs(queue, jobs):
+        count += 1
+        job = jobsbyrun[report['run']]
+        entry = {
+            'key' : job['key'],
+            'test' : testname,
+            'point' : job['point'],
+            'params' : testlib.effectiveParams(job['params']),
+            'results' : report.get('results'),
+            'walltime' : round(report['walltime'], 3),
+            'usage' : report.get('usage'),
+            'error' : report['error'],
+            'finished' : time.time(),
+        }
+        appendResult(path, entry)
+        pointstr = " ".join("%s=%s" % (k, v) for k, v in sorted(job['point'].items()))
+        if report['error'] is None and report.get('results'):
+            r = report['results']
+            print("  [%i/%i] %s  survivors %i  diversity %s  (%.1fs)"
+                  % (count, len(queue), pointstr, r['survivors'], r['diversity'], report['walltime']),
+                  flush=True)
+            if not verbose:
+                shutil.rmtree(report['dir'], ignore_errors=True)
+        else:
+            failed += 1
+            print("  [%i/%i] %s  failed: %s\n      workspace: %s"
+                  % (count, len(queue), pointstr, report['error'], report['dir']), flush=True)
+
+    print("\n%i run(s) completed, %i failed in %s seconds\n"
+          % (count - failed, failed, round(time.monotonic() - start_time, 1)))
+
+    return failed
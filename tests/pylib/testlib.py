@@ -3,12 +3,22 @@
     """
 
 from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import struct
 import subprocess
 #from pylib import config
+from . import epochlog
+from . import supervisor
 
 global TEMPinifile
 TEMPinifile = None
 
+# EpochLog objects by log file path, see getEpochLog()
+_epochlogs = dict()
+
 
 #TODO initialize object (perhaps instantiate a class singleton)?
 # attributes: sections, active class, etc 
@@ -150,10 +160,96 @@ def loadStdParamsFromFile(thisconfig, testname, param_src):
         print("loadStdParams() exception: %s" % e)
 
 
-def writeStdTestFile(thisconfig, testname):
+def getTestParams(section, overrides=None):
+    """ Convert the test-style 'param-*' keys of a test section
+        to a dictionary of biosim4-style params, e.g.
+        param-maxgenerations -> maxgenerations
+        Values in 'overrides' replace or extend the section's params.
+        """
+
+    params = dict()
+    for k, v in section.items():
+        if k.startswith('param-'):
+            params[k[len('param-'):]] = v
+    if overrides:
+        for k, v in overrides.items():
+            params[str.lower(k)] = str(v)
+
+    return params
+
+
+def readDefaultParams(param_src='../biosim4.ini'):
+    """ Quietly read the biosim4 default parameters into a
+        dictionary with lower case keys, the way biosim4 itself
+        parses them: '#' starts a comment, whitespace is ignored.
+        """
+
+    params = dict()
+    with open(param_src, 'r') as src:
+        for line in src:
+            line = str.split(line, "#")[0]
+            if "=" not in line:
+                continue
+            k, v = str.split(line, "=", 1)
+            params[str.lower("".join(k.split()))] = "".join(v.split())
+
+    return params
+
+
+def effectiveParams(params, param_src='../biosim4.ini'):
+    """ Return the parameters a simulation actually runs with: the
+        biosim4.ini defaults overlaid with the biosim4-style 'params'
+        (e.g. from getTestParams()).
+        """
+
+    effective = readDefaultParams(param_src)
+    for k, v in params.items():
+        effective[str.lower(k)] = "".join(str(v).split())
+
+    return effective
+
+
+# params that only name output locations; they don't change results
+_LOCATIONPARAMS = ['logdir', 'imagedir']
+
+def paramsHash(params, exclude=_LOCATIONPARAMS):
+    """ Return a hex digest that identifies the parameter set 'params'
+        regardless of key order, key case and number formatting
+        (e.g. '0.50' and '.5'). Keys in 'exclude' are ignored.
+        """
+
+    normalized = dict()
+    for k, v in params.items():
+        k = str.lower(k)
+        if k in exclude:
+            continue
+        v = "".join(str(v).split())
+        try:
+            number = float(v)
+            v = repr(int(number)) if number == int(number) and "e" not in v.lower() else repr(number)
+        except (ValueError, OverflowError):
+            v = str.lower(v)
+        normalized[k] = v
+
+    text = json.dumps(normalized, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def writeStdParams(params, path):
+    """ Write a dictionary of biosim4-style params to the
+        biosim4 style INI file 'path'.
+        """
+
+    with open(path, 'w') as ini:
+        for k, v in params.items():
+            ini.write(k + "= " + v + "\n")
+
+
+def writeStdTestFile(thisconfig, testname, overrides=None):
     """ Write a biosim4 style INI file prior to running
         a sim test. Test-style params are converted to
         biosim4-style params before being written to file.
+        Values in 'overrides' replace or extend the test's params.
         """
     # see https://realpython.com/python-pathlib/
     # can also use methods to Path
@@ -169,28 +265,127 @@ def writeStdTestFile(thisconfig, testname):
         abspath = relpath.resolve()
         if checkFileExists(abspath, create=True):
             print("using temp file ", abspath)
-            with open(abspath, 'w') as ini:
-                for k, v in s.items():
-                    if 'param' in k:
-                        p = str.split(k, '-')
-                        ini.write(p[1] + "= " + v + "\n")
+            writeStdParams(getTestParams(s, overrides), abspath)
 
     except Exception as e:
         print("writeTestFile() exception: %s" % e)
 
     
-def runTest():
-    """ Execute the biosim4 binary using the 'subprocess' module
+def readCheckpointHeader(path):
+    """ Return the generation a biosim4 checkpoint file resumes at
+        and the sizes the epoch log and the fingerprint file had
+        when it was written, as a dictionary with keys 'generation',
+        'logsize' and 'fingerprintsize'.
+        """
+
+    with open(path, 'rb') as f:
+        # see saveCheckpoint() in src/checkpoint.cpp
+        header = f.read(44)
+    magic, version, generation = struct.unpack_from('<8sII', header, 0)
+    if magic != b"BS4CKPT\0" or version != 2:
+        raise ValueError("%s is not a biosim4 checkpoint" % path)
+    logsize, fingerprintsize = struct.unpack_from('<QQ', header, 28)
+
+    return {'generation': generation, 'logsize': logsize, 'fingerprintsize': fingerprintsize}
+
+
+def runTest(inifile=None, outdir=None, monitor=None, resume=None, schedule=None,
+            timeout=None, cputimeout=None, echo=None):
+    """ Execute the biosim4 binary, see runTestAsync(). For callers
+        without an event loop.
+        """
+
+    return asyncio.run(runTestAsync(inifile, outdir, monitor, resume, schedule, timeout, cputimeout, echo))
+
+
+async def runTestAsync(inifile=None, outdir=None, monitor=None, resume=None, schedule=None,
+                       timeout=None, cputimeout=None, echo=None, progress=None):
+    """ Execute the biosim4 binary without a shell, supervised by
+        the event loop (see pylib/supervisor.py).
+        'inifile' is relative to the project root and defaults to
+        the shared temp file in ./tests/configs/. If 'outdir' is
+        given, the simulator's stdout and stderr are written to
+        stdout.txt and stderr.txt in it; they are echoed to the
+        terminal if 'echo' is true, which is the default without
+        'outdir'. If a monitor.Monitor is given,
+        it follows the epoch log while the simulation runs and may
+        terminate it early; check monitor.failure afterwards.
+        'resume' is the path of a checkpoint file, relative to the
+        project root, to continue a simulation from. A
+        schedule.Scheduler given as 'schedule' changes parameters
+        of the running simulation. 'timeout' and 'cputimeout' limit
+        the wall-clock and CPU time of the run in seconds; a run
+        that exceeds either raises subprocess.TimeoutExpired, with
+        an extra attribute 'limit' of "wall" or "cpu".
+        'progress(child)' is called with the supervisor.Child after
+        every "Gen N" progress line of the simulator.
+        The returned CompletedProcess has extra attributes:
+        'rusage', the resource usage of the biosim4 process as
+        returned by os.wait4(), 'walltime' in seconds, 'generation'
+        from the last progress line and 'lines', the last lines of
+        output.
         """
 
     global TEMPinifile
 
-    relpath = "./tests/configs/%s" % TEMPinifile
-    shellcmd = "./bin/Release/biosim4 %s" % relpath
-    print("Running the simulation...\n")
-    # launch biosim4
-    process = subprocess.run(shellcmd, cwd='../', shell=True, capture_output=False, text=True, check=True)
-    
+    relpath = inifile or "./tests/configs/%s" % TEMPinifile
+    args = ["./bin/Release/biosim4", relpath]
+    if resume is not None:
+        args.append(resume)
+    if echo is None:
+        echo = outdir is None
+    if echo:
+        print("Running the simulation...\n")
+    # a stale log from a previous run would look like a restart, or
+    # make scheduled changes early; biosim4 truncates the logs of a
+    # resumed run to their size at the checkpoint
+    sizes = {}
+    if resume is not None and (monitor is not None or schedule is not None):
+        sizes = readCheckpointHeader(Path("..", resume))
+    for follower in (monitor, schedule):
+        if follower is None:
+            continue
+        logdir = os.path.dirname(follower.log.filename)
+        for name, key in [("epoch-log.txt", 'logsize'), ("fingerprints.txt", 'fingerprintsize')]:
+            try:
+                if resume is None:
+                    Path(logdir, name).unlink()
+                else:
+                    os.truncate(os.path.join(logdir, name), sizes[key])
+            except OSError:
+                pass
+
+    def started(child):
+        if monitor is not None:
+            monitor.start(child)
+        if schedule is not None:
+            schedule.start(child)
+
+    stdout = os.path.join(outdir, "stdout.txt") if outdir is not None else None
+    stderr = os.path.join(outdir, "stderr.txt") if outdir is not None else None
+    try:
+        child = await supervisor.supervise(args, cwd='../', stdout=stdout, stderr=stderr,
+                                           timeout=timeout, cputimeout=cputimeout, echo=echo,
+                                           progress=progress, started=started, lock=monitor.lock if monitor is not None else None)
+    finally:
+        if schedule is not None:
+            schedule.stop()
+        if monitor is not None:
+            monitor.stop()
+    if child.timedout is not None:
+        error = subprocess.TimeoutExpired(args, timeout if child.timedout == "wall" else cputimeout,
+                                          output=child.tail())
+        # "wall" or "cpu"
+        error.limit = child.timedout
+        raise error
+    if child.returncode != 0 and (monitor is None or monitor.failure is None):
+        raise subprocess.CalledProcessError(child.returncode, args, output=child.tail())
+
+    process = subprocess.CompletedProcess(args, child.returncode)
+    process.rusage = child.rusage
+    process.walltime = child.walltime
+    process.generation = child.generation
+    process.lines = list(child.lines)
     return process
 
 
@@ -238,24 +433,63 @@ def showResultParams(resultdict):
         print("\nthis test has no result params defined")
 
 
-def readLog(results_log):
+def checkResults(rp, resdict):
+    """ Non-interactive counterpart of resultsAnalysis(): compare
+        the actual results in 'resdict' (as returned by readLog())
+        against the result params 'rp' (as returned by
+        getResultParams()). Return a list of
+        (result, expected, actual, 'Pass'|'Fail') tuples.
+        """
+
+    rows = list()
+    for k, v in resdict.items():
+        # epoch-log column names map to result param names
+        rstr = {'generation': 'generations', 'genomeSize': 'genomesize'}.get(k, k)
+        if k in ['survivors', 'diversity']:
+            minstr = rstr + '-min'
+            maxstr = rstr + '-max'
+            if minstr in rp and maxstr in rp:
+                expected = "%s - %s" % (rp[minstr], rp[maxstr])
+                passed = rp[minstr] <= v <= rp[maxstr]
+            else:
+                expected = "NA"
+                passed = False
+        elif rstr in rp:
+            expected = rp[rstr]
+            passed = v == rp[rstr]
+        else:
+            expected = "NA"
+            passed = False
+        rows.append((k, expected, v, "Pass" if passed else "Fail"))
+
+    return rows
+
+
+def getEpochLog(results_log, logdir='../logs'):
+    """ Return the EpochLog object for 'logdir/results_log',
+        updated with any lines appended since the last call. The
+        object is cached, so any generation range can be queried
+        (e.g. getEpochLog(...).select(100, 200)) without parsing
+        the file again.
+        """
+    logfile = '%s/%s' % (logdir, results_log)
+    if logfile not in _epochlogs:
+        _epochlogs[logfile] = epochlog.EpochLog(logfile)
+    log = _epochlogs[logfile]
+    log.update()
+
+    return log
+
+
+def readLog(results_log, logdir='../logs'):
     """ Read the biosim4 log file and return the last line.
         return a dictionary of results
         """
-    logfile = '../logs/%s' % results_log
-    with open(logfile, 'r') as log:
-        for line in log:
-            pass
-        last_line = line
+    logfile = '%s/%s' % (logdir, results_log)
     try:
-        reslist = str.split(last_line)
-        resdict = {
-            'generation' : int(reslist[0]),
-            'survivors' : int(reslist[1]),
-            'diversity' : float(reslist[2]),
-            'genomeSize' : int(reslist[3]),
-            'kills' : int(reslist[4])
-        }
+        # seeks backwards from the end, the rest of the file is not read
+        resdict = epochlog.EpochLog(logfile).last()
+        assert resdict, "no complete record in %s" % logfile
         return resdict
     except Exception as e:
         print("readLog() exception:\n%s" % e)
@@ -4,7 +4,13 @@
 """ Thread utility functions
     """
 
+import asyncio
+import heapq
+import itertools
+import logging
+import os
 import threading
+import time
 import weakref
 import inspect
 import traceback
@@ -22,7 +28,7 @@ def stop_thread(thread_obj):
     """ stop thread execution
         """
     result = thread_obj.join(3.0)
-    alive = thread_obj.isAlive()
+    alive = thread_obj.is_alive()
     return (result,alive)
 
 
@@ -30,17 +36,22 @@ class Signal():
     """ Callback functions (so called slots) can be connected
         to a signal and will be called when the signal is called
         (Signal implements __call__).
-        The slots receive two arguments: the sender of the signal and a custom data object. Two different threads won't be allowed to send signals at the same time application-wide,
-        concurrent threads will have to wait until the lock is
-        releaesed again.
-        The lock allows recursive reentry of the same thread to
-        avoid deadlocks when a slot wants to send a signal itself.
+        The slots receive two arguments: the sender of the signal and a custom data object. Each signal has its own lock that
+        only guards its list of slots; the slots are called outside
+        of any lock, so threads emitting different signals (or the
+        same signal) never wait for each other.
+        A slot may send a signal itself, or connect and disconnect
+        slots, without deadlocking.
+        The class-wide Signal._lock is no longer taken by signals.
+        It remains available to callers that need application-wide
+        mutual exclusion, e.g. TestConfig.write_config_setting().
         """
 
     _lock = threading.RLock()
     signal_error = None
 
     def __init__(self):
+        self._slots_lock = threading.Lock()
         self._functions = weakref.WeakSet()
         self._methods = weakref.WeakKeyDictionary()
 
@@ -58,71 +69,337 @@ class Signal():
         The parameter slot can be a funtion that takes exactly 2 arguments or a method that takes self plus 2 more
         arguments, or it can even be even another signal. the first argument is a reference to the sender of the signal and the second argument is the payload. The payload can be anything, it totally depends on the sender and type of the signal.
         """
-        if inspect.ismethod(slot):
-            if slot.__self__ not in self._methods:
-                self._methods[slot.__self__] = set()
-            self._methods[slot.__self__].add(slot.__func__)
-        else:
-            self._functions.add(slot)
+        with self._slots_lock:
+            if inspect.ismethod(slot):
+                if slot.__self__ not in self._methods:
+                    self._methods[slot.__self__] = set()
+                self._methods[slot.__self__].add(slot.__func__)
+            else:
+                self._functions.add(slot)
+
+    def disconnect(self, slot):
+        """ disconnect a slot that was connected with connect()
+            """
+        with self._slots_lock:
+            if inspect.ismethod(slot):
+                funcs = self._methods.get(slot.__self__)
+                if funcs is not None:
+                    funcs.discard(slot.__func__)
+                    if not funcs:
+                        del self._methods[slot.__self__]
+            else:
+                self._functions.discard(slot)
+
+    def _slots(self):
+        """ return a snapshot of the connected slots as a list of
+            (function, bound object or None)
+            """
+        with self._slots_lock:
+            slots = [(func, None) for func in self._functions]
+            for obj, funcs in self._methods.items():
+                slots.extend((func, obj) for func in funcs)
+        return slots
 
     def __call__(self, sender, data, error_signal_on_error=True):
         """ dispatch signal to all connected slots.
         
-        This is a synchronous operation, It will not return before all slots have been called.
-        Also only exactly one thread is allowed to emit signals at any time, all other threads that try to emit *any* signal anywhere in the application at the same time will be blocked until the lock is released again. The lock will allow recursive re-entry of the same thread, this means a slot can itself emit other signals before it returns (or
-        signals can be directly connected to other signals) without problems.
+        This is a synchronous operation, It will not return before all slots have been called. The slots are called with the snapshot of slots taken when the signal was sent, and without holding any lock, so any number of threads can emit signals at the same time. A slot can itself emit other signals before it returns (or signals can be directly connected to other signals) without problems.
         If a slot raises an exception a traceback will be sent to the static Signal.signal_error() or to logging.critical()"""
-        with self._lock:
-            sent = False
-            errors = []
-            #print "signal: ", sender
-            for func in self._functions:
-                try:
+        sent = False
+        errors = []
+        for func, obj in self._slots():
+            try:
+                if obj is None:
                     func(sender, data)
-                    #print "signal sent 1"
-                    sent = True
-                except:
-                    errors.append(traceback.format_exc())
-
-            for obj, funcs in self._methods.items():
-                for func in funcs:
-                    try:
-                        func(obj, sender, data)
-                        #print "signal sent 2"
-                        sent = True
-                    except:
-                        errors.append(traceback.format_exc())
-
-            for error in errors:
-                if error_signal_on_error:
-                    Signal.signal_error(self, (error), False)
-                    #print "error: ", error
                 else:
-                    logging.critical(error)
+                    func(obj, sender, data)
+                sent = True
+            except:
+                errors.append(traceback.format_exc())
+
+        for error in errors:
+            if error_signal_on_error:
+                Signal.signal_error(self, (error), False)
+            else:
+                logging.critical(error)
+
+        return sent
+
+
+# queued by Subscription.close() to wake a waiting consumer
+_CLOSED = object()
+
+
+class Subscription():
+    """ An asyncio queue of the events of one EventBus topic,
+        returned by EventBus.subscribe(). Iterate it with
+        'async for', or await get(). With batch > 1 each item is a
+        list of up to 'batch' events, collected for at most
+        'interval' seconds after the first one arrived.
+        """
+
+    def __init__(self, bus, topic, loop, maxsize=0, batch=1, interval=0.1):
+        self.bus = bus
+        self.topic = topic
+        self.batch = max(1, batch)
+        self.interval = interval
+        self.maxsize = maxsize
+        # events dropped because the subscriber fell 'maxsize' behind
+        self.dropped = 0
+        self.closed = False
+        self._loop = loop
+        self._queue = asyncio.Queue()
+
+    def _put(self, data):
+        """ add an event, dropping the oldest one when the queue is full.
+            Runs in the event loop thread.
+            """
+        if self.closed:
+            return
+        if self.maxsize and self._queue.qsize() >= self.maxsize:
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(data)
+
+    def _deliver(self, data):
+        """ thread-safe _put() """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._put(data)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._put, data)
+
+    async def get(self):
+        """ wait for the next event, or the next batch of events.
+            Raise StopAsyncIteration once the subscription is closed
+            and the events queued before were consumed.
+            """
+        first = await self._queue.get()
+        if first is _CLOSED:
+            # leave it for the next call
+            self._queue.put_nowait(_CLOSED)
+            raise StopAsyncIteration
+        if self.batch == 1:
+            return first
+        events = [first]
+        deadline = self._loop.time() + self.interval
+        while len(events) < self.batch:
+            while not self._queue.empty() and len(events) < self.batch:
+                event = self._queue.get_nowait()
+                if event is _CLOSED:
+                    self._queue.put_nowait(_CLOSED)
+                    return events
+                events.append(event)
+            remaining = deadline - self._loop.time()
+            if len(events) >= self.batch or remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if event is _CLOSED:
+                self._queue.put_nowait(_CLOSED)
+                break
+            events.append(event)
+        return events
+
+    def close(self):
+        """ stop receiving events and wake a consumer waiting in
+            get(); thread-safe """
+        if self.closed:
+            return
+        self.closed = True
+        self.bus.unsubscribe(self)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._queue.put_nowait(_CLOSED)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, _CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class EventBus():
+    """ Topic-based publish/subscribe for asyncio consumers.
+        emit() may be called from any thread and never blocks: the
+        subscribers of a topic are kept in an immutable tuple that
+        is replaced (under a lock) when someone subscribes or
+        unsubscribes, so emitters only read it. Each event is handed
+        to the subscriber's event loop with call_soon_threadsafe().
+        
+        bus = EventBus()
+        progress = bus.subscribe("progress", batch=100, interval=0.5)
+        ...
+        bus.emit("progress", (run, generation))   # any thread
+        ...
+        async for events in progress:
+            ...
+        """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = dict()
+
+    def subscribe(self, topic, maxsize=0, batch=1, interval=0.1, loop=None):
+        """ subscribe to 'topic' from a coroutine (or pass the event
+            loop that will consume the events as 'loop'). Return a
+            Subscription. With 'maxsize', a subscriber that falls
+            behind loses its oldest events instead of using more memory.
+            """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        sub = Subscription(self, topic, loop, maxsize, batch, interval)
+        with self._lock:
+            self._topics[topic] = self._topics.get(topic, ()) + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        """ remove a Subscription """
+        with self._lock:
+            subs = tuple(s for s in self._topics.get(sub.topic, ()) if s is not sub)
+            if subs:
+                self._topics[sub.topic] = subs
+            else:
+                self._topics.pop(sub.topic, None)
+
+    def emit(self, topic, data):
+        """ send 'data' to every subscriber of 'topic'. Return the
+            number of subscribers.
+            """
+        subs = self._topics.get(topic, ())
+        for sub in subs:
+            sub._deliver(data)
+        return len(subs)
+
+    def slot(self, topic):
+        """ return a Signal slot that forwards the signal's data to
+            'topic'. Keep a reference to the slot as long as it is
+            connected, signals only hold weak references.
+            """
+        def forward(sender, data):
+            self.emit(topic, data)
+        return forward
+
+
+class TimerHandle():
+    """ A timer registered with a TimerScheduler """
+
+    def __init__(self, scheduler, callback, interval):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+        # periodic ticks skipped because the timer fell behind
+        self.missed = 0
+
+    def cancel(self):
+        """ cancel the timer; a tick already in progress completes """
+        self.scheduler.cancel(self)
+
+
+class TimerScheduler():
+    """ One thread that serves any number of one-shot and periodic
+        timers from a heap ordered by due time. Callbacks run in the
+        scheduler thread, one at a time, so they should return
+        quickly. A periodic timer that falls behind (a slow callback,
+        a suspended process) fires once and then continues on its
+        original schedule; the skipped ticks are coalesced and
+        counted in TimerHandle.missed.
+        """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def schedule(self, callback, delay, interval=None):
+        """ call 'callback()' after 'delay' seconds and then every
+            'interval' seconds, if given. Return a TimerHandle.
+            """
+        handle = TimerHandle(self, callback, interval)
+        with self._cond:
+            self._push(time.monotonic() + delay, handle)
+            if self._thread is None:
+                self._thread = start_thread(self._run, "TimerScheduler")
+            self._cond.notify()
+        return handle
+
+    def cancel(self, handle):
+        """ cancel a timer; it is dropped from the heap lazily """
+        with self._cond:
+            handle.cancelled = True
+            self._cond.notify()
+
+    def _push(self, due, handle):
+        heapq.heappush(self._heap, (due, next(self._seq), handle))
+
+    def _run(self, targs=None):
+        while True:
+            with self._cond:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = self._heap[0][0]
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                due, seq, handle = heapq.heappop(self._heap)
+                if handle.interval:
+                    # coalesce the ticks that are already overdue
+                    late = int((now - due) // handle.interval)
+                    handle.missed += late
+                    self._push(due + (late + 1) * handle.interval, handle)
+            try:
+                handle.callback()
+            except:
+                logging.critical(traceback.format_exc())
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """ return the application-wide TimerScheduler, creating it on
+        first use (and again in a forked child process, which does
+        not inherit the parent's scheduler thread)
+        """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler._pid != os.getpid():
+            _scheduler = TimerScheduler()
+        return _scheduler
 
-            return sent
 
 class Timer(Signal):
-    """ a simple timer (used for stuff like keepalive) """
+    """ a simple timer (used for stuff like keepalive). All timers
+        share the thread of one TimerScheduler. """
 
-    def __init__(self, interval):
+    def __init__(self, interval, scheduler=None):
         """ create a new timer, interval is in seconds"""
         Signal.__init__(self)
         self._interval = interval
-        self._timer = None
-        self._start()
+        self._scheduler = scheduler or get_scheduler()
+        self._timer = self._scheduler.schedule(self._fire, interval, interval)
 
     def _fire(self):
-        """ fire the signal and restart it"""
+        """ fire the signal"""
         self.__call__(self, None)
-        self._start()
-
-    def _start(self):
-        """ start the timer"""
-        self._timer = threading.Timer(self._interval, self._fire)
-        self._timer.daemon = True
-        self._timer.start()
 
     def cancel(self):
         """ cancel the timer"""
-        self._timer.cancel()
\ No newline at end of file
+        self._timer.cancel()
@@ -0,0 +1,129 @@
+""" Reader for the trajectory files the simulator writes to
+    <imageDir>/gen-NNNNNN.traj when saveTrajectory = true (see
+    src/trajectory.cpp for the layout). The first frame of a file
+    holds every living agent, later frames only the agents that moved
+    or died. Trajectory maps the file with numpy.memmap; replay()
+    applies the deltas and yields the complete state after each step:
+
+        traj = trajectory.Trajectory("images/gen-000100.traj")
+        for step, state in traj.replay():
+            alive = state['alive']
+            xy = np.stack([state['x'][alive], state['y'][alive]], axis=1)
+
+    Requires numpy.
+    """
+
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"BS4TRAJ\0"
+VERSION = 1
+DIED = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('generation', '<u4'),
+    ('sizeX', '<u2'),
+    ('sizeY', '<u2'),
+    ('population', '<u4'),
+    ('numBarriers', '<u4'),
+])
+
+RECORD = np.dtype([
+    ('index', '<u2'),
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('color', 'u1'),
+    ('flags', 'u1'),
+])
+
+FRAME = np.dtype([('simStep', '<u4'), ('count', '<u4')])
+
+
+class Trajectory():
+    """ A memory-mapped trajectory file. 'barriers' is an (n, 2) int16
+        array of barrier locations, 'steps' the sim step of each frame.
+        """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+        if len(self._map) < HEADER.itemsize:
+            raise ValueError("%s: too short for a trajectory" % self.path)
+        header = self._map[:HEADER.itemsize].view(HEADER)[0]
+        if bytes(header['magic']).ljust(8, b"\0") != MAGIC:
+            raise ValueError("%s: not a biosim4 trajectory" % self.path)
+        if header['version'] != VERSION:
+            raise ValueError("%s: trajectory version %i, expected %i" % (self.path, header['version'], VERSION))
+
+        self.generation = int(header['generation'])
+        self.sizeX = int(header['sizeX'])
+        self.sizeY = int(header['sizeY'])
+        self.population = int(header['population'])
+        start = HEADER.itemsize
+        end = start + 4 * int(header['numBarriers'])
+        self.barriers = self._map[start:end].view('<i2').reshape(-1, 2)
+
+        # index the frames; a frame cut short by a crash is ignored
+        self._frames = []
+        offset = end
+        while offset + FRAME.itemsize <= len(self._map):
+            frame = self._map[offset:offset + FRAME.itemsize].view(FRAME)[0]
+            begin = offset + FRAME.itemsize
+            offset = begin + int(frame['count']) * RECORD.itemsize
+            if offset > len(self._map):
+                break
+            self._frames.append((int(frame['simStep']), begin, int(frame['count'])))
+        self.steps = [f[0] for f in self._frames]
+
+    def __len__(self):
+        return len(self._frames)
+
+    def records(self, i):
+        """ Return the records of frame i, a structured array view
+            with fields index, x, y, color and flags.
+            """
+        step, begin, count = self._frames[i]
+        return self._map[begin:begin + count * RECORD.itemsize].view(RECORD)
+
+    def newState(self):
+        """ Return an empty state: a dictionary of arrays indexed by
+            agent index (0 is unused) with keys x, y, color and alive.
+            """
+        n = self.population + 1
+        return {
+            'x' : np.zeros(n, dtype=np.int16),
+            'y' : np.zeros(n, dtype=np.int16),
+            'color' : np.zeros(n, dtype=np.uint8),
+            'alive' : np.zeros(n, dtype=bool),
+        }
+
+    def apply(self, state, i):
+        """ Update 'state' in place with the records of frame i.
+            """
+        rec = self.records(i)
+        idx = rec['index'].astype(np.int64)
+        state['x'][idx] = rec['x']
+        state['y'][idx] = rec['y']
+        state['color'][idx] = rec['color']
+        state['alive'][idx] = (rec['flags'] & DIED) == 0
+
+    def replay(self, start=0, stop=None):
+        """ Yield (simStep, state) after each frame from 'start' to
+            'stop'. The same state dictionary is updated and yielded
+            every time; copy it to keep a frame.
+            """
+        stop = len(self) if stop is None else min(stop, len(self))
+        state = self.newState()
+        for i in range(stop):
+            self.apply(state, i)
+            if i >= start:
+                yield self._frames[i][0], state
+
+
+def listTrajectories(imagedir):
+    """ Return the trajectory paths in 'imagedir', by generation.
+        """
+    return sorted(Path(imagedir).glob("gen-[0-9]*.traj"))
@@ -10,9 +10,9 @@
 from sys import version_info, platform, argv, exit
 
 try:
-    assert version_info >= (3, 4)
+    assert version_info >= (3, 9)
 except:
-    print("Python version >= 3.4 required")
+    print("Python version >= 3.9 required")
     exit(1)
 
 import argparse
@@ -122,6 +122,48 @@ argp.add_argument(
     default = False,
     help = "adjust result params according to test results"
 )
+argp.add_argument(
+    "--bench",
+    action = "store_true",
+    default = False,
+    help = "run the scaling benchmark (numThreads x population x grid size\n"
+            + "x maxNumberNeurons) and compare it with this machine's baseline;\n"
+            + "use with --adjust to store the results as the new baseline"
+)
+argp.add_argument(
+    "--calibrate",
+    type = int,
+    metavar = "N",
+    default = None,
+    help = "use with --test to run N deterministic replicates with different\n"
+            + "RNG seeds in parallel (see --jobs) and store percentile-based\n"
+            + "result params, without prompting"
+)
+argp.add_argument(
+    "--coverage",
+    type = float,
+    metavar = "PCT",
+    default = 95.0,
+    help = "use with --calibrate: percentage of replicate results the\n"
+            + "result-*-min/max params must cover (default 95)"
+)
+argp.add_argument(
+    "--compare",
+    type = str,
+    nargs = 2,
+    metavar = ("BIN_A", "BIN_B"),
+    default = None,
+    help = "use with --test to compare the throughput of two biosim4 binaries\n"
+            + "with interleaved, pinned runs using the same seeds (see --repeat)"
+)
+argp.add_argument(
+    "--cores",
+    type = str,
+    metavar = "LIST",
+    default = None,
+    help = "use with --compare: cores to pin every run to, e.g. 0-3,6\n"
+            + "(default: all cores this process may use)"
+)
 argp.add_argument(
     "-c",
     "--check",
@@ -131,6 +173,16 @@ argp.add_argument(
     # TODO show color [Yes] or [No] env checks
     # offer to repair, else --repair
 )
+argp.add_argument(
+    # run tests in parallel
+    "-j",
+    "--jobs",
+    type = int,
+    metavar = "N",
+    default = None,
+    help = "run tests in N parallel, isolated processes\n"
+            + "use with --test NAME[,NAME...] or --test all (the default)"
+)
 argp.add_argument(
     # use this test section
     "-l",
@@ -141,6 +193,13 @@ argp.add_argument(
     help = "import parameters for a new test configuration\n"
             + "provide the name of the source .ini file in ./configs/"
 )
+argp.add_argument(
+    "--nocache",
+    action = "store_true",
+    default = False,
+    help = "always run the simulation, even if the result of a deterministic\n"
+            + "test (deterministic = true, numThreads = 1) is already cached"
+)
 argp.add_argument(
     # this shows both test amd result params
     "-p",
@@ -165,6 +224,107 @@ argp.add_argument(
     default = None,
     help = "see a list of configured simulation tests"
 )
+argp.add_argument(
+    "--enqueue",
+    action = "store_true",
+    default = False,
+    help = "use with --queue: add the tests of --test (default all) to the\n"
+            + "queue; with --sweep the points of the test's sweep, with\n"
+            + "--seeds N that many deterministic replicates of every job"
+)
+argp.add_argument(
+    "--golden",
+    action = "store_true",
+    default = False,
+    help = "use with --test to run a deterministic test and store its\n"
+            + "per-generation state fingerprints as the golden file\n"
+            + "./configs/golden/<test>.txt; later runs of the test stop at\n"
+            + "the first generation that differs from it"
+)
+argp.add_argument(
+    "--queue",
+    type = str,
+    metavar = "DIR",
+    default = None,
+    help = "job queue in the shared directory DIR, for running tests on\n"
+            + "several hosts; use with --enqueue, --worker or --status"
+)
+argp.add_argument(
+    "--repeat",
+    type = int,
+    metavar = "N",
+    default = 5,
+    help = "use with --compare: number of runs of each binary (default 5)"
+)
+argp.add_argument(
+    "--resume",
+    action = "store_true",
+    default = False,
+    help = "use with --test to continue an interrupted simulation from the\n"
+            + "checkpoint in its logDir (see param-checkpointstride); starts\n"
+            + "from generation 0 if there is no checkpoint"
+)
+argp.add_argument(
+    "--samples",
+    type = int,
+    metavar = "N",
+    default = None,
+    help = "use with --sweep to run N random points instead of the full grid"
+)
+argp.add_argument(
+    "--seed",
+    type = int,
+    metavar = "S",
+    default = 0,
+    help = "use with --sweep --samples: seed for drawing the random points\n"
+            + "(the same seed draws the same points, default 0)"
+)
+argp.add_argument(
+    "--seeds",
+    type = int,
+    metavar = "N",
+    default = None,
+    help = "use with --queue --enqueue: enqueue N replicates of every job\n"
+            + "with deterministic = true and RNGSeed, RNGSeed + 1, ..."
+)
+argp.add_argument(
+    "--status",
+    action = "store_true",
+    default = False,
+    help = "use with --queue: show pending, running and finished jobs"
+)
+argp.add_argument(
+    "--sweep",
+    action = "store_true",
+    default = False,
+    help = "use with --test to run the parameter sweep defined by the test's\n"
+            + "sweep-* keys in parallel (see --jobs); points already recorded\n"
+            + "in ./results/sweep-<test>.jsonl are skipped"
+)
+argp.add_argument(
+    "--timeout",
+    type = float,
+    metavar = "SEC",
+    default = None,
+    help = "use with --test, --jobs or --compare: stop a simulation that\n"
+            + "runs for more than SEC seconds of wall-clock time and fail the test"
+)
+argp.add_argument(
+    "--cpu-timeout",
+    type = float,
+    metavar = "SEC",
+    default = None,
+    help = "use with --test, --jobs or --compare: stop a simulation that\n"
+            + "uses more than SEC seconds of CPU time and fail the test"
+)
+argp.add_argument(
+    "--tolerance",
+    type = float,
+    metavar = "PCT",
+    default = 10.0,
+    help = "use with --bench: fail if throughput drops by more than PCT percent\n"
+            + "below the baseline (default 10)"
+)
 argp.add_argument(
     # use this test section
     "-t",
@@ -180,6 +340,21 @@ argp.add_argument(
     action = "store_true", 
     help = "see more detailed usage instructions"
 )
+argp.add_argument(
+    "-w",
+    "--watch",
+    action = "store_true",
+    default = False,
+    help = "follow the epoch log while the simulation runs and stop it\n"
+            + "as soon as the test is clearly going to fail"
+)
+argp.add_argument(
+    "--worker",
+    action = "store_true",
+    default = False,
+    help = "use with --queue: run queued jobs (see --jobs, default 1 at a\n"
+            + "time) until the queue is empty; start one worker per host"
+)
 argp.add_argument(
     "-v",
     "--verbose", 
@@ -199,10 +374,25 @@ if args.usage:
 # We made it this far without incident or exiting
 # Load additional modules for environment set-up.
 import locale
+import os
+import sqlite3
+import subprocess
 import time
 from datetime import timedelta
+from pylib import bench
+from pylib import calibrate
+from pylib import compare
 from pylib import config
+from pylib import fingerprint
 from pylib import include_tests
+from pylib import jobqueue
+from pylib import monitor
+from pylib import resultstore
+from pylib import runcache
+from pylib import runner
+from pylib import runreport
+from pylib import schedule
+from pylib import sweep
 from pylib import testlib
 
 
@@ -241,7 +431,8 @@ TEST_DEFAULTS = [
     ["slowtest", "description", "Slow test that runs for hours/days"],
     ['slowtest', 'param-numthreads', '1'],
     ["slowtest", "param-stepsPerGeneration", "10000"],
-    ['slowtest', 'param-maxgenerations', '100001']
+    ['slowtest', 'param-maxgenerations', '100001'],
+    ['slowtest', 'param-checkpointstride', '10']
 ]
 # concatenate additional tests (with more params) stored in pylib/include_tests.py
 TEST_DEFAULTS += include_tests.incl_list
@@ -338,7 +529,7 @@ if args.check:
         thislen = len(k) + len(str(v)) + 7
         flag = "Pass"
         if 'Python' in k:
-            if float(v) < 3.4:
+            if tuple(int(n) for n in v.split('.')) < (3, 9):
                 flag = "Fail"
         elif 'working' in k:
             if not v.endswith("tests"):
@@ -366,6 +557,135 @@ if args.show:
         print(t)
     print()
 
+elif args.bench:
+
+    if args.tolerance < 0:
+        print("--tolerance must not be negative")
+        exit(1)
+    if bench.bench(args.tolerance, args.adjust) > 0:
+        exit(1)
+
+elif args.compare:
+
+    if not args.test or not testlib.getTestSection(thisconfig, args.test):
+        print("--compare requires the name of one test, e.g. --test microtest")
+        exit(1)
+    for b in args.compare:
+        if not os.access(b, os.X_OK):
+            print("%s is not an executable file" % b)
+            exit(1)
+    if args.repeat < 2:
+        print("--repeat must be at least 2")
+        exit(1)
+    try:
+        cores = compare.parseCores(args.cores) if args.cores else None
+    except ValueError:
+        print("--cores takes a list like 0-3,6")
+        exit(1)
+    report = compare.compare(thisconfig, args.test, args.compare, args.repeat, cores,
+                             timeout=args.timeout, cputimeout=args.cpu_timeout)
+    if report is None or not report['identical_logs']:
+        exit(1)
+
+elif args.calibrate:
+
+    if not args.test or not testlib.getTestSection(thisconfig, args.test):
+        print("--calibrate requires the name of one test, e.g. --test quicktest")
+        exit(1)
+    if args.calibrate < 1 or not 0 < args.coverage <= 100:
+        print("--calibrate needs N >= 1 and --coverage in 0..100")
+        exit(1)
+    if not calibrate.calibrate(thisconfig, args.test, args.calibrate,
+                               args.jobs or os.cpu_count() or 1, args.coverage):
+        exit(1)
+
+elif args.queue:
+
+    if not (args.enqueue or args.worker or args.status):
+        print("--queue needs --enqueue, --worker or --status")
+        exit(1)
+    if args.enqueue:
+        if args.test is None or args.test == "all":
+            testnames = testlib.showTests(thisconfig)
+        else:
+            testnames = [str.strip(n) for n in str.split(args.test, ",") if str.strip(n)]
+        for n in testnames:
+            if not testlib.getTestSection(thisconfig, n):
+                print("to see available tests, run:\n\n    python3 %s --show\n" % _scriptname)
+                exit(1)
+        if args.seeds is not None and args.seeds < 1:
+            print("--seeds must be at least 1")
+            exit(1)
+        jobs = list()
+        for n in testnames:
+            points = [None]
+            if args.sweep:
+                try:
+                    specs = sweep.getSweepSpecs(testlib.getTestSection(thisconfig, n))
+                except ValueError as e:
+                    print("sweep error: %s" % e)
+                    exit(1)
+                if not specs:
+                    print("test %s has no sweep-* keys" % n)
+                    exit(1)
+                points = sweep.samplePoints(specs, args.samples, args.seed) if args.samples \
+                    else sweep.gridPoints(specs)
+            base = int(testlib.getTestParams(testlib.getTestSection(thisconfig, n))
+                       .get('rngseed', calibrate.DEFAULT_SEED))
+            for point in points:
+                seeds = [None] if args.seeds is None else range(base, base + args.seeds)
+                for seed in seeds:
+                    overrides = dict(point or {})
+                    if seed is not None:
+                        overrides.update({'deterministic': "true", 'rngseed': str(seed)})
+                    jobs.append(runner.makeJob(thisconfig, n, overrides=overrides or None, watch=args.watch,
+                                               cache=not args.nocache, timeout=args.timeout,
+                                               cputimeout=args.cpu_timeout))
+        added = jobqueue.JobQueue(args.queue).enqueue(jobs)
+        print("\n%i job(s) added to %s, %i already queued\n" % (len(added), args.queue, len(jobs) - len(added)))
+    if args.worker:
+        if args.jobs is not None and args.jobs < 1:
+            print("--jobs must be at least 1")
+            exit(1)
+        counts = jobqueue.work(args.queue, args.jobs or 1, args.verbose)
+        if counts['failed'] > 0:
+            exit(1)
+    if args.status:
+        state = jobqueue.showStatus(args.queue, args.verbose)
+        if state['failed'] or any(not (e['report'] or {}).get('passed') for e in state['done']):
+            exit(1)
+
+elif args.sweep:
+
+    if not args.test or not testlib.getTestSection(thisconfig, args.test):
+        print("--sweep requires the name of one test, e.g. --test quicktest")
+        exit(1)
+    if (args.samples is not None and args.samples < 1) or (args.jobs is not None and args.jobs < 1):
+        print("--sweep needs --samples and --jobs of at least 1")
+        exit(1)
+    failed = sweep.sweep(thisconfig, args.test, args.jobs or os.cpu_count() or 1,
+                         args.samples, args.seed, args.verbose)
+    if failed is None or failed > 0:
+        exit(1)
+
+elif args.jobs:
+
+    # run a matrix of tests, each in its own workspace under ./runs/
+    if args.jobs < 1:
+        print("--jobs must be at least 1")
+        exit(1)
+    if args.test is None or args.test == "all":
+        testnames = testlib.showTests(thisconfig)
+    else:
+        testnames = [str.strip(n) for n in str.split(args.test, ",") if str.strip(n)]
+    for n in testnames:
+        if not testlib.getTestSection(thisconfig, n):
+            print("to see available tests, run:\n\n    python3 %s --show\n" % _scriptname)
+            exit(1)
+    if runner.runMatrix(thisconfig, testnames, args.jobs, args.verbose, args.watch,
+                        not args.nocache, args.timeout, args.cpu_timeout) > 0:
+        exit(1)
+
 elif args.test:
 
     #TODO change writeStdTestFile() to take t (section) as arg
@@ -407,24 +727,93 @@ elif args.test:
         testlib.TEMPinifile = _temp_ini
         print("\nRunning %s sim" % t.name)
         #print(dir(t))
-        testlib.writeStdTestFile(thisconfig, args.test)
+        # compare with the golden fingerprints, or record them
+        golden = None if args.golden else fingerprint.readGolden(args.test)
+        overrides = {'savefingerprints': "true"} if args.golden or golden is not None else None
+        testlib.writeStdTestFile(thisconfig, args.test, overrides)
         if args.verbose:
             print("\n# ", t['description'])
-        # start objetive time
         start_time = time.monotonic()
-        # start processor time
-        cpu_start_time = time.perf_counter()
         #
-        # run simulation
-        proc = testlib.runTest()
+        # run simulation, unless a deterministic result is cached
+        testparams = testlib.getTestParams(t, overrides)
+        logdir = str(Path("..", testparams.get('logdir', 'logs')))
+        if args.golden:
+            reason = fingerprint.canRecord(testlib.effectiveParams(testparams))
+            if reason:
+                print("--golden: %s in %s for reproducible fingerprints" % (reason, args.test))
+                exit(1)
+        changes = schedule.getSchedule(t)
+        # scheduled changes depend on timing, see pylib/schedule.py; a
+        # cached log would skip the check of the golden fingerprints
+        cachekey = None if args.nocache or args.golden or golden is not None or changes \
+            else runcache.runKey(testparams)
+        if runcache.restore(cachekey, logdir):
+            proc = "cached result %s" % cachekey
+            print("\n# deterministic result found in the run cache, simulation skipped\n")
+        else:
+            watcher = None
+            if args.watch or golden is not None:
+                rp, complete = testlib.getResultParams(thisconfig, args.test)
+                watcher = monitor.Monitor(str(Path(logdir, _results_log)), rp,
+                                          monitor.getWatchParams(t) if args.watch else monitor.GOLDEN_ONLY,
+                                          golden=golden)
+            resume = None
+            if args.resume:
+                # relative to the project root, like logdir
+                checkpoint = str(Path(testparams.get('logdir', 'logs'), "checkpoint.bin"))
+                if Path("..", checkpoint).exists():
+                    resume = checkpoint
+                    print("\n# resuming from %s\n" % checkpoint)
+                else:
+                    print("\n# no checkpoint in %s, starting from generation 0\n" % logdir)
+            scheduler = None
+            if changes:
+                scheduler = schedule.Scheduler("./configs/%s" % _temp_ini, testparams, changes,
+                                               str(Path(logdir, _results_log)), schedule.getScheduleInterval(t))
+                startgen = testlib.readCheckpointHeader(Path("..", resume))['generation'] if resume else 0
+                scheduler.prepare(startgen)
+            # the console output is also kept in logDir
+            try:
+                proc = testlib.runTest(outdir=logdir, monitor=watcher, resume=resume, schedule=scheduler,
+                                       timeout=args.timeout, cputimeout=args.cpu_timeout, echo=True)
+            except subprocess.TimeoutExpired as e:
+                print("\n# simulation stopped after %s seconds of %s time\n"
+                      % (e.timeout, "wall-clock" if e.limit == "wall" else "CPU"))
+                print("test: Fail\n")
+                exit(1)
+            if scheduler:
+                for generation, lastgen in scheduler.late():
+                    print("\n# warning: the change scheduled for generation %i was applied after generation %i"
+                          % (generation, lastgen))
+            # CPU time, peak RSS etc. of biosim4, see pylib/runreport.py
+            usage = runreport.makeRunReport(proc, testparams, str(Path(logdir, _results_log)), args.test)
+            reportpath = runreport.writeRunReport(usage, logdir)
+            try:
+                resultstore.recordRun(usage, testparams, str(Path(logdir, _results_log)), args.test, args.test,
+                                      error="stopped at generation %i: %s" % watcher.failure
+                                      if watcher and watcher.failure else None)
+            except sqlite3.Error as e:
+                print("results database: %s" % e)
+            if watcher and watcher.failure:
+                print("\n# simulation stopped at generation %i:\n# %s\n" % watcher.failure)
+                print("test: Fail\n")
+                exit(1)
+            runcache.store(cachekey, logdir, testparams, round(proc.walltime, 3))
+            print("\n# simulation completed\n")
+            if golden is not None:
+                print("# state fingerprints of all %i generations match the golden file\n" % len(golden))
+            if args.golden:
+                print("# golden fingerprints saved to %s\n" % fingerprint.saveGolden(args.test, logdir))
+            if args.verbose:
+                print(proc)
+                for line in runreport.formatRunReport(usage):
+                    print(line)
+                print("run report: %s" % reportpath)
         #
-        cpu_end_time = time.perf_counter()
         end_time = time.monotonic()
-        print("\n# simulation completed\n")
         if args.verbose:
-            print(proc)
             print("clock time: %s seconds" % timedelta(seconds=end_time - start_time))
-            print("CPU time: %s seconds" % (cpu_end_time - start_time))
         #
         # run test analysis
         res = testlib.resultsAnalysis(thisconfig, args.test, _results_log, args.adjust)
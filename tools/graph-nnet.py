@@ -1,73 +1,404 @@
 #!/usr/bin/python3
 
+""" Render neural nets as graphs with igraph.
+
+    Without arguments, read the edge list in net.txt (lines of
+    "source sink weight", as printed by printIGraphEdgeList()) and
+    render it to net.svg.
+
+    With --log, stream-parse a captured simulator stdout (or - for
+    stdin) and render every individual printed by
+    displaySampleGenomes() into --outdir, named by the generation of
+    the preceding "Gen N" line and the individual ID:
+
+        ./bin/Release/biosim4 biosim4.ini | tee stdout.txt
+        tools/graph-nnet.py --log stdout.txt --outdir nets --format png
+
+    Layouts are the expensive part of rendering. They are stored in a
+    layout cache directory (by default <outdir>/.layout-cache), keyed
+    by a hash of the graph's canonical edge list, so an unchanged
+    graph is never laid out twice. A graph that is not in the cache
+    starts from the cached layout sharing the most nodes with it:
+    known nodes at their cached positions, new nodes next to their
+    neighbors, and the result is aligned to that layout. An evolving
+    net then needs only a few layout iterations and keeps its shape
+    from image to image.
+    """
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+from multiprocessing import Pool
+
 import igraph
 
-# load data into a graph
-g = igraph.Graph.Read_Ncol('net.txt', names=True, weights=True)
+SENSORS = ['Lx', 'Ly', 'EDx', 'EDy', 'ED', 'Bfd', 'Blr', 'Gen', 'LMx', 'LMy', 'LPf', 'LPb', 'Pop', 'Pfd', 'Plr', 'Osc', 'Age', 'Rnd', 'Sg', 'Sfd', 'Slr']
+ACTIONS = ['MvX', 'MvY', 'MvE', 'MvW', 'MvN', 'MvS', 'Mfd', 'MvL', 'MvR', 'MRL', 'Mrv', 'Mrn', 'OSC', 'LPD', 'Res', 'SG', 'Klf' ]
+
 
-for v in g.vs:
-	v['size'] = 35
-	v['label'] = v['name']
-	if v['name'] in ['Lx', 'Ly', 'EDx', 'EDy', 'ED', 'Bfd', 'Blr', 'Gen', 'LMx', 'LMy', 'LPf', 'LPb', 'Pop', 'Pfd', 'Plr', 'Osc', 'Age', 'Rnd', 'Sg', 'Sfd', 'Slr']:
-		v['color'] = 'lightblue'
-	elif v['name'] in ['MvX', 'MvY', 'MvE', 'MvW', 'MvN', 'MvS', 'Mfd', 'MvL', 'MvR', 'MRL', 'Mrv', 'Mrn', 'OSC', 'LPD', 'Res', 'SG', 'Klf' ]:
-		v['color'] = 'lightpink'
+def makeGraph(g):
+	""" set the vertex and edge attributes used for plotting """
+	for v in g.vs:
+		v['size'] = 35
+		v['label'] = v['name']
+		if v['name'] in SENSORS:
+			v['color'] = 'lightblue'
+		elif v['name'] in ACTIONS:
+			v['color'] = 'lightpink'
+		else:
+			v['color'] = 'lightgrey'
+
+	# convert edge weights to color and size
+	for e in g.es:
+		if e['weight'] < 0:
+			e['color'] = 'lightcoral'
+		elif e['weight'] == 0:
+			e['color'] = 'grey'
+		else:
+			e['color'] = 'green'
+
+		width = abs(e['weight'])
+		e['width'] = 1 + 1.25 * (width / 8192.0)
+
+	return g
+
+
+def plotSettings(g):
+	""" return the bounding box and layout for the size of 'g' """
+	if len(g.vs) < 6:
+		bbox = (300,300)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 12:
+		bbox = (400,400)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 18:
+		bbox = (500,500)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 24:
+		bbox = (520,520)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 26:
+		bbox = (800,800)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 50:
+		bbox = (1000,1000)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 130:
+		bbox = (1200,1000)
+		layout = 'fruchterman_reingold'
+	elif len(g.vs) < 150:
+		bbox = (4000,4000)
+		layout = 'fruchterman_reingold'
+		for v in g.vs:
+			v['size'] = v['size'] * 1.5
+	elif len(g.vs) < 200:
+		bbox = (4000,4000)
+		layout = 'kamada_kawai'
+		for v in g.vs:
+			v['size'] = v['size'] * 2
 	else:
-		v['color'] = 'lightgrey'
-
-# convert edge weights to color and size
-for e in g.es:
-	#print(e['weight'])
-	if e['weight'] < 0:
-		e['color'] = 'lightcoral'
-	elif e['weight'] == 0:
-		e['color'] = 'grey'
+		bbox = (8000,8000)
+		layout = 'fruchterman_reingold'
+
+	return bbox, layout
+
+
+# layout iterations when most nodes start at known positions
+SEEDED_NITER = 100
+SEEDED_KK_MAXITER_PER_NODE = 10
+# most recent cached layouts considered as the start of a new layout
+SEED_CANDIDATES = 200
+
+
+def render(g, filename, cache=None):
+	""" plot graph """
+	makeGraph(g)
+	bbox, layout = plotSettings(g)
+	positions = computeLayout(g, layout, cache)
+	coords = [positions[v['name']] for v in g.vs]
+	igraph.plot(g, filename, edge_curved=True, bbox=bbox, margin=64, layout=igraph.Layout(coords))
+
+
+def edgeKey(g):
+	""" hash of the canonical (sorted) edge list of 'g'; weights don't
+	    affect the layout, so they are not part of the key """
+	names = g.vs['name']
+	edges = sorted("%s %s" % (names[e.source], names[e.target]) for e in g.es)
+	return hashlib.sha1("\n".join(edges).encode()).hexdigest()
+
+
+class LayoutCache():
+	""" node positions by edgeKey(), one JSON file per graph """
+
+	def __init__(self, directory):
+		self.directory = directory
+		# key -> (mtime, positions) of the entries read so far
+		self.entries = {}
+		os.makedirs(directory, exist_ok=True)
+
+	def get(self, key):
+		try:
+			with open(os.path.join(self.directory, key + ".json"), 'r') as f:
+				return dict((k, tuple(v)) for k, v in json.load(f).items())
+		except (OSError, ValueError):
+			return None
+
+	def put(self, key, positions):
+		# written atomically, render processes may share the cache
+		path = os.path.join(self.directory, key + ".json")
+		tmppath = "%s.%i.tmp" % (path, os.getpid())
+		with open(tmppath, 'w') as f:
+			json.dump(positions, f)
+		os.replace(tmppath, path)
+		self.entries[key] = (os.stat(path).st_mtime, positions)
+
+	def refresh(self):
+		""" read the entries added by other processes """
+		for entry in os.scandir(self.directory):
+			key = entry.name[:-len(".json")]
+			if entry.name.endswith(".json") and key not in self.entries:
+				positions = self.get(key)
+				if positions is not None:
+					self.entries[key] = (entry.stat().st_mtime, positions)
+
+	def nearest(self, names):
+		""" return the positions of the recent cached layout sharing
+		    the most nodes with 'names' (the newest of equally good
+		    ones), or None if no layout shares any """
+		self.refresh()
+		names = set(names)
+		recent = sorted(self.entries.values(), key=lambda e: e[0], reverse=True)[:SEED_CANDIDATES]
+		best = None
+		for mtime, positions in recent:
+			overlap = len(names.intersection(positions))
+			if overlap > 0 and (best is None or overlap > best[0]):
+				best = (overlap, positions)
+		return best[1] if best else None
+
+
+# the LayoutCache of each render process, so that the cached layouts
+# are read once per process instead of once per net
+_caches = {}
+
+
+def layoutCache(directory):
+	if directory not in _caches:
+		_caches[directory] = LayoutCache(directory)
+	return _caches[directory]
+
+
+def seedPositions(g, previous):
+	""" start positions for a layout of 'g': known nodes keep their
+	    'previous' position, new nodes start at the centroid of their
+	    known neighbors (or near the center) with a small jitter """
+	names = g.vs['name']
+	known = [previous[n] for n in names if n in previous]
+	cx = sum(p[0] for p in known) / len(known)
+	cy = sum(p[1] for p in known) / len(known)
+	spread = max(1.0, max(math.hypot(p[0] - cx, p[1] - cy) for p in known))
+	seed = []
+	for v in g.vs:
+		if v['name'] in previous:
+			seed.append(list(previous[v['name']]))
+			continue
+		near = [previous[names[u]] for u in g.neighbors(v) if names[u] in previous]
+		x = sum(p[0] for p in near) / len(near) if near else cx
+		y = sum(p[1] for p in near) / len(near) if near else cy
+		# jitter by name, so the same net always gets the same layout
+		rng = random.Random(v['name'])
+		seed.append([x + rng.uniform(-0.1, 0.1) * spread, y + rng.uniform(-0.1, 0.1) * spread])
+	return seed
+
+
+def alignTo(positions, reference):
+	""" rotate, reflect, scale and shift 'positions' to best match the
+	    'reference' positions of the nodes they share (2D Procrustes),
+	    so a new layout doesn't appear turned or mirrored """
+	common = [n for n in positions if n in reference]
+	if len(common) < 2:
+		return positions
+	pcx = sum(positions[n][0] for n in common) / len(common)
+	pcy = sum(positions[n][1] for n in common) / len(common)
+	rcx = sum(reference[n][0] for n in common) / len(common)
+	rcy = sum(reference[n][1] for n in common) / len(common)
+	best = None
+	for flip in [1, -1]:
+		a = b = norm = 0.0
+		for n in common:
+			px, py = positions[n][0] - pcx, flip * (positions[n][1] - pcy)
+			rx, ry = reference[n][0] - rcx, reference[n][1] - rcy
+			a += px * rx + py * ry
+			b += px * ry - py * rx
+			norm += px * px + py * py
+		if norm == 0:
+			return positions
+		# a, b give the best rotation angle and scale for this reflection
+		fit = math.hypot(a, b)
+		if best is None or fit > best[0]:
+			best = (fit, flip, math.atan2(b, a), fit / norm)
+	fit, flip, angle, scale = best
+	c, s = math.cos(angle) * scale, math.sin(angle) * scale
+	aligned = {}
+	for n, (x, y) in positions.items():
+		px, py = x - pcx, flip * (y - pcy)
+		aligned[n] = (rcx + c * px - s * py, rcy + s * px + c * py)
+	return aligned
+
+
+def computeLayout(g, method, cache=None):
+	""" return {name: (x, y)} for 'g' from the cache, or computed by
+	    'method', starting from the cached layout that shares the most
+	    nodes with 'g' if there is one """
+	key = edgeKey(g)
+	previous = None
+	if cache is not None:
+		positions = cache.get(key)
+		if positions is not None and all(n in positions for n in g.vs['name']):
+			return positions
+		previous = cache.nearest(g.vs['name'])
+
+	# seeded by the edge-set hash, so the result doesn't depend on
+	# what else the process rendered before
+	igraph.set_random_number_generator(random.Random(key))
+	if previous is not None:
+		seed = seedPositions(g, previous)
+		if method == 'kamada_kawai':
+			layout = g.layout_kamada_kawai(seed=seed, maxiter=SEEDED_KK_MAXITER_PER_NODE * len(g.vs))
+		else:
+			layout = g.layout_fruchterman_reingold(seed=seed, niter=SEEDED_NITER)
 	else:
-		e['color'] = 'green'
-
-	width = abs(e['weight'])
-	e['width'] = 1 + 1.25 * (width / 8192.0)
-
-
-# plot graph
-
-print(len(g.vs))
-
-if len(g.vs) < 6:
-    bbox = (300,300)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 12:
-    bbox = (400,400)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 18:
-    bbox = (500,500)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 24:
-    bbox = (520,520)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 26:
-    bbox = (800,800)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 50:
-    bbox = (1000,1000)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 130:
-    bbox = (1200,1000)
-    layout = 'fruchterman_reingold'
-elif len(g.vs) < 150:
-    bbox = (4000,4000)
-    layout = 'fruchterman_reingold'
-    for v in g.vs:
-        v['size'] = v['size'] * 1.5
-elif len(g.vs) < 200:
-    bbox = (4000,4000)
-    layout = 'kamada_kawai'
-    for v in g.vs:
-        v['size'] = v['size'] * 2
-else:
-    bbox = (8000,8000)
-    layout = 'fruchterman_reingold'
-
-igraph.plot(g, "net.svg", edge_curved=True, bbox=bbox, margin=64, layout=layout)
+		layout = g.layout(method)
+	positions = dict((name, tuple(xy)) for name, xy in zip(g.vs['name'], layout.coords))
+	if previous is not None:
+		# igraph may return the layout turned or mirrored
+		positions = alignTo(positions, previous)
+	if cache is not None:
+		cache.put(key, positions)
+	return positions
+
+
+# the simulator's "Gen N, M survivors" progress line
+GENERATION = re.compile(r"^Gen (\d+),")
+
+
+def parseNets(lines):
+	""" Stream-parse simulator output. Yield (generation, indiv, edges)
+	    for every "Individual ID" block, where edges is a list of
+	    (source, sink, weight). The generation is that of the last
+	    "Gen N" line before the block; blocks printed before any
+	    "Gen N" line get generation 0.
+	    """
+	generation = 0
+	indiv = None
+	state = None   # None, 'genome' or 'edges'
+	edges = []
+	for line in lines:
+		line = line.strip()
+		# not startswith("Gen "): Gen is also the short name of the
+		# genetic similarity sensor in edge lines
+		header = GENERATION.match(line)
+		if header:
+			generation = int(header.group(1))
+		elif line.startswith("Individual ID "):
+			indiv = int(line[len("Individual ID "):])
+			state = 'genome'
+			edges = []
+		elif state == 'genome':
+			# the hex genome ends with an empty line
+			if not line:
+				state = 'edges'
+		elif state == 'edges':
+			if line.startswith("---"):
+				yield (generation, indiv, edges)
+				state = None
+				continue
+			fields = line.split()
+			if len(fields) == 3:
+				edges.append((fields[0], fields[1], float(fields[2])))
+
+
+def netName(generation, indiv, count, fmt):
+	""" file name of a net; repeated blocks of the same individual
+	    and generation (e.g. the final report) get a suffix """
+	name = "gen-%06d-id-%i" % (generation, indiv)
+	if count > 1:
+		name += "-%i" % count
+	return "%s.%s" % (name, fmt)
+
+
+def renderJob(job):
+	""" render one net in a worker process """
+	cachedir, filename, edges = job
+	try:
+		g = igraph.Graph.TupleList(edges, directed=True, edge_attrs=['weight'])
+		render(g, filename, layoutCache(cachedir) if cachedir else None)
+		return (filename, None)
+	except Exception as e:
+		return (filename, str(e))
+
+
+def batchJobs(lines, outdir, fmt, cachedir):
+	""" yield (cachedir, filename, edges) for every net in 'lines' """
+	seen = {}
+	for generation, indiv, edges in parseNets(lines):
+		key = (generation, indiv)
+		seen[key] = seen.get(key, 0) + 1
+		if edges:
+			yield (cachedir, os.path.join(outdir, netName(generation, indiv, seen[key], fmt)), edges)
+
+
+def renderLog(log, outdir, fmt, jobs, cachedir=None):
+	""" render every net in the simulator output 'log' (- for stdin)
+	    into 'outdir' with a pool of 'jobs' processes. Return the
+	    number of failed renders. """
+	os.makedirs(outdir, exist_ok=True)
+	src = sys.stdin if log == '-' else open(log, 'r')
+	count = 0
+	failed = 0
+	with src:
+		with Pool(jobs) as pool:
+			# the log is parsed while earlier nets are rendered
+			jobiter = batchJobs(src, outdir, fmt, cachedir)
+			for filename, error in pool.imap_unordered(renderJob, jobiter, chunksize=4):
+				count += 1
+				if error:
+					failed += 1
+					print("%s: %s" % (filename, error))
+	print("rendered %i net(s) into %s, %i failed" % (count - failed, outdir, failed))
+	return failed
+
+
+if __name__ == '__main__':
+	argp = argparse.ArgumentParser(description="Render biosim4 neural nets with igraph")
+	argp.add_argument("--log", metavar="FILE", default=None,
+	                  help="captured simulator stdout to render all sample genomes from, - for stdin")
+	argp.add_argument("--outdir", metavar="DIR", default="nets",
+	                  help="directory for the rendered nets (default nets)")
+	argp.add_argument("--format", choices=['svg', 'png', 'pdf'], default='svg',
+	                  help="output format (default svg)")
+	argp.add_argument("-j", "--jobs", type=int, metavar="N", default=os.cpu_count() or 1,
+	                  help="number of render processes (default: number of CPUs)")
+	argp.add_argument("--layout-cache", metavar="DIR", default=None,
+	                  help="layout cache directory (default <outdir>/.layout-cache with --log, none for net.txt)")
+	argp.add_argument("--no-layout-cache", action="store_true", default=False,
+	                  help="compute every layout from scratch")
+	args = argp.parse_args()
 
+	cachedir = args.layout_cache
+	if args.no_layout_cache:
+		cachedir = None
+	elif cachedir is None and args.log is not None:
+		cachedir = os.path.join(args.outdir, ".layout-cache")
 
+	if args.log is None:
+		# load data into a graph
+		g = igraph.Graph.Read_Ncol('net.txt', names=True, weights=True)
+		print(len(g.vs))
+		render(g, "net.svg", LayoutCache(cachedir) if cachedir else None)
+	elif renderLog(args.log, args.outdir, args.format, max(1, args.jobs), cachedir) > 0:
+		sys.exit(1)
@@ -0,0 +1,435 @@
+#!/usr/bin/python3
+
+""" Plot one or more biosim4 epoch logs, for runs of any length.
+
+		tools/graphlog.py logs/epoch-log.txt
+		tools/graphlog.py runs/*/logs/epoch-log.txt --columns survivors,diversity,genomeSize -o images/runs.svg
+		tools/graphlog.py logs/epoch-log.txt -o images/log.png --follow 30
+
+	Unlike tools/graphlog.gp, which plots every line of the log, the
+	records are reduced to a fixed number of buckets of consecutive
+	generations. Each bucket keeps the minimum and maximum of every
+	column with their generations, and the chart draws those extremes
+	in order, so spikes and dips survive however many generations a
+	bucket holds. When the buckets run out, neighbours are merged.
+	--method lttb further reduces the points with the Largest Triangle
+	Three Buckets algorithm.
+
+	The buckets and the read position of every log are kept in a state
+	file next to the chart (<output>.state), so running the tool again
+	during a long simulation only reads the generations appended since
+	the last run. A log that was truncated or rewritten (a new run, or a
+	resumed checkpoint) is read again from the start. --follow keeps
+	redrawing the chart every N seconds until interrupted.
+
+	Every column gets its own panel. The survivors axis is scaled to the
+	population parameter of --config (biosim4.ini by default) or
+	--population, and diversity to 0..1. Several logs are overlaid in
+	each panel, labelled by their directory or --labels.
+
+	The chart is written as SVG; an output name ending in .png is
+	rendered with gnuplot instead. No other packages are needed.
+	"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath("tests")))
+from pylib import epochlog, testlib
+
+STATE_VERSION = 1
+# the columns that can be plotted, all but the generation
+PLOTTED = epochlog.COLUMNS[1:]
+TITLES = {
+	'survivors': "Survivors",
+	'diversity': "Diversity",
+	'genomeSize': "Genome length",
+	'kills': "Kills",
+}
+COLORS = ("#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd",
+          "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf")
+
+
+class Buckets():
+	""" Min/max decimation of a growing epoch log. Each bucket covers
+		'width' consecutive records and is a list
+
+			[count, firstGen, lastGen] + [min, minGen, max, maxGen] per column
+
+		in the order of PLOTTED. When there are more than 'capacity'
+		buckets, pairs of neighbours are merged and the width doubles,
+		so adding a record costs O(1) and the bucket count stays between
+		capacity / 2 and capacity.
+		"""
+
+	def __init__(self, capacity):
+		self.capacity = capacity
+		self.width = 1
+		self.buckets = []
+
+	def add(self, log):
+		""" Add all records parsed by the EpochLog 'log'.
+			"""
+		gens = log['generation']
+		columns = [log[c] for c in PLOTTED]
+		for i in range(len(gens)):
+			gen = gens[i]
+			if not self.buckets or self.buckets[-1][0] >= self.width:
+				if len(self.buckets) == self.capacity:
+					self._merge()
+			if not self.buckets or self.buckets[-1][0] >= self.width:
+				bucket = [0, gen, gen]
+				for column in columns:
+					bucket += [column[i], gen, column[i], gen]
+				self.buckets.append(bucket)
+			bucket = self.buckets[-1]
+			bucket[0] += 1
+			bucket[2] = gen
+			j = 3
+			for column in columns:
+				value = column[i]
+				if value < bucket[j]:
+					bucket[j] = value
+					bucket[j + 1] = gen
+				if value > bucket[j + 2]:
+					bucket[j + 2] = value
+					bucket[j + 3] = gen
+				j += 4
+
+	def _merge(self):
+		merged = []
+		for k in range(0, len(self.buckets), 2):
+			a = self.buckets[k]
+			if k + 1 == len(self.buckets):
+				merged.append(a)
+				break
+			b = self.buckets[k + 1]
+			bucket = [a[0] + b[0], a[1], b[2]]
+			for j in range(3, len(a), 4):
+				low = a if a[j] <= b[j] else b
+				high = a if a[j + 2] >= b[j + 2] else b
+				bucket += [low[j], low[j + 1], high[j + 2], high[j + 3]]
+			merged.append(bucket)
+		self.buckets = merged
+		self.width *= 2
+
+	def points(self, column):
+		""" Return the (generation, value) points of 'column': the
+			minimum and maximum of every bucket, in generation order.
+			"""
+		j = 3 + 4 * PLOTTED.index(column)
+		points = []
+		for bucket in self.buckets:
+			low = (bucket[j + 1], bucket[j])
+			high = (bucket[j + 3], bucket[j + 2])
+			if low[0] == high[0]:
+				points.append(low)
+			else:
+				points.extend(sorted((low, high)))
+		return points
+
+	def maximum(self, column):
+		j = 5 + 4 * PLOTTED.index(column)
+		return max((bucket[j] for bucket in self.buckets), default=0)
+
+	def lastGeneration(self):
+		return self.buckets[-1][2] if self.buckets else 0
+
+	def getState(self):
+		return {'width': self.width, 'buckets': self.buckets}
+
+	def setState(self, state):
+		self.width = state['width']
+		self.buckets = state['buckets']
+		while len(self.buckets) > self.capacity:
+			self._merge()
+
+
+def lttb(points, threshold):
+	""" Reduce 'points', a list of (x, y) tuples ordered by x, to
+		'threshold' points with the Largest Triangle Three Buckets
+		algorithm (Steinarsson 2013).
+		"""
+	if threshold >= len(points) or threshold < 3:
+		return points
+	sampled = [points[0]]
+	every = (len(points) - 2) / (threshold - 2)
+	a = 0
+	for i in range(threshold - 2):
+		# average of the next bucket
+		start = int((i + 1) * every) + 1
+		stop = min(int((i + 2) * every) + 1, len(points))
+		n = stop - start
+		avgX = sum(p[0] for p in points[start:stop]) / n
+		avgY = sum(p[1] for p in points[start:stop]) / n
+		# the point of this bucket with the largest triangle
+		ax, ay = points[a]
+		best = -1.0
+		chosen = a
+		for k in range(int(i * every) + 1, start):
+			area = abs((ax - avgX) * (points[k][1] - ay) - (ax - points[k][0]) * (avgY - ay))
+			if area > best:
+				best = area
+				chosen = k
+		sampled.append(points[chosen])
+		a = chosen
+	sampled.append(points[-1])
+	return sampled
+
+
+class Series():
+	""" One epoch log, its read position and its buckets.
+		"""
+
+	def __init__(self, path, label, capacity):
+		self.path = str(path)
+		self.label = label
+		self.log = epochlog.EpochLog(self.path)
+		self.buckets = Buckets(capacity)
+
+	def getState(self):
+		offset, lastline = self.log.position()
+		state = self.buckets.getState()
+		state.update({'offset': offset, 'lastline': lastline.decode()})
+		return state
+
+	def setState(self, state):
+		self.log.seek((state['offset'], state['lastline'].encode()))
+		self.buckets.setState(state)
+
+	def update(self):
+		""" Read the appended records. Returns their number.
+			"""
+		truncations = self.log.truncations
+		count = self.log.update()
+		if self.log.truncations != truncations:
+			# update() parsed the file again from the start
+			self.buckets = Buckets(self.buckets.capacity)
+		self.buckets.add(self.log)
+		# the records are in the buckets now; keep only the position
+		self.log.seek(self.log.position())
+		return count
+
+
+def logLabel(path):
+	""" Name a log by its directory, or by the directory above a logs/
+		directory, like runs/<test>/logs/epoch-log.txt.
+		"""
+	parent = Path(path).resolve().parent
+	if parent.name == "logs":
+		parent = parent.parent
+	return parent.name
+
+
+def loadState(path, series):
+	""" Restore the saved state of the logs in 'series', if any.
+		"""
+	try:
+		with open(path) as f:
+			state = json.load(f)
+	except (OSError, ValueError):
+		return
+	if state.get('version') != STATE_VERSION:
+		return
+	for s in series:
+		saved = state['logs'].get(os.path.abspath(s.path))
+		if saved is not None:
+			s.setState(saved)
+
+
+def saveState(path, series):
+	state = {
+		'version': STATE_VERSION,
+		'logs': dict((os.path.abspath(s.path), s.getState()) for s in series),
+	}
+	tmppath = "%s.%i.tmp" % (path, os.getpid())
+	with open(tmppath, 'w') as f:
+		json.dump(state, f, separators=(',', ':'))
+	os.replace(tmppath, path)
+
+
+def niceCeiling(value):
+	""" Round 'value' up to 1, 2 or 5 times a power of ten.
+		"""
+	if value <= 0:
+		return 1
+	power = 10 ** math.floor(math.log10(value))
+	for m in (1, 2, 5, 10):
+		if value <= m * power:
+			return m * power
+
+
+def ticks(top, count=5):
+	step = niceCeiling(top / count)
+	return [k * step for k in range(int(top / step + 1e-9) + 1)]
+
+
+def axisLimit(column, series, population):
+	""" Return the upper end of the y axis of 'column'.
+		"""
+	seen = max((s.buckets.maximum(column) for s in series), default=0)
+	if column == 'diversity':
+		return max(1.0, seen)
+	if column == 'survivors' and population:
+		return max(population, seen)
+	return niceCeiling(seen)
+
+
+def panelPoints(series, column, method, threshold):
+	points = series.buckets.points(column)
+	if method == 'lttb':
+		points = lttb(points, threshold)
+	return points
+
+
+def formatTick(value):
+	return ("%g" % value) if value < 1e6 else ("%.3g" % value)
+
+
+def writeSvg(output, series, columns, limits, xmax, args):
+	width, height = args.width, args.height
+	left, right, top, bottom = 70, 20, 30, 30
+	panel = (height - 10) / len(columns)
+	out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i" font-family="sans-serif" font-size="12">' % (width, height),
+	       '<rect width="100%" height="100%" fill="white"/>']
+	plotW = width - left - right
+	for n, column in enumerate(columns):
+		y0 = n * panel + top
+		plotH = panel - top - bottom
+		ymax = limits[column]
+		out.append('<text x="%i" y="%.1f" font-weight="bold">%s</text>' % (left, y0 - 10, escape(TITLES[column])))
+		for t in ticks(ymax):
+			y = y0 + plotH - t / ymax * plotH
+			out.append('<line x1="%i" y1="%.1f" x2="%i" y2="%.1f" stroke="#ddd"/>' % (left, y, left + plotW, y))
+			out.append('<text x="%i" y="%.1f" text-anchor="end">%s</text>' % (left - 6, y + 4, formatTick(t)))
+		for t in ticks(xmax, 10):
+			x = left + t / xmax * plotW
+			out.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="#ddd"/>' % (x, y0, x, y0 + plotH))
+			out.append('<text x="%.1f" y="%.1f" text-anchor="middle">%s</text>' % (x, y0 + plotH + 16, formatTick(t)))
+		out.append('<rect x="%i" y="%.1f" width="%i" height="%.1f" fill="none" stroke="black"/>' % (left, y0, plotW, plotH))
+		for k, s in enumerate(series):
+			points = panelPoints(s, column, args.method, args.points)
+			if not points:
+				continue
+			coords = " ".join("%.1f,%.1f" % (left + g / xmax * plotW, y0 + plotH - min(v, ymax) / ymax * plotH) for g, v in points)
+			out.append('<polyline fill="none" stroke="%s" stroke-width="1.5" points="%s"/>' % (COLORS[k % len(COLORS)], coords))
+		if len(series) > 1 or series[0].label:
+			for k, s in enumerate(series):
+				out.append('<text x="%i" y="%.1f" fill="%s" text-anchor="end">%s</text>'
+				           % (left + plotW - 8, y0 + 16 + 14 * k, COLORS[k % len(COLORS)], escape(s.label)))
+	out.append('</svg>')
+	tmppath = "%s.%i.tmp" % (output, os.getpid())
+	with open(tmppath, 'w') as f:
+		f.write("\n".join(out) + "\n")
+	os.replace(tmppath, output)
+
+
+def writePng(output, series, columns, limits, xmax, args):
+	""" Render the decimated points with gnuplot.
+		"""
+	with tempfile.TemporaryDirectory() as tmpdir:
+		script = ['set term png size %i, %i' % (args.width, args.height),
+		          'set output "%s"' % output,
+		          'set grid',
+		          'set xrange [0:%s]' % xmax,
+		          'set multiplot layout %i, 1' % len(columns)]
+		for column in columns:
+			plots = []
+			for k, s in enumerate(series):
+				data = os.path.join(tmpdir, "%i-%s.dat" % (k, column))
+				with open(data, 'w') as f:
+					f.writelines("%s %s\n" % point for point in panelPoints(s, column, args.method, args.points))
+				plots.append('"%s" using 1:2 with lines lw 2 linecolor rgb "%s" title "%s"'
+				             % (data, COLORS[k % len(COLORS)], s.label.replace('"', "'")))
+			script += ['set title "%s"' % TITLES[column],
+			           'set yrange [0:%s]' % limits[column],
+			           'plot ' + ", ".join(plots)]
+		script.append('unset multiplot')
+		subprocess.run(["gnuplot"], input="\n".join(script) + "\n", text=True, check=True)
+
+
+def plot(output, series, columns, population, args):
+	xmax = niceCeiling(max(1, max(s.buckets.lastGeneration() for s in series)))
+	limits = dict((c, axisLimit(c, series, population)) for c in columns)
+	if output.endswith(".png"):
+		writePng(output, series, columns, limits, xmax, args)
+	else:
+		writeSvg(output, series, columns, limits, xmax, args)
+
+
+def main(argv=None):
+	root = Path(__file__).resolve().parents[1]
+	argp = argparse.ArgumentParser(description="Plot biosim4 epoch logs of any length")
+	argp.add_argument("logs", nargs="*", default=["logs/epoch-log.txt"], help="epoch logs (default logs/epoch-log.txt)")
+	argp.add_argument("-o", "--output", default="images/log.svg", help="chart file, .svg or .png (default images/log.svg)")
+	argp.add_argument("--columns", default="survivors,diversity", help="comma-separated columns to plot, of %s" % ", ".join(PLOTTED))
+	argp.add_argument("--labels", default=None, help="comma-separated labels of the logs (default: their directories)")
+	argp.add_argument("--config", default=str(root.joinpath("biosim4.ini")), help="config file to read the population from")
+	argp.add_argument("--population", type=int, default=None, help="survivors axis maximum (default: population of --config)")
+	argp.add_argument("--method", choices=("minmax", "lttb"), default="minmax", help="decimation (default minmax)")
+	argp.add_argument("--points", type=int, default=None, help="points per line with --method lttb (default: width / 2)")
+	argp.add_argument("--buckets", type=int, default=None, help="buckets per log (default: width / 2)")
+	argp.add_argument("--width", type=int, default=2000, help="chart width in pixels (default 2000)")
+	argp.add_argument("--height", type=int, default=None, help="chart height in pixels (default 300 per column)")
+	argp.add_argument("--state", default=None, help="state file (default: <output>.state)")
+	argp.add_argument("--no-state", action="store_true", help="read the logs from the start and keep no state")
+	argp.add_argument("--follow", type=float, default=None, metavar="SECONDS", help="redraw every SECONDS until interrupted")
+	args = argp.parse_args(argv)
+
+	columns = args.columns.split(",")
+	for column in columns:
+		if column not in PLOTTED:
+			argp.error("unknown column %s" % column)
+	if args.labels is not None:
+		labels = args.labels.split(",")
+		if len(labels) != len(args.logs):
+			argp.error("--labels needs one label per log")
+	elif len(args.logs) > 1:
+		labels = [logLabel(log) for log in args.logs]
+	else:
+		labels = [""]
+	args.height = args.height or 300 * len(columns)
+	args.buckets = args.buckets or args.width // 2
+	args.points = args.points or args.width // 2
+
+	if args.output.endswith(".png") and shutil.which("gnuplot") is None:
+		print("PNG output requires gnuplot on the PATH, write .svg instead")
+		return 1
+
+	population = args.population
+	if population is None and os.path.exists(args.config):
+		population = int(testlib.readDefaultParams(args.config).get('population', 0)) or None
+
+	series = [Series(log, label, args.buckets) for log, label in zip(args.logs, labels)]
+	state = None if args.no_state else (args.state or args.output + ".state")
+	if state:
+		loadState(state, series)
+	os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+	while True:
+		new = sum(s.update() for s in series)
+		if new or args.follow is None or not os.path.exists(args.output):
+			plot(args.output, series, columns, population, args)
+			if state:
+				saveState(state, series)
+		if args.follow is None:
+			break
+		try:
+			time.sleep(args.follow)
+		except KeyboardInterrupt:
+			break
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
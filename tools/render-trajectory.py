@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+
+""" Render the trajectory files the simulator writes with
+	saveTrajectory = true (imageDir/gen-NNNNNN.traj) to PNG frames
+	and, if ffmpeg is installed, to one video per generation.
+
+		tools/render-trajectory.py images/gen-000100.traj
+		tools/render-trajectory.py images --outdir frames --scale 4 -j 8 --video
+
+	Frames are drawn like the simulator's own video frames: barriers
+	as grey squares and agents as discs colored by their genome, on a
+	white arena scaled by --scale pixels per grid cell. The frames of
+	every file are split into chunks that are rendered by a pool of
+	worker processes; each worker replays the deltas up to the start
+	of its chunk, which costs far less than drawing a frame.
+
+	Requires numpy. Reads the files with tests/pylib/trajectory.py.
+	"""
+
+import argparse
+import math
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import zlib
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath("tests")))
+from pylib import trajectory
+
+BARRIER = 0x88
+# makeGeneticColor() values are mapped as in saveOneFrameImmed()
+MAXCOLOR = 0xb0
+MAXLUMA = 0xb0
+
+
+def agentColors(c):
+	""" Map makeGeneticColor() values to an (n, 3) uint8 RGB array.
+		"""
+	c = c.astype(np.int64)
+	rgb = np.stack([c, (c & 0x1f) << 3, (c & 7) << 5], axis=1) & 0xff
+	luma = (3 * rgb[:, 0] + rgb[:, 2] + 4 * rgb[:, 1]) // 8
+	bright = (luma > MAXLUMA)[:, None] & (rgb > MAXCOLOR)
+	rgb = np.where(bright, rgb % MAXCOLOR, rgb)
+	return rgb.astype(np.uint8)
+
+
+def disc(radius):
+	""" Return the (dy, dx) offsets of the pixels of a disc.
+		"""
+	r = int(radius)
+	dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+	inside = dx * dx + dy * dy <= radius * radius
+	return dy[inside], dx[inside]
+
+
+def drawFrame(traj, state, scale, offsets):
+	""" Return an (height, width, 3) uint8 image of one state.
+		"""
+	height = traj.sizeY * scale
+	width = traj.sizeX * scale
+	image = np.full((height, width, 3), 255, dtype=np.uint8)
+
+	# barriers, as the rectangles drawn by saveOneFrameImmed(); as
+	# int16 scalars, x * scale would wrap on large images
+	for x, y in traj.barriers.astype(np.int64):
+		x0 = max(0, x * scale - scale // 2)
+		y0 = max(0, (traj.sizeY - y - 1) * scale - scale // 2)
+		image[y0:(traj.sizeY - y) * scale + 1, x0:(x + 1) * scale + 1] = BARRIER
+
+	alive = np.flatnonzero(state['alive'])
+	if len(alive):
+		dy, dx = offsets
+		cx = state['x'][alive].astype(np.int64) * scale
+		cy = (traj.sizeY - state['y'][alive].astype(np.int64) - 1) * scale
+		px = (cx[:, None] + dx[None, :]).ravel()
+		py = (cy[:, None] + dy[None, :]).ravel()
+		colors = np.repeat(agentColors(state['color'][alive]), len(dx), axis=0)
+		keep = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+		image[py[keep], px[keep]] = colors[keep]
+
+	return image
+
+
+def writePng(path, image):
+	""" Write an RGB uint8 image as PNG with zlib only.
+		"""
+	height, width = image.shape[:2]
+	# filter type 0 (none) in front of every row
+	raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+	raw[:, 1:] = image.reshape(height, width * 3)
+
+	def chunk(kind, data):
+		return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+	png = b"\x89PNG\r\n\x1a\n"
+	png += chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+	png += chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+	png += chunk(b"IEND", b"")
+	tmppath = "%s.%i.tmp" % (path, os.getpid())
+	with open(tmppath, 'wb') as f:
+		f.write(png)
+	os.replace(tmppath, path)
+
+
+def frameName(generation, step):
+	return "frame-%06d-%06d.png" % (generation, step)
+
+
+def renderChunk(job):
+	""" Render frames [start, stop) of one file. Returns the count.
+		"""
+	path, outdir, start, stop, scale, radius = job
+	traj = trajectory.Trajectory(path)
+	offsets = disc(radius)
+	count = 0
+	for step, state in traj.replay(start, stop):
+		writePng(os.path.join(outdir, frameName(traj.generation, step)), drawFrame(traj, state, scale, offsets))
+		count += 1
+	return count
+
+
+def makeVideo(traj, outdir, fps):
+	""" Encode the frames of one generation with ffmpeg. Returns the
+		video path, or None if ffmpeg failed.
+		"""
+	video = os.path.join(outdir, "gen-%06d.mp4" % traj.generation)
+	cmd = ["ffmpeg", "-loglevel", "error", "-y", "-framerate", str(fps),
+	       "-start_number", str(traj.steps[0]),
+	       "-i", os.path.join(outdir, "frame-%06d-%%06d.png" % traj.generation),
+	       "-frames:v", str(len(traj)),
+	       "-c:v", "libx264", "-pix_fmt", "yuv420p",
+	       # libx264 needs even dimensions
+	       "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white",
+	       video]
+	if subprocess.run(cmd).returncode != 0:
+		return None
+	return video
+
+
+def main(argv=None):
+	argp = argparse.ArgumentParser(description="Render biosim4 trajectory files to PNG frames and videos")
+	argp.add_argument("paths", nargs="+", help="gen-NNNNNN.traj files, or directories holding them")
+	argp.add_argument("--outdir", default=None, help="output directory (default: next to each file)")
+	argp.add_argument("--scale", type=int, default=8, help="pixels per grid cell (default 8, like displayScale)")
+	argp.add_argument("--radius", type=float, default=None, help="agent radius in pixels (default scale / 2)")
+	argp.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+	argp.add_argument("--video", action="store_true", help="also encode one video per generation with ffmpeg")
+	argp.add_argument("--fps", type=int, default=25, help="video frame rate (default 25)")
+	argp.add_argument("--keep-frames", action="store_true", help="with --video, keep the PNG frames")
+	args = argp.parse_args(argv)
+
+	files = []
+	for p in args.paths:
+		files.extend(trajectory.listTrajectories(p) if os.path.isdir(p) else [Path(p)])
+	if not files:
+		print("no trajectory files found")
+		return 1
+	if args.video and shutil.which("ffmpeg") is None:
+		print("--video requires ffmpeg on the PATH")
+		return 1
+
+	radius = args.radius if args.radius is not None else args.scale / 2.0
+	jobs = []
+	trajs = []
+	for path in files:
+		traj = trajectory.Trajectory(path)
+		outdir = args.outdir or str(path.parent)
+		os.makedirs(outdir, exist_ok=True)
+		trajs.append((traj, outdir))
+		size = max(1, math.ceil(len(traj) / max(1, args.jobs)))
+		for start in range(0, len(traj), size):
+			jobs.append((str(path), outdir, start, start + size, args.scale, radius))
+
+	with Pool(max(1, args.jobs)) as pool:
+		frames = sum(pool.imap_unordered(renderChunk, jobs))
+	print("%i frame(s) of %i generation(s) rendered" % (frames, len(files)))
+
+	if args.video:
+		for traj, outdir in trajs:
+			video = makeVideo(traj, outdir, args.fps)
+			if video is None:
+				print("ffmpeg failed for generation %i" % traj.generation)
+				return 1
+			print(video)
+			if not args.keep_frames:
+				for step in traj.steps:
+					os.unlink(os.path.join(outdir, frameName(traj.generation, step)))
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())